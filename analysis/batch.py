@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Batching of the small per configuration tasks in ``dodo.py``.
+
+Large ensembles have tens of thousands of configurations and several tasks
+for each of them. The bookkeeping of doit then takes longer than the work.
+Here the tasks of a chunk of configurations are combined into a single task
+which has all the actions and targets of the individual tasks. The chunks are
+formed by the configuration number, so new configurations only change the
+last chunk and a changed input file only invalidates its own chunk.
+'''
+
+import collections
+import re
+
+
+def config_number(path):
+    '''
+    :return: The number in ``config-1234`` of the file name or ``None``.
+    '''
+    m = re.search(r'config-(\d+)', path)
+    if m:
+        return int(m.group(1))
+
+
+def group_chunks(paths, chunk_size):
+    '''
+    Groups files into chunks of ``chunk_size`` consecutive configuration
+    numbers. Files without a configuration number are chunked by their
+    position in the sorted list instead.
+
+    :return: List of tuples ``(index, paths)`` sorted by the index.
+    '''
+    chunks = collections.defaultdict(list)
+    without_number = []
+    for path in sorted(paths):
+        number = config_number(path)
+        if number is None:
+            without_number.append(path)
+        else:
+            chunks[number // chunk_size].append(path)
+
+    result = [('{:06d}'.format(index), chunk) for index, chunk in sorted(chunks.items())]
+    for i in range(0, len(without_number), chunk_size):
+        result.append(('other-{:06d}'.format(i // chunk_size), without_number[i:i + chunk_size]))
+    return result
+
+
+def merge_tasks(name, tasks, **kwargs):
+    '''
+    Combines several task dictionaries into one.
+
+    The actions are run in the given order. Files that are created by one of
+    the tasks are no dependencies of the combined task, such that a chain of
+    transformations can be put into the same chunk.
+
+    :param kwargs: Further entries of the task dictionary, like ``basename``.
+    '''
+    actions = []
+    targets = []
+    file_dep = []
+    uptodate = []
+
+    for task in tasks:
+        actions += task['actions']
+        targets += task.get('targets', [])
+        file_dep += task.get('file_dep', [])
+        uptodate += task.get('uptodate', [])
+
+    created = set(targets)
+    merged = {
+        'actions': actions,
+        'name': name,
+        'targets': targets,
+        'file_dep': sorted(set(path for path in file_dep if path not in created)),
+        'uptodate': uptodate,
+    }
+    merged.update(kwargs)
+    return merged
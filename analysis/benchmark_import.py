@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Startup time of ``dodo.py``.
+
+Importing ``dodo.py`` and listing the tasks is measured in fresh processes,
+by default in an empty directory. The program fails if the median time
+exceeds the budget or if one of the large libraries is imported already at
+startup, they have to be loaded with ``lazy.lazy_import``.
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+heavy_modules = ['matplotlib', 'scipy', 'pandas']
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+import_script = '''
+import json, sys
+sys.path.insert(0, {here!r})
+import dodo
+print(json.dumps(sorted(set(name.split('.')[0] for name in sys.modules))))
+'''
+
+
+def time_command(command, cwd):
+    start = time.perf_counter()
+    output = subprocess.check_output(command, cwd=cwd)
+    return time.perf_counter() - start, output
+
+
+def measure(runs_dir, repetitions):
+    '''
+    :return: Tuple with the median times of the import and of ``doit list``
+        and the set of top level modules after the import.
+    '''
+    import_times = []
+    list_times = []
+    modules = set()
+
+    for i in range(repetitions):
+        duration, output = time_command([sys.executable, '-c', import_script.format(here=here)], runs_dir)
+        import_times.append(duration)
+        modules = set(json.loads(output.decode().splitlines()[-1]))
+
+        duration, output = time_command([sys.executable, '-m', 'doit', 'list', '--all',
+                                         '-f', os.path.join(here, 'dodo.py'), '--dir', runs_dir], runs_dir)
+        list_times.append(duration)
+
+    return statistics.median(import_times), statistics.median(list_times), modules
+
+
+def main():
+    options = _parse_args()
+
+    if options.runs is None:
+        with tempfile.TemporaryDirectory() as runs_dir:
+            import_time, list_time, modules = measure(runs_dir, options.repetitions)
+    else:
+        import_time, list_time, modules = measure(os.path.abspath(options.runs), options.repetitions)
+
+    print('Import of dodo.py: {:.3f} s'.format(import_time))
+    print('doit list:         {:.3f} s (budget {:.3f} s)'.format(list_time, options.budget))
+
+    failed = False
+    loaded = sorted(modules.intersection(heavy_modules))
+    if len(loaded) > 0:
+        print('Imported at startup: {}'.format(', '.join(loaded)))
+        failed = True
+    if list_time > options.budget:
+        print('The startup time exceeds the budget.')
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Measure the startup time of dodo.py and check it against a budget.')
+    parser.add_argument('--runs', help='Directory with runs to list the tasks for. Default: an empty directory')
+    parser.add_argument('--budget', type=float, default=0.5, help='Maximum time for `doit list` in seconds. Default: %(default)s')
+    parser.add_argument('--repetitions', type=int, default=5, help='Default: %(default)s')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Benchmark of the solver line matching in ``extractors.logfile``.
+
+A synthetic update block is parsed with the ``bytes`` pattern dispatcher that
+``parse_update_block`` runs over the raw bytes of the block and with the old
+loop that tried every solver pattern on every line. The throughput of the
+whole ``parse_update_block``, which also scans the ``QDP:FlopCount`` kernels
+and the phases, is shown as well. The script exits with a non-zero status if
+the speedup of the solver matching is below ``--min-speedup``.
+'''
+
+import argparse
+import collections
+import sys
+import time
+
+import extractors.logfile
+
+
+filler_lines = [
+    'CLOV_LINOP: Time spent in clov deriv (total) = 0\n',
+    'CLOV_LINOP: Time spent in clov apply/invapply (total) = 0.125204\n',
+    'TwoFlavWilson4DMonomial: resetting Predictor after field refresh\n',
+    'LastSolution4DChronoPredictor: resetting\n',
+    'FORCE: monomial=TwoFlavorExactRatioConvConvWilsonTypeFermMonomial F_sq=2.3456 F_avg=0.1234 F_max=1.2345\n',
+    'Monitoring: w_plaq = 0.5912345678 s_plaq = 0.5913 t_plaq = 0.5911\n',
+    'OMP: Info #171: KMP_AFFINITY: OS proc 12 maps to package 0 core 4\n',
+    'InvCG2: starting\n',
+    '2Flav::invert,  n_count = 37\n',
+    'CG_SOLVER_TIME: 2.855817 sec\n',
+]
+
+solver_lines = [
+    'QDP:FlopCount:invcg2 Performance/CPU: t=2.708439(s) Flops=4107718656 => 1516.63694696465 Mflops/cpu.\n',
+    'QDP:FlopCount:invcg2 Total performance:  48521.4665978852 Mflops = 48.5214665978852 Gflops = 0.0485214665978852 Tflops\n',
+    'CG_SOLVER: 37 iterations. Rsd = 6.08991207156025e-09 Relative Rsd = 6.54430345664521e-13\n',
+    'MInvCG2: 36 iterations\n',
+    'QDP:FlopCount:minvcg Total performance:  48774.1790785814 Mflops = 48.7741790785814 Gflops = 0.0487741790785814 Tflops\n',
+    'QPHIX_CLOVER_CG_SOLVER: 120 iters, rsd_sq_final=1.2e-18\n',
+    'QPHIX_CLOVER_CG_SOLVER: || r || / || b || = 3.30e-10\n',
+    'QPHIX_CLOVER_CG_SOLVER: Iters=120 Cycles=0 Time=1.2 (s) Performance=230.5 GFLOPS\n',
+    'QPHIX_CLOVER_MULTI_SHIFT_CG_MDAGM_SOLVER: Iters=300 Time=2.2 (s) Performance=201.5 GFLOPS\n',
+    'shift[0]  Actual || r || / || b || = 1.5e-09\n',
+]
+
+
+def make_synthetic_block(solves, filler_per_solve):
+    lines = []
+    for i in range(solves):
+        for j in range(filler_per_solve):
+            lines.append(filler_lines[(i + j) % len(filler_lines)])
+        lines.append(solver_lines[i % len(solver_lines)])
+    return lines
+
+
+def reference_parse_update_block(lines):
+    '''
+    The matching loop as it was before the dispatcher, kept for comparison.
+    '''
+    solvers = collections.defaultdict(lambda: collections.defaultdict(list))
+
+    for line in lines:
+        for solver, pattern in extractors.logfile.patterns_gflops.items():
+            m = pattern.match(line)
+            if m:
+                solvers[solver]['gflops'].append(float(m.group(1)))
+
+        for solver, pattern in extractors.logfile.patterns_iterations.items():
+            m = pattern.match(line)
+            if m:
+                solvers[solver]['iters'].append(float(m.group(1)))
+
+        for solver, pattern in extractors.logfile.patterns_resiuals.items():
+            m = pattern.search(line)
+            if m:
+                solvers[solver]['residuals'].append(float(m.group(1)))
+
+    return {'solvers': solvers}
+
+
+def dispatcher_parse_update_block(lines):
+    '''
+    Only the solver part of ``extractors.logfile.parse_update_block``.
+    '''
+    solvers = collections.defaultdict(lambda: collections.defaultdict(list))
+    extractors.logfile.solver_dispatcher_bytes.feed_text(''.join(lines).encode(), solvers)
+    return {'solvers': solvers}
+
+
+def lines_per_second(function, lines, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(lines)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return len(lines) / best
+
+
+def main():
+    options = _parse_args()
+
+    lines = make_synthetic_block(options.solves, options.filler)
+
+    expected = reference_parse_update_block(lines)
+    assert dispatcher_parse_update_block(lines) == expected
+    assert extractors.logfile.parse_update_block(lines)['solvers'] == expected['solvers']
+
+    old = lines_per_second(reference_parse_update_block, lines, options.repeat)
+    new = lines_per_second(dispatcher_parse_update_block, lines, options.repeat)
+    full = lines_per_second(extractors.logfile.parse_update_block, lines, options.repeat)
+    speedup = new / old
+
+    print('Lines:        {:d}'.format(len(lines)))
+    print('Reference:    {:.0f} lines/s'.format(old))
+    print('Dispatcher:   {:.0f} lines/s'.format(new))
+    print('Whole block:  {:.0f} lines/s'.format(full))
+    print('Speedup:      {:.2f}'.format(speedup))
+
+    if speedup < options.min_speedup:
+        print('Speedup is below the required {:g}.'.format(options.min_speedup))
+        sys.exit(1)
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Benchmark the solver line matching of the logfile extractor.')
+    parser.add_argument('--solves', type=int, default=20000, help='Number of solver lines. Default: %(default)s')
+    parser.add_argument('--filler', type=int, default=10, help='Non-solver lines per solver line. Default: %(default)s')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions, the best is taken. Default: %(default)s')
+    parser.add_argument('--min-speedup', type=float, default=5.0, help='Required speedup. Default: %(default)s')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
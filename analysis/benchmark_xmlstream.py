@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Benchmark of the streaming XML extraction in ``extractors.xmlfile``.
+
+A synthetic Chroma ``out.xml.gz`` of the requested size is written and all
+keys of ``extractors.xmlfile.bits`` are extracted from it. Every measurement
+runs in a fresh process such that its peak memory can be reported. With
+``--compare`` the file is also loaded with ``etree.parse`` as the extractors
+used to do, this is only feasible for small sizes.
+'''
+
+import argparse
+import concurrent.futures
+import gzip
+import os
+import resource
+import time
+
+from lxml import etree
+
+import extractors.xmlfile
+
+
+header = '''<?xml version="1.0"?>
+<hmc>
+  <Input><Params><HMCTrj><MDIntegrator><tau0>1</tau0><Integrator><n_steps>12</n_steps></Integrator></MDIntegrator></HMCTrj></Params></Input>
+  <doHMC>
+    <MCUpdates>
+'''
+
+footer = '''    </MCUpdates>
+  </doHMC>
+</hmc>
+'''
+
+update_template = '''      <elem>
+        <Update>
+          <update_no>{update_no}</update_no>
+          <HMCTrajectory>
+            <WarmUpP>false</WarmUpP>
+{leaps}            <deltaH>{delta_h}</deltaH>
+            <DeltaDeltaH>1e-09</DeltaDeltaH>
+            <AcceptP>true</AcceptP>
+          </HMCTrajectory>
+          <seconds_for_trajectory>{seconds}</seconds_for_trajectory>
+          <InlineObservables>
+            <elem><Plaquette><update_no>{update_no}</update_no><w_plaq>0.5912</w_plaq></Plaquette></elem>
+          </InlineObservables>
+        </Update>
+      </elem>
+'''
+
+leap_template = '''            <leapP><dt>0.0833</dt><AbsHamiltonianForce><ForcesByMonomial><elem><GaugeMonomial><Forces><F_sq>1.2</F_sq><F_avg>0.3</F_avg><F_max>1.1</F_max></Forces></GaugeMonomial></elem></ForcesByMonomial></AbsHamiltonianForce></leapP>
+'''
+
+
+def write_synthetic_xml(path, size, leaps_per_update):
+    '''
+    Writes updates until the uncompressed size is reached.
+
+    :return: Number of updates.
+    '''
+    leaps = leap_template * leaps_per_update
+    written = 0
+    update_no = 0
+
+    with gzip.open(path, 'wt', compresslevel=1) as f:
+        written += f.write(header)
+        while written < size:
+            update_no += 1
+            written += f.write(update_template.format(
+                update_no=update_no, leaps=leaps, delta_h=0.01 * (update_no % 7), seconds=100 + update_no % 13))
+        f.write(footer)
+
+    return update_no
+
+
+def max_rss_mib():
+    # On Linux the maximum resident set size is given in KiB.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_streaming(path):
+    start = time.perf_counter()
+    extracted = extractors.xmlfile.extract_bits(path, extractors.xmlfile.bits)
+    duration = time.perf_counter() - start
+    return duration, len(extracted['deltaH'][0]), max_rss_mib()
+
+
+def run_tree(path):
+    start = time.perf_counter()
+    tree = etree.parse(path)
+    count = len(tree.xpath('//Update'))
+    duration = time.perf_counter() - start
+    return duration, count, max_rss_mib()
+
+
+def measure(function, path):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(function, path).result()
+
+
+def main():
+    options = _parse_args()
+
+    size = int(options.size * 1024**3)
+
+    if not os.path.isfile(options.path) or options.regenerate:
+        print('Writing {:.2f} GiB of XML to {} …'.format(options.size, options.path))
+        write_synthetic_xml(options.path, size, options.leaps)
+
+    modes = [('Streaming', run_streaming)]
+    if options.compare:
+        modes.append(('etree.parse', run_tree))
+
+    for name, function in modes:
+        duration, count, peak = measure(function, options.path)
+        print('{:12s} {:8d} updates in {:7.1f} s, {:6.1f} MiB/s, peak memory {:7.1f} MiB'.format(
+            name, count, duration, size / 1024**2 / duration, peak))
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Benchmark the streaming extraction from large XML files.')
+    parser.add_argument('--path', default='benchmark-out.xml.gz', help='Synthetic file, it is reused if it exists. Default: %(default)s')
+    parser.add_argument('--size', type=float, default=5.0, help='Uncompressed size in GiB. Default: %(default)s')
+    parser.add_argument('--leaps', type=int, default=200, help='Force evaluations per update. Default: %(default)s')
+    parser.add_argument('--regenerate', action='store_true', help='Write the synthetic file even if it exists.')
+    parser.add_argument('--compare', action='store_true', help='Also load the whole tree with etree.parse.')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
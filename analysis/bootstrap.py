@@ -2,9 +2,12 @@
 
 import random
 
-import matplotlib.pyplot as pl
 import numpy as np
 
+from lazy import lazy_import
+
+pl = lazy_import('matplotlib.pyplot')
+
 
 class Boot(object):
     def __init__(self, dist):
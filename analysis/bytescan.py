@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Scanning of log files on the level of bytes.
+
+Only a few percent of the lines in a Chroma log are of interest. Instead of
+decoding every line into a ``str`` and running the regular expressions on it,
+the patterns are compiled as ``bytes`` patterns and run over large buffers.
+Only the captured groups are converted afterwards, ``int`` and ``float``
+accept ``bytes`` directly.
+
+Uncompressed files are mapped into memory with ``mmap``, gzip compressed files
+are decompressed in chunks that end at a line break. No pattern may match
+across a line break, then the chunking does not change the results. A gzip
+file that is still being written ends in the middle of the stream, it is read
+as far as it can be decompressed.
+'''
+
+import heapq
+import mmap
+import os
+import re
+
+import zran
+
+
+CHUNK_SIZE = 16 * 1024**2
+
+
+def compile_pattern(pattern, anchored=False):
+    '''
+    Compiles a ``str`` pattern into a ``bytes`` pattern.
+
+    :param bool anchored: Only match at the beginning of a line, like
+        ``re.match`` on a single line.
+    '''
+    if isinstance(pattern, str):
+        pattern = pattern.encode()
+    if anchored:
+        return re.compile(rb'(?m)^(?:' + pattern + rb')')
+    else:
+        return re.compile(pattern)
+
+
+def compile_patterns(patterns, anchored=False):
+    return {name: compile_pattern(pattern, anchored) for name, pattern in patterns.items()}
+
+
+def iter_buffers(path, offset=0, complete_lines=False, chunk_size=CHUNK_SIZE):
+    '''
+    Yields the contents of the file as buffers that end at line breaks.
+
+    The buffers may be a memory map of the whole file, so no references to
+    them may be kept after the next one has been requested.
+
+    :param int offset: Byte offset in the (decompressed) file to start at.
+    :param bool complete_lines: Leave out a last line that has no line break
+        yet because it is still being written.
+    '''
+    if not path.endswith('.gz') and offset == 0 and not complete_lines:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mm
+            finally:
+                try:
+                    mm.close()
+                except BufferError:
+                    # Some match object still refers to the map, it will be
+                    # closed once that is gone.
+                    pass
+        return
+
+    if path.endswith('.gz'):
+        f = zran.GzipReader(path, spacing=None)
+    else:
+        f = open(path, 'rb')
+    with f:
+        f.seek(offset)
+        yield from iter_file_buffers(f, complete_lines, chunk_size)
+
+
+def iter_file_buffers(f, complete_lines=False, chunk_size=CHUNK_SIZE):
+    '''
+    Yields the contents of an open file from its current position as buffers
+    that end at line breaks.
+    '''
+    rest = b''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        chunk = rest + chunk
+        cut = chunk.rfind(b'\n') + 1
+        rest = chunk[cut:]
+        if cut > 0:
+            yield chunk[:cut]
+    if rest and not complete_lines:
+        yield rest
+
+
+def _tag_matches(name, matches):
+    for m in matches:
+        yield m.start(), name, m
+
+
+def scan(buf, patterns):
+    '''
+    Finds all matches of several patterns in a buffer.
+
+    :param dict patterns: Compiled ``bytes`` patterns by name.
+    :return: Generator of tuples ``(name, match)`` in the order of the
+        position in the buffer.
+    '''
+    iterators = [_tag_matches(name, pattern.finditer(buf)) for name, pattern in patterns.items()]
+    for start, name, m in heapq.merge(*iterators):
+        yield name, m
+
+
+def scan_file(path, patterns):
+    '''
+    Finds all matches of several patterns in a log file.
+
+    :param dict patterns: Compiled ``bytes`` patterns by name.
+    :return: Generator of tuples ``(name, groups)`` in the order of the
+        position in the file. The groups are still ``bytes``.
+    '''
+    for buf in iter_buffers(path):
+        for name, m in scan(buf, patterns):
+            yield name, m.groups()
@@ -0,0 +1,360 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Content addressed cache for the results of the extractors.
+
+The output files of an extractor are stored under a key that is derived from
+the contents of the input files, the source code of the extractor module and
+of all modules of this directory that it uses, and the parameters of the
+call. Rebuilding a run directory on another machine or
+after cleaning ``extract`` then only copies the files from the cache.
+
+The hash of an input file is remembered for its path together with the size,
+modification time and inode. As long as these do not change, a cache hit does
+not read the input file at all. Copying the cache directory to another machine
+transfers the results, the input files are hashed once there.
+
+The cache lives in ``~/.cache/hmc-analysis`` unless ``HMC_ANALYSIS_CACHE`` is
+set, setting it to ``off`` disables the cache. The least recently used entries
+and remembered hashes are removed once the size exceeds
+``HMC_ANALYSIS_CACHE_SIZE`` bytes, 10 GiB by default. Each process scans the
+cache once and then keeps track of the size of the entries that it adds.
+'''
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+
+DEFAULT_MAX_SIZE = 10 * 1024**3
+
+# The automatic eviction shrinks the cache to this fraction of the limit, so
+# that the next one is only due after a while.
+EVICT_FRACTION = 0.9
+
+
+def cache_dir():
+    '''
+    :return: Path of the cache directory or ``None`` if it is disabled.
+    '''
+    path = os.environ.get('HMC_ANALYSIS_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'hmc-analysis'))
+    if path in ('', 'off'):
+        return None
+    return path
+
+
+def max_size():
+    return int(os.environ.get('HMC_ANALYSIS_CACHE_SIZE', DEFAULT_MAX_SIZE))
+
+
+def _write_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def file_digest(path, root=None):
+    '''
+    Computes the SHA-256 of the file contents.
+
+    The digest is remembered in the cache directory for the path of the file
+    together with its stat tuple, then the file is only read again once it has
+    changed.
+    '''
+    st = os.stat(path)
+    path = os.path.abspath(path)
+    stat_key = '{} {} {} {}'.format(path, st.st_size, st.st_mtime_ns, st.st_ino)
+    memo = None
+    if root is not None:
+        memo = os.path.join(root, 'digests', hashlib.sha1(path.encode()).hexdigest())
+        try:
+            with open(memo) as f:
+                memo_key, digest = f.read().split('\n')
+        except (FileNotFoundError, ValueError):
+            pass
+        else:
+            if memo_key == stat_key:
+                # The modification time of the memo is used for the eviction.
+                os.utime(memo)
+                return digest
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024**2), b''):
+            h.update(block)
+    digest = h.hexdigest()
+
+    if memo is not None:
+        _write_atomic(memo, stat_key + '\n' + digest)
+
+    return digest
+
+
+_source_dir = os.path.dirname(os.path.abspath(__file__))
+
+_module_digests = {}
+
+
+def _is_local(module):
+    path = getattr(module, '__file__', None)
+    return path is not None and os.path.abspath(path).startswith(_source_dir + os.sep)
+
+
+def local_dependencies(module):
+    '''
+    Finds the modules of this directory that a module uses, directly or
+    through other ones. The globals of each module are followed, that covers
+    ``import extractors.xmlstream`` as well as ``from transforms import
+    LogColumns``. Packages lead to all of their loaded submodules.
+
+    :return: Dictionary from the module name to the module, including
+        ``module`` itself.
+    '''
+    modules = {}
+    todo = [module]
+    while len(todo) > 0:
+        module = todo.pop()
+        if module.__name__ in modules:
+            continue
+        modules[module.__name__] = module
+
+        for value in vars(module).values():
+            if inspect.ismodule(value):
+                dependency = value
+            elif inspect.isfunction(value) or inspect.isclass(value):
+                dependency = sys.modules.get(value.__module__)
+            else:
+                continue
+            if dependency is not None and _is_local(dependency):
+                todo.append(dependency)
+
+    return modules
+
+
+def function_version(function):
+    '''
+    Identifies the version of a function by the source of its module and of
+    the modules of this directory that it uses.
+    '''
+    module = inspect.getmodule(function)
+    name = module.__name__
+    if name not in _module_digests:
+        h = hashlib.sha256()
+        for dependency_name, dependency in sorted(local_dependencies(module).items()):
+            h.update(dependency_name.encode())
+            h.update(hashlib.sha256(inspect.getsource(dependency).encode()).digest())
+        _module_digests[name] = h.hexdigest()
+    return '{}.{} {}'.format(name, function.__qualname__, _module_digests[name])
+
+
+def cache_key(function, args, kwargs, inputs, outputs, root=None):
+    '''
+    Derives the key from everything that determines the output files. The
+    paths of the input and output files are left out such that the key is the
+    same on every machine.
+    '''
+    params = {
+        'function': function_version(function),
+        'inputs': [file_digest(path, root) for path in inputs],
+        'args': [repr(arg) for arg in args if arg not in inputs and arg not in outputs],
+        'kwargs': {key: repr(val) for key, val in kwargs.items()},
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def entry_path(root, key):
+    return os.path.join(root, 'objects', key[:2], key)
+
+
+def cached_call(function, args=(), kwargs=None, inputs=(), outputs=()):
+    '''
+    Calls ``function(*args, **kwargs)`` unless its output files are in the
+    cache already, then they are copied from there.
+
+    :param list inputs: Files that are read by the function.
+    :param list outputs: Files that are written by the function.
+    '''
+    if kwargs is None:
+        kwargs = {}
+
+    root = cache_dir()
+    if root is None:
+        function(*args, **kwargs)
+        return
+
+    key = cache_key(function, args, kwargs, inputs, outputs, root)
+    entry = entry_path(root, key)
+
+    if restore(entry, outputs):
+        return
+
+    function(*args, **kwargs)
+    added = store(root, entry, outputs)
+    account(root, added)
+
+
+def restore(entry, outputs):
+    if not os.path.isdir(entry):
+        return False
+
+    for i, output in enumerate(outputs):
+        cached = os.path.join(entry, str(i))
+        if not os.path.isfile(cached):
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        shutil.copyfile(cached, output)
+
+    # The modification time of the entry is used for the eviction.
+    os.utime(entry)
+    return True
+
+
+def store(root, entry, outputs):
+    '''
+    :return: Size of the new entry in bytes.
+    '''
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(entry))
+    size = 0
+    for i, output in enumerate(outputs):
+        shutil.copyfile(output, os.path.join(tmp, str(i)))
+        size += os.path.getsize(output)
+
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # Another process has stored the same entry in the meantime.
+        shutil.rmtree(tmp)
+        return 0
+
+    return size
+
+
+# Size of the cache as far as this process knows, ``None`` before the first
+# entry has been stored.
+_known_size = None
+
+
+def account(root, added):
+    '''
+    Keeps track of the size of the cache and evicts entries once it exceeds
+    the limit. Only the first call in a process scans the cache.
+    '''
+    global _known_size
+
+    if _known_size is None:
+        _known_size = sum(size for mtime, size, path in list_entries(root) + list_digests(root))
+    else:
+        _known_size += added
+
+    limit = max_size()
+    if _known_size > limit:
+        _known_size = evict(root, int(limit * EVICT_FRACTION))
+
+
+def list_entries(root):
+    '''
+    :return: List of tuples ``(mtime, size, path)`` of all entries.
+    '''
+    entries = []
+    objects = os.path.join(root, 'objects')
+    if not os.path.isdir(objects):
+        return entries
+
+    for prefix in os.scandir(objects):
+        for entry in os.scandir(prefix.path):
+            if not entry.is_dir():
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            entries.append((entry.stat().st_mtime, size, entry.path))
+
+    return entries
+
+
+def list_digests(root):
+    '''
+    :return: List of tuples ``(mtime, size, path)`` of the remembered hashes.
+    '''
+    path = os.path.join(root, 'digests')
+    if not os.path.isdir(path):
+        return []
+
+    digests = []
+    for entry in os.scandir(path):
+        if entry.is_file():
+            st = entry.stat()
+            digests.append((st.st_mtime, st.st_size, entry.path))
+    return digests
+
+
+def evict(root, limit):
+    '''
+    Removes the least recently used entries and remembered hashes until the
+    cache is smaller than ``limit`` bytes.
+
+    :return: Remaining size in bytes.
+    '''
+    entries = sorted(list_entries(root) + list_digests(root))
+    total = sum(size for mtime, size, path in entries)
+
+    for mtime, size, path in entries:
+        if total <= limit:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+
+    return total
+
+
+def main():
+    options = _parse_args()
+
+    root = cache_dir()
+    if root is None:
+        print('The cache is disabled.')
+        return
+
+    if options.clear:
+        shutil.rmtree(root, ignore_errors=True)
+    elif options.limit is not None:
+        evict(root, options.limit)
+
+    entries = list_entries(root)
+    digests = list_digests(root)
+    print('{}: {} entries, {} remembered hashes, {:.1f} MiB'.format(
+        root, len(entries), len(digests), sum(size for mtime, size, path in entries + digests) / 1024**2))
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Show the size of the extraction cache and shrink it.')
+    parser.add_argument('--limit', type=int, help='Evict the least recently used entries down to this many bytes.')
+    parser.add_argument('--clear', action='store_true', help='Remove the whole cache.')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
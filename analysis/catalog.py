@@ -0,0 +1,428 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+SQLite catalog of the runs, jobs, updates, solver calls and observables of
+many ensembles.
+
+The catalog is filled from the extracts of the runs, that are the shards of
+the text logs, the flattened shards of the XML logs and the observable
+columns. Every such file is a source of the catalog. When the catalog is
+updated, only the sources with a changed modification time or size are read
+again, the rows of removed sources are deleted. Each job is one log file, the
+text logs give the number of nodes and the subgrid volume, the XML logs
+``tau0`` and ``n_steps``.
+
+The catalog is ``hmc-catalog.sqlite`` in the working directory unless
+``HMC_ANALYSIS_CATALOG`` is set. ``Catalog.query`` returns the columns of the
+result as NumPy arrays::
+
+    catalog = Catalog()
+    result = catalog.query("""
+        SELECT runs.name, MAX(solver_calls.gflops_per_node) AS gflops
+        FROM solver_calls JOIN runs ON runs.id = solver_calls.run_id
+        JOIN updates USING (run_id, update_no)
+        WHERE updates.subgrid_volume = 4096 AND solver = 'QPhiX Clover CG'
+        GROUP BY runs.id HAVING gflops > 200""")
+'''
+
+import argparse
+import collections
+import fnmatch
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+import extractors
+import names
+import observables
+import transforms
+
+
+CATALOG_VERSION = 1
+
+schema = '''
+CREATE TABLE runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE sources (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL,
+    path TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE jobs (
+    id INTEGER PRIMARY KEY,
+    source_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    job_no INTEGER,
+    kind TEXT NOT NULL,
+    log TEXT NOT NULL,
+    nodes INTEGER,
+    subgrid_volume INTEGER,
+    tau0 REAL,
+    n_steps INTEGER,
+    first_update INTEGER,
+    last_update INTEGER,
+    update_count INTEGER NOT NULL
+);
+CREATE TABLE updates (
+    source_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    job_id INTEGER NOT NULL,
+    update_no INTEGER NOT NULL,
+    nodes INTEGER,
+    subgrid_volume INTEGER
+);
+CREATE TABLE solver_calls (
+    source_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    update_no INTEGER NOT NULL,
+    solver TEXT NOT NULL,
+    call INTEGER NOT NULL,
+    gflops REAL,
+    gflops_per_node REAL,
+    iters REAL,
+    residual REAL
+);
+CREATE TABLE observables (
+    source_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    update_no INTEGER NOT NULL,
+    value REAL
+);
+CREATE INDEX jobs_run ON jobs (run_id, job_no);
+CREATE INDEX jobs_source ON jobs (source_id);
+CREATE INDEX updates_run ON updates (run_id, update_no);
+CREATE INDEX updates_subgrid_volume ON updates (subgrid_volume);
+CREATE INDEX updates_source ON updates (source_id);
+CREATE INDEX solver_calls_solver ON solver_calls (solver, gflops_per_node);
+CREATE INDEX solver_calls_run ON solver_calls (run_id, update_no);
+CREATE INDEX solver_calls_source ON solver_calls (source_id);
+CREATE INDEX observables_name ON observables (name, run_id, update_no);
+CREATE INDEX observables_source ON observables (source_id);
+'''
+
+# Tables with rows that are derived from a source.
+derived_tables = ['jobs', 'updates', 'solver_calls', 'observables']
+
+
+def catalog_path():
+    return os.environ.get('HMC_ANALYSIS_CATALOG', 'hmc-catalog.sqlite')
+
+
+def find_runs(paths):
+    '''
+    Finds the run directories, that are the directories with an ``hmc-out``
+    or an ``extract`` subdirectory. Each path may be a run itself or contain
+    runs.
+    '''
+    def is_run(path):
+        return os.path.isdir(os.path.join(path, 'hmc-out')) or os.path.isdir(os.path.join(path, 'extract'))
+
+    runs = []
+    for path in paths:
+        if is_run(path):
+            runs.append(os.path.abspath(path))
+        else:
+            with os.scandir(path) as entries:
+                runs += sorted(os.path.abspath(entry.path) for entry in entries
+                               if entry.is_dir() and not entry.name.startswith('.') and is_run(entry.path))
+    return runs
+
+
+def find_sources(run):
+    '''
+    :return: List of tuples ``(kind, path, stat)`` of the extracts of a run.
+    '''
+    sources = []
+    for kind, subdir, pattern in [
+        ('log', os.path.join('hmc-out', 'shard', 'logfile'), 'shard-*.npz'),
+        ('xml', os.path.join('hmc-out', 'shard', 'flat'), 'flat-*.npz'),
+    ]:
+        for entry in names.layout.files(run, subdir):
+            if fnmatch.fnmatchcase(entry.name, pattern):
+                sources.append((kind, entry.path, entry.stat()))
+
+    for name in observables.column_names(run):
+        path = names.observable(run, name)
+        sources.append(('observable', path, os.stat(path)))
+
+    return sources
+
+
+def job_number(log):
+    m = re.match(r'hmc\.(\d+)\.', os.path.basename(log))
+    if m:
+        return int(m.group(1))
+    return None
+
+
+def _aligned(values, offsets, update_index, call):
+    '''
+    Picks the values of another metric for the calls of a solver, missing
+    values are NaN.
+    '''
+    counts = np.diff(offsets)[update_index]
+    valid = call < counts
+    result = np.full(len(call), np.nan)
+    result[valid] = values[offsets[update_index[valid]] + call[valid]]
+    return result
+
+
+def parse_param(text):
+    '''
+    Converts a parameter from the command line to a number if possible. The
+    result of an aggregate has no type affinity, it would be compared to a
+    string as a string.
+    '''
+    for conversion in [int, float]:
+        try:
+            return conversion(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _none_if_missing(value):
+    return None if value == -1 else int(value)
+
+
+class Catalog(object):
+    def __init__(self, path=None):
+        self.path = catalog_path() if path is None else path
+        self.connection = sqlite3.connect(self.path)
+
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != CATALOG_VERSION:
+            with self.connection:
+                tables = [row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+                for table in tables:
+                    self.connection.execute('DROP TABLE {}'.format(table))
+                self.connection.executescript(schema)
+                self.connection.execute('PRAGMA user_version = {}'.format(CATALOG_VERSION))
+
+    def close(self):
+        self.connection.close()
+
+    def run_id(self, run):
+        self.connection.execute('INSERT OR IGNORE INTO runs (path, name) VALUES (?, ?)', (run, os.path.basename(run)))
+        return self.connection.execute('SELECT id FROM runs WHERE path = ?', (run,)).fetchone()[0]
+
+    def remove_source(self, source_id):
+        for table in derived_tables:
+            self.connection.execute('DELETE FROM {} WHERE source_id = ?'.format(table), (source_id,))
+        self.connection.execute('DELETE FROM sources WHERE id = ?', (source_id,))
+
+    def add_job(self, source_id, run_id, kind, log, update_no, **header):
+        cursor = self.connection.execute(
+            'INSERT INTO jobs (source_id, run_id, job_no, kind, log, nodes, subgrid_volume, tau0, n_steps, '
+            'first_update, last_update, update_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (source_id, run_id, job_number(log), kind, log, header.get('nodes'), header.get('subgrid_volume'),
+             header.get('tau0'), header.get('n_steps'),
+             int(update_no.min()) if len(update_no) > 0 else None,
+             int(update_no.max()) if len(update_no) > 0 else None,
+             len(update_no)))
+        return cursor.lastrowid
+
+    def add_log_shard(self, source_id, run_id, path):
+        with transforms.LogColumns(path) as columns:
+            update_no = columns.update_no
+            nodes = columns.common('nodes')
+            subgrid_volume = columns.common('subgrid_volume')
+
+            log = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(path))),
+                               os.path.basename(path)[len('shard-'):-len('.npz')])
+            job_id = self.add_job(source_id, run_id, 'log', log, update_no,
+                                  nodes=_none_if_missing(nodes[0]) if len(nodes) > 0 else None,
+                                  subgrid_volume=_none_if_missing(subgrid_volume[0]) if len(nodes) > 0 else None)
+
+            self.connection.executemany(
+                'INSERT INTO updates (source_id, run_id, job_id, update_no, nodes, subgrid_volume) VALUES (?, ?, ?, ?, ?, ?)',
+                ((source_id, run_id, job_id, u, _none_if_missing(n), _none_if_missing(s))
+                 for u, n, s in zip(update_no.tolist(), nodes.tolist(), subgrid_volume.tolist())))
+
+            # Missing node counts are nan, so are the values per node then.
+            node_counts = columns.nodes()
+
+            for solver in columns.solvers():
+                metrics = [metric for metric in ['gflops', 'iters', 'residuals'] if (solver, metric) in columns.series]
+                if len(metrics) == 0:
+                    continue
+                values, offsets = columns.values(solver, metrics[0])
+                update_index = np.repeat(np.arange(len(update_no)), np.diff(offsets))
+                call = np.arange(len(update_index)) - offsets[update_index]
+
+                data = {}
+                for metric in ['gflops', 'iters', 'residuals']:
+                    if metric in metrics:
+                        data[metric] = _aligned(*columns.values(solver, metric), update_index, call)
+                    else:
+                        data[metric] = np.full(len(call), np.nan)
+
+                gflops_per_node = data['gflops'] / node_counts[update_index]
+
+                self.connection.executemany(
+                    'INSERT INTO solver_calls (source_id, run_id, update_no, solver, call, gflops, gflops_per_node, '
+                    'iters, residual) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    ((source_id, run_id, u, solver, c, g, gn, i, r)
+                     for u, c, g, gn, i, r in zip(update_no[update_index].tolist(), call.tolist(),
+                                                   data['gflops'].tolist(), gflops_per_node.tolist(),
+                                                   data['iters'].tolist(), data['residuals'].tolist())))
+
+    def add_flat_shard(self, source_id, run_id, path):
+        store = extractors.flatstore.FlatStore(path)
+        header = {}
+        for key in ['tau0', 'n_steps']:
+            update_no, values = store.extract(extractors.xmlfile.bits[key])
+            if len(values) > 0:
+                header[key] = values[0]
+        if 'n_steps' in header:
+            header['n_steps'] = int(header['n_steps'])
+
+        log = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(path))),
+                           os.path.basename(path)[len('flat-'):-len('.npz')])
+        self.add_job(source_id, run_id, 'xml', log, np.asarray(store.store['updates']), **header)
+
+    def add_observable(self, source_id, run_id, path):
+        name = os.path.basename(path)[:-len('.npy')]
+        update_no, values = observables.read(path)
+        self.connection.executemany(
+            'INSERT INTO observables (source_id, run_id, name, update_no, value) VALUES (?, ?, ?, ?, ?)',
+            ((source_id, run_id, name, u, v) for u, v in zip(update_no.tolist(), values.tolist())))
+
+    def update_run(self, run):
+        '''
+        Reads the new and changed sources of a run and removes the rows of
+        the sources that are gone.
+
+        :return: Tuple with the number of read and removed sources.
+        '''
+        readers = {'log': self.add_log_shard, 'xml': self.add_flat_shard, 'observable': self.add_observable}
+        read = 0
+
+        with self.connection:
+            run_id = self.run_id(run)
+            known = {path: (source_id, mtime_ns, size) for source_id, path, mtime_ns, size in self.connection.execute(
+                'SELECT id, path, mtime_ns, size FROM sources WHERE run_id = ?', (run_id,))}
+
+            for kind, path, st in find_sources(run):
+                source_id, mtime_ns, size = known.pop(path, (None, None, None))
+                if (mtime_ns, size) == (st.st_mtime_ns, st.st_size):
+                    continue
+                if source_id is not None:
+                    self.remove_source(source_id)
+                source_id = self.connection.execute(
+                    'INSERT INTO sources (run_id, path, kind, mtime_ns, size) VALUES (?, ?, ?, ?, ?)',
+                    (run_id, path, kind, st.st_mtime_ns, st.st_size)).lastrowid
+                readers[kind](source_id, run_id, path)
+                read += 1
+
+            for source_id, mtime_ns, size in known.values():
+                self.remove_source(source_id)
+
+        return read, len(known)
+
+    def update(self, paths):
+        '''
+        Updates all runs in the given paths.
+        '''
+        for run in find_runs(paths):
+            start = time.perf_counter()
+            read, removed = self.update_run(run)
+            if read > 0 or removed > 0:
+                print('{}: {} sources read, {} removed in {:.2f} s'.format(run, read, removed, time.perf_counter() - start))
+
+    def query(self, sql, params=()):
+        '''
+        Runs a query.
+
+        :return: Ordered dictionary from the column name to a NumPy array with
+            the values of the column.
+        '''
+        cursor = self.connection.execute(sql, params)
+        rows = cursor.fetchall()
+        column_names = [description[0] for description in cursor.description]
+        if len(rows) == 0:
+            return collections.OrderedDict((name, np.array([])) for name in column_names)
+        return collections.OrderedDict(
+            (name, np.array(column)) for name, column in zip(column_names, zip(*rows)))
+
+    def runs(self):
+        return self.query('SELECT id, name, path FROM runs ORDER BY name')
+
+    def observable(self, run, name):
+        '''
+        :param str run: Name or path of a run.
+        :return: Tuple ``(update_no, values)`` of arrays.
+        '''
+        result = self.query('SELECT update_no, value FROM observables JOIN runs ON runs.id = observables.run_id '
+                            'WHERE (runs.name = ? OR runs.path = ?) AND observables.name = ? ORDER BY update_no',
+                            (run, os.path.abspath(run), name))
+        return result['update_no'].astype(np.int64), result['value'].astype(np.float64)
+
+
+def main():
+    options = _parse_args()
+
+    catalog = Catalog(options.db)
+
+    if options.command == 'update':
+        catalog.update(options.path)
+    elif options.command == 'query':
+        start = time.perf_counter()
+        result = catalog.query(options.sql, [parse_param(param) for param in options.params])
+        print('\t'.join(result.keys()))
+        for row in zip(*result.values()):
+            print('\t'.join(str(value) for value in row))
+        if options.time:
+            print('{} rows in {:.1f} ms'.format(len(next(iter(result.values()), [])),
+                                                 (time.perf_counter() - start) * 1000))
+    elif options.command == 'observable':
+        for update_no, value in zip(*catalog.observable(options.run, options.name)):
+            print('{}\t{}'.format(update_no, value))
+
+    catalog.close()
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Collect the extracts of many runs into an SQLite catalog and query it.')
+    parser.add_argument('--db', help='Path of the catalog. Default: $HMC_ANALYSIS_CATALOG or hmc-catalog.sqlite')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    update = subparsers.add_parser('update', help='Read the new and changed extracts of runs.')
+    update.add_argument('path', nargs='+', help='Run directories or directories containing runs, like `Runs`.')
+
+    query = subparsers.add_parser('query', help='Run an SQL query and print the result as TSV.')
+    query.add_argument('sql')
+    query.add_argument('params', nargs='*', help='Values for the `?` placeholders.')
+    query.add_argument('--time', action='store_true', help='Print the time that the query took.')
+
+    observable = subparsers.add_parser('observable', help='Print an observable of a run.')
+    observable.add_argument('run', help='Name or path of the run.')
+    observable.add_argument('name')
+
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Check of the Slurm executor of ``ingest.py`` against the local one.
+
+A tiny synthetic run with a text log and an XML log is ingested once with
+``--executor local`` and then with ``--executor slurm`` against
+``fake_slurm.py``. The Slurm run is repeated in the situations that the
+real ``squeue`` produces: the finished job is still listed as ``COMPLETED``,
+it has already been purged such that ``squeue`` fails with "Invalid job id
+specified", and a fraction of the queries time out. The shards and extracts
+of every Slurm run have to be equal to those of the local run. The script
+exits with a non-zero status otherwise.
+'''
+
+import argparse
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+import benchmark_logfile
+import benchmark_xmlstream
+
+
+scenarios = [
+    ('completed job still listed', {'FAKE_SLURM_MIN_JOB_AGE': '3600', 'FAKE_SLURM_FAIL_RATE': '0'}),
+    ('job purged', {'FAKE_SLURM_MIN_JOB_AGE': '0', 'FAKE_SLURM_FAIL_RATE': '0'}),
+    ('flaky squeue', {'FAKE_SLURM_MIN_JOB_AGE': '0', 'FAKE_SLURM_FAIL_RATE': '0.4'}),
+]
+
+
+def write_synthetic_run(run, updates):
+    hmc_out = os.path.join(run, 'hmc-out')
+    os.makedirs(hmc_out)
+
+    with gzip.open(os.path.join(hmc_out, 'hmc.1.out.txt.gz'), 'wt') as f:
+        f.write('  total number of nodes = 4\n')
+        f.write('  subgrid volume = 4096\n')
+        for update_no in range(1, updates + 1):
+            f.write('Doing Update: {}\n'.format(update_no))
+            f.writelines(benchmark_logfile.make_synthetic_block(20, 2))
+            f.write('FORCE TIME: GaugeMonomial : 0.{}\n'.format(update_no))
+            f.write('HMC: total time = {}.5 secs\n'.format(100 + update_no))
+
+    benchmark_xmlstream.write_synthetic_xml(os.path.join(hmc_out, 'hmc.1.out.xml.gz'), 20000, 2)
+
+
+def ingest(run, work_dir, env, executor, timeout=None):
+    '''
+    :return: Error message or ``None``.
+    '''
+    command = [sys.executable, 'ingest.py', '--executor', executor, run]
+    if executor == 'slurm':
+        fake_slurm = '{} {}'.format(sys.executable, os.path.abspath('fake_slurm.py'))
+        command += ['--work-dir', work_dir, '--poll-interval', '0.2',
+                    '--sbatch', fake_slurm + ' sbatch', '--squeue', fake_slurm + ' squeue']
+    try:
+        status = subprocess.call(command, env=env, stdout=subprocess.DEVNULL, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return 'ingest.py did not finish within {:g} s'.format(timeout)
+    if status != 0:
+        return 'ingest.py failed with status {}'.format(status)
+
+
+def result_files(run):
+    '''
+    :return: Relative paths of the shards and extracts that can be compared.
+    '''
+    paths = []
+    for directory, subdirs, files in os.walk(run):
+        for name in files:
+            if name.endswith('.npz') or name.endswith('.npy'):
+                paths.append(os.path.relpath(os.path.join(directory, name), run))
+    return sorted(paths)
+
+
+def load_arrays(path):
+    if path.endswith('.npy'):
+        return {'': np.load(path)}
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def arrays_equal(a, b):
+    if a.shape != b.shape or a.dtype != b.dtype:
+        return False
+    if a.dtype.kind in 'fc':
+        return np.array_equal(a, b, equal_nan=True)
+    return np.array_equal(a, b)
+
+
+def compare_runs(expected_run, run):
+    '''
+    :return: List of the differences.
+    '''
+    differences = []
+    expected_files = result_files(expected_run)
+    files = result_files(run)
+    for path in sorted(set(expected_files) ^ set(files)):
+        differences.append('{}: only in one of the runs'.format(path))
+
+    for path in sorted(set(expected_files) & set(files)):
+        expected = load_arrays(os.path.join(expected_run, path))
+        actual = load_arrays(os.path.join(run, path))
+        if sorted(expected) != sorted(actual):
+            differences.append('{}: different arrays'.format(path))
+            continue
+        for key in expected:
+            if not arrays_equal(expected[key], actual[key]):
+                differences.append('{} {}: different values'.format(path, key))
+
+    return differences
+
+
+def main():
+    options = _parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, 'template')
+        write_synthetic_run(template, options.updates)
+
+        # A shared cache would let the second run copy the results of the
+        # first one.
+        env = dict(os.environ, HMC_ANALYSIS_CACHE='off', MPLBACKEND='Agg')
+
+        local_run = os.path.join(tmp, 'local')
+        shutil.copytree(template, local_run)
+        error = ingest(local_run, None, env, 'local')
+        if error is not None or len(result_files(local_run)) == 0:
+            print('The local executor did not write any shards.')
+            sys.exit(1)
+
+        failures = 0
+        for i, (description, settings) in enumerate(scenarios):
+            run = os.path.join(tmp, 'slurm-{}'.format(i))
+            shutil.copytree(template, run)
+            slurm_env = dict(env, FAKE_SLURM_DIR=os.path.join(tmp, 'fake-slurm-{}'.format(i)), **settings)
+            error = ingest(run, os.path.join(tmp, 'work-{}'.format(i)), slurm_env, 'slurm', options.timeout)
+
+            differences = compare_runs(local_run, run) if error is None else [error]
+            print('{}: {}'.format(description, 'ok' if len(differences) == 0 else 'FAILED'))
+            for difference in differences:
+                print('    ' + difference)
+            failures += len(differences) > 0
+
+    if failures > 0:
+        sys.exit(1)
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Compare the shards from the Slurm executor with fake_slurm.py to those of the local executor.')
+    parser.add_argument('--updates', type=int, default=20, help='Updates in the synthetic text log. Default: %(default)s')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds after which a Slurm run counts as hanging. Default: %(default)s')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,15 @@ import os
 
 from lxml import etree
 import numpy as np
-import scipy.optimize as op
 
+from lazy import lazy_import
+import profiling
 import util
 
+op = lazy_import('scipy.optimize')
 
+
+@profiling.profiled
 def io_extract_pion_corr(path_in, path_out):
     try:
         tree = etree.parse(path_in)
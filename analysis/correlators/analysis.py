@@ -7,22 +7,26 @@ Fragments for the analysis.
 import logging
 import sys
 
-import matplotlib.pyplot as pl
 import numpy as np
-import scipy.optimize as op
-import scipy.stats
 
+from lazy import lazy_import
 import bootstrap
 import correlators.corrfit
 import correlators.fit
 import correlators.loader
 import correlators.transform
+import profiling
 import util
 
+pl = lazy_import('matplotlib.pyplot')
+op = lazy_import('scipy.optimize')
+scipy = lazy_import('scipy')
+
 
 LOGGER = logging.getLogger(__name__)
 
 
+@profiling.profiled
 def io_effective_mass(paths_in, path_out):
     twopts_orig = correlators.loader.folded_list_loader(paths_in)
     sample_count = 3 * len(twopts_orig)
@@ -40,6 +44,7 @@ def io_effective_mass(paths_in, path_out):
 
 
 
+@profiling.profiled
 def io_extract_mass(paths_in, path_out):
     twopts_orig = correlators.loader.folded_list_loader(paths_in)
 
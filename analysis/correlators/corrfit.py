@@ -8,13 +8,15 @@
 Fitting correlated data with least squares.
 '''
 
-import matplotlib.pyplot as pl
 import numpy as np
-import scipy.optimize as op
-import scipy.stats
 
+from lazy import lazy_import
 import correlators.fit
 
+pl = lazy_import('matplotlib.pyplot')
+op = lazy_import('scipy.optimize')
+scipy = lazy_import('scipy')
+
 
 def correlation_matrix(sets):
     r'''
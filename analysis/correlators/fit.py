@@ -1,8 +1,11 @@
 # Copyright © 2014-2015, 2017 Martin Ueding <mu@martin-ueding.de>
 
 import numpy as np
-import scipy.optimize as op
-import scipy.stats
+
+from lazy import lazy_import
+
+op = lazy_import('scipy.optimize')
+scipy = lazy_import('scipy')
 
 
 def _cut(x, y, yerr, omit_pre, omit_post):
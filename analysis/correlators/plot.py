@@ -6,13 +6,15 @@ Plots of data sets.
 
 import logging
 
-import matplotlib.figure
 import numpy as np
 
+from lazy import lazy_import
 import correlators.bootstrap
 import correlators.fit
 import correlators.transform
 
+matplotlib = lazy_import('matplotlib')
+
 
 LOGGER = logging.getLogger(__name__)
 
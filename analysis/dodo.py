@@ -3,42 +3,81 @@
 
 # Copyright © 2017-2018 Martin Ueding <mu@martin-ueding.de>
 
-import glob
-import itertools
 import os
 import re
 
+from doit import get_var
+
+import batch
+import cache
 import correlators
 import correlators.analysis
+import epilogue
 import extractors
+import manifest
 import names
+import observables
+import profiling
 import transforms
 import visualizers
 import wflow
 
-directories = list(filter(os.path.isdir, os.listdir()))
+DOIT_CONFIG = {}
+
+# The resource usage of the tasks is only recorded on request, like
+# `HMC_ANALYSIS_PROFILE=on doit`.
+if profiling.profile_path() is not None:
+    DOIT_CONFIG['reporter'] = profiling.ProfilingReporter
+
+# The tasks can be restricted to some of the runs, like `doit runs=A,B`. Only
+# these runs are walked then.
+selected_runs = get_var('runs')
+if selected_runs:
+    selected_runs = selected_runs.split(',')
+    run_manifest = manifest.refresh(runs=selected_runs)
+    directories = [directory for directory in run_manifest.directories if directory in selected_runs]
+else:
+    run_manifest = manifest.refresh()
+    directories = run_manifest.directories
+
+# Number of configurations per task for the families of small per
+# configuration tasks. They can be changed on the command line, like
+# `doit chunk_wflow=16`.
+chunk_sizes = {
+    family: int(get_var('chunk_' + family) or default)
+    for family, default in [('wflow', 64), ('correlators', 64)]
+}
 
 
 def task_logfiles_to_shards():
     for directory in directories:
         shard_names = []
-        for logfile in glob.glob(os.path.join(directory, 'hmc-out', 'hmc.*.out.txt.gz')):
+        for logfile in run_manifest.glob(directory, 'hmc-out', 'hmc.*.out.txt.gz'):
             shard_name = names.log_shard(logfile)
+            checkpoint_name = names.log_checkpoint(logfile)
             shard_names.append(shard_name)
 
             yield {
-                'actions': [(extractors.logfile.parse_logfile_to_shard, [logfile])],
+                # The text logs of running jobs grow, hashing them for the
+                # cache would read them completely every time. The parse
+                # continues from the checkpoint instead.
+                'actions': [(epilogue.call_unless_reduced,
+                             [extractors.logfile.parse_logfile_to_shard, [logfile], {'incremental': True},
+                              [logfile], [shard_name, checkpoint_name]])],
                 'basename': 'logfile_to_shards',
                 'name': logfile,
-                'file_dep': [logfile],
-                'targets': [shard_name],
+                'uptodate': [manifest.stat_uptodate(run_manifest, [logfile])],
+                'targets': [shard_name, checkpoint_name],
             }
 
         merged_name = names.log_extract(directory)
         log_long_name = names.log_long(directory)
+        kernels_long_name = names.kernels_long(directory)
+        phases_long_name = names.phases_long(directory)
+        trajectory_name = names.observable(directory, 'seconds_for_trajectory')
 
         yield {
-            'actions': [(transforms.merge_json_shards, [shard_names, merged_name])],
+            'actions': [(transforms.merge_log_shards, [shard_names, merged_name])],
             'basename': 'merge_logfile_shards',
             'name': merged_name,
             'file_dep': shard_names,
@@ -46,13 +85,38 @@ def task_logfiles_to_shards():
         }
 
         yield {
-            'actions': [(transforms.io_log_json_to_long, [merged_name, log_long_name])],
+            'actions': [(transforms.io_log_columns_to_long, [merged_name, log_long_name])],
             'basename': 'logfile_to_long',
             'name': log_long_name,
             'file_dep': [merged_name],
             'targets': [log_long_name],
         }
 
+        yield {
+            'actions': [(transforms.io_kernel_breakdown, [merged_name, kernels_long_name])],
+            'basename': 'logfile_kernel_breakdown',
+            'name': kernels_long_name,
+            'file_dep': [merged_name],
+            'targets': [kernels_long_name],
+        }
+
+        yield {
+            'actions': [(transforms.io_phase_breakdown, [merged_name, trajectory_name, phases_long_name])],
+            'basename': 'logfile_phase_breakdown',
+            'name': phases_long_name,
+            'file_dep': [merged_name, trajectory_name],
+            'targets': [phases_long_name],
+        }
+
+        path_out = names.plot(directory, 'phases')
+        yield {
+            'actions': [(visualizers.plot_phases, [phases_long_name, path_out])],
+            'basename': 'plot_phases',
+            'name': path_out,
+            'file_dep': [phases_long_name],
+            'targets': [path_out],
+        }
+
 
 def task_transform_solver_data():
     for directory in directories:
@@ -79,38 +143,49 @@ def task_transform_solver_data():
             }
 
 
-def task_xpath_shards():
+def task_flatten_xml():
     for directory in directories:
-        for key, extractor in extractors.xmlfile.bits.items():
-            shard_names = []
-            for xml_file in itertools.chain(glob.glob(os.path.join(directory, 'hmc-out', 'hmc.*.out.xml.gz')),
-                                            glob.glob(os.path.join(directory, 'hmc-out', 'hmc.*.log.xml.gz'))):
-                shard_name = names.xpath_shard(xml_file, key)
-                shard_names.append(shard_name)
-                yield {
-                    'actions': [(extractors.xmlfile.extractor_to_shard, [extractor, xml_file, key])],
-                    'name': shard_name,
-                    'basename': 'xpath_to_shard',
-                    'file_dep': [xml_file],
-                    'targets': [shard_name],
-                }
+        xml_files = sorted(run_manifest.glob(directory, 'hmc-out', 'hmc.*.out.xml.gz')
+                           + run_manifest.glob(directory, 'hmc-out', 'hmc.*.log.xml.gz'))
+
+        for xml_file in xml_files:
+            targets = [names.flat_shard(xml_file), names.xpath_shard_meta(xml_file)]
+            yield {
+                'actions': [(epilogue.cached_call_unless_reduced,
+                             [extractors.flatstore.flatten_to_shard, [xml_file], {}, [xml_file], targets])],
+                'name': xml_file,
+                'basename': 'flatten_xml',
+                'uptodate': [manifest.stat_uptodate(run_manifest, [xml_file])],
+                'targets': targets,
+            }
+
+        shard_names = [names.flat_shard(xml_file) for xml_file in xml_files]
+        flat_name = names.flat_extract(directory)
+        yield {
+            'actions': [(extractors.flatstore.merge_flat_shards, [shard_names, flat_name])],
+            'basename': 'merge_flat_shards',
+            'name': flat_name,
+            'file_dep': shard_names,
+            'targets': [flat_name],
+        }
 
-            merged_name = names.xmllog_extract(directory, key)
+        for key in extractors.xmlfile.bits:
+            merged_name = names.observable(directory, key)
 
             yield {
-                'actions': [(transforms.merge_tsv_shards, [shard_names, merged_name])],
-                'basename': 'merge_xml_shards',
+                'actions': [(extractors.flatstore.io_extract_key, [flat_name, key, merged_name])],
+                'basename': 'flat_to_observable',
                 'name': merged_name,
-                'file_dep': shard_names,
+                'file_dep': [flat_name],
                 'targets': [merged_name],
             }
 
 
 def task_convert_delta_delta_h():
     for dirname in directories:
-        in_files = [os.path.join(dirname, 'extract', 'extract-DeltaDeltaH.tsv'),
-                    os.path.join(dirname,'extract',  'extract-deltaH.tsv')]
-        out_file = os.path.join(dirname,'extract',  'extract-DeltaDeltaH_over_DeltaH.tsv')
+        in_files = [names.observable(dirname, 'DeltaDeltaH'),
+                    names.observable(dirname, 'deltaH')]
+        out_file = names.observable(dirname, 'DeltaDeltaH_over_DeltaH')
         yield {
             'actions': [(transforms.delta_delta_h, [dirname])],
             'name': dirname,
@@ -123,14 +198,14 @@ def task_delta_h_to_exp():
     for dirname in directories:
         yield make_single_transform(dirname,
                                     transforms.io_delta_h_to_exp,
-                                    os.path.join(dirname, 'extract', 'extract-deltaH.tsv'),
-                                    os.path.join(dirname, 'extract', 'extract-exp_deltaH.tsv'))
+                                    names.observable(dirname, 'deltaH'),
+                                    names.observable(dirname, 'exp_deltaH'))
 
 
 def task_convert_time_to_minutes():
     for dirname in directories:
-        path_in = os.path.join(dirname, 'extract', 'extract-seconds_for_trajectory.tsv')
-        path_out = os.path.join(dirname, 'extract', 'extract-minutes_for_trajectory.tsv')
+        path_in = names.observable(dirname, 'seconds_for_trajectory')
+        path_out = names.observable(dirname, 'minutes_for_trajectory')
         yield make_single_transform(dirname,
                                     transforms.io_time_to_minutes,
                                     path_in,
@@ -141,47 +216,52 @@ def task_convert_t0_to_md_time():
     for dirname in directories:
         yield make_single_transform(dirname,
                                     transforms.convert_tau0_to_md_time,
-                                    os.path.join(dirname, 'extract', 'extract-tau0.tsv'),
-                                    os.path.join(dirname, 'extract', 'extract-md_time.tsv'))
+                                    names.observable(dirname, 'tau0'),
+                                    names.observable(dirname, 'md_time'))
+
+def wflow_config_tasks(dirname, xml_file):
+    file_e = names.wflow_xml_shard_name(xml_file, 'e')
+    file_t2e = names.wflow_xml_shard_name(xml_file, 't2e')
+    file_w = names.wflow_xml_shard_name(xml_file, 'w')
+    file_t0 = names.wflow_xml_shard_name(xml_file, 't0')
+    file_w0 = names.wflow_xml_shard_name(xml_file, 'w0')
+
+    return [
+        make_cached_transform(dirname,
+                              wflow.io_convert_xml_to_tsv,
+                              xml_file,
+                              file_e),
+        make_single_transform(dirname,
+                              wflow.io_compute_t2_e,
+                              file_e,
+                              file_t2e),
+        make_single_transform(dirname,
+                              wflow.io_compute_w,
+                              file_e,
+                              file_w),
+        make_single_transform(dirname,
+                              wflow.io_compute_intersection,
+                              file_t2e,
+                              file_t0),
+        make_single_transform(dirname,
+                              wflow.io_compute_intersection,
+                              file_w,
+                              file_w0),
+    ]
+
 
 def task_wflow():
     for dirname in directories:
-        files_t0 = []
-        files_w0 = []
-
-        for xml_file in glob.glob(os.path.join(dirname, 'wflow', 'wflow.config-*.out.xml')):
-            file_e = names.wflow_xml_shard_name(xml_file, 'e')
-            file_t2e = names.wflow_xml_shard_name(xml_file, 't2e')
-            file_w = names.wflow_xml_shard_name(xml_file, 'w')
-            file_t0 = names.wflow_xml_shard_name(xml_file, 't0')
-            file_w0 = names.wflow_xml_shard_name(xml_file, 'w0')
-
-            files_t0.append(file_t0)
-            files_w0.append(file_w0)
+        xml_files = run_manifest.glob(dirname, 'wflow', 'wflow.config-*.out.xml')
+        files_t0 = [names.wflow_xml_shard_name(xml_file, 't0') for xml_file in xml_files]
+        files_w0 = [names.wflow_xml_shard_name(xml_file, 'w0') for xml_file in xml_files]
 
-            yield make_single_transform(dirname,
-                                        wflow.io_convert_xml_to_tsv,
-                                        xml_file,
-                                        file_e)
-            yield make_single_transform(dirname,
-                                        wflow.io_compute_t2_e,
-                                        file_e,
-                                        file_t2e)
-            yield make_single_transform(dirname,
-                                        wflow.io_compute_w,
-                                        file_e,
-                                        file_w)
-            yield make_single_transform(dirname,
-                                        wflow.io_compute_intersection,
-                                        file_t2e,
-                                        file_t0)
-            yield make_single_transform(dirname,
-                                        wflow.io_compute_intersection,
-                                        file_w,
-                                        file_w0)
+        for index, chunk in batch.group_chunks(xml_files, chunk_sizes['wflow']):
+            tasks = [task for xml_file in chunk for task in wflow_config_tasks(dirname, xml_file)]
+            yield batch.merge_tasks(os.path.join(dirname, 'wflow', 'chunk-' + index), tasks)
 
         for name, files in [('t0', files_t0), ('w0', files_w0)]:
-            path_out = names.wflow_tsv(dirname, name)
+            path_out = names.observable(dirname, name)
             yield {
                 'actions': [(wflow.merge_intersections, [files, path_out])],
                 'name': path_out,
@@ -191,8 +271,8 @@ def task_wflow():
 
         yield make_single_transform(dirname,
                                     wflow.io_w0_to_a,
-                                    names.tsv_extract(dirname, 'w0'),
-                                    names.tsv_extract(dirname, 'a_mev_from_w0'))
+                                    names.observable(dirname, 'w0'),
+                                    names.observable(dirname, 'a_mev_from_w0'))
 
 
 def make_single_transform(dirname, function, path_in, path_out, **kwargs):
@@ -204,8 +284,22 @@ def make_single_transform(dirname, function, path_in, path_out, **kwargs):
     }
 
 
+def make_cached_transform(dirname, function, path_in, path_out, **kwargs):
+    '''
+    Like ``make_single_transform`` for extractors that read large files, the
+    output is taken from the extraction cache if possible. The input file has
+    to be in the manifest, it is only checked by its stat tuple.
+    '''
+    return {
+        'actions': [(cache.cached_call, [function, [path_in, path_out], kwargs, [path_in], [path_out]])],
+        'name': path_out,
+        'uptodate': [manifest.stat_uptodate(run_manifest, [path_in])],
+        'targets': [path_out],
+    }
+
+
 def plot_generic(dirname, name, *args, **kwargs):
-    path_in = names.tsv_extract(dirname, name)
+    path_in = names.observable(dirname, name)
     path_out = names.plot(dirname, name)
 
     yield {
@@ -266,14 +360,16 @@ def task_make_plot():
 def task_correlators():
     for dirname in directories:
         for meson in ['pion', 'kaon']:
-            corr_tsv_files = []
-            for corr_xml in glob.glob(os.path.join(dirname, 'corr', 'corr.config-*.{}.xml.gz'.format(meson))):
-                corr_tsv = names.correlator_tsv(corr_xml, meson)
-                corr_tsv_files.append(corr_tsv)
-                yield make_single_transform(dirname,
-                                            correlators.io_extract_pion_corr,
-                                            corr_xml,
-                                            corr_tsv)
+            corr_xml_files = run_manifest.glob(dirname, 'corr', 'corr.config-*.{}.xml.gz'.format(meson))
+            corr_tsv_files = [names.correlator_tsv(corr_xml, meson) for corr_xml in corr_xml_files]
+
+            for index, chunk in batch.group_chunks(corr_xml_files, chunk_sizes['correlators']):
+                tasks = [make_cached_transform(dirname,
+                                               correlators.io_extract_pion_corr,
+                                               corr_xml,
+                                               names.correlator_tsv(corr_xml, meson))
+                         for corr_xml in chunk]
+                yield batch.merge_tasks(os.path.join(dirname, 'corr', '{}-chunk-{}'.format(meson, index)), tasks)
             
             if len(corr_tsv_files) > 0:
                 path_pion_mass = names.tsv_extract(dirname, meson + '_mass')
@@ -296,10 +392,27 @@ def task_correlators():
 def task_running_mean():
     for dirname in directories:
         for window in [100, 10]:
-            path_in = names.tsv_extract(dirname, 'AcceptP')
-            path_out = names.tsv_extract(dirname, 'AcceptP-running_mean_{}'.format(window))
+            path_in = names.observable(dirname, 'AcceptP')
+            path_out = names.observable(dirname, 'AcceptP-running_mean_{}'.format(window))
             yield make_single_transform(dirname,
                                         transforms.io_running_mean,
                                         path_in,
                                         path_out,
                                         window=window)
+
+
+# Observables that are written as TSV files for the analysis with other
+# tools.
+exported_observables = list(extractors.xmlfile.bits) + [
+    'DeltaDeltaH_over_DeltaH', 'exp_deltaH', 'minutes_for_trajectory', 'md_time',
+    't0', 'w0', 'a_mev_from_w0', 'AcceptP-running_mean_100', 'AcceptP-running_mean_10',
+]
+
+
+def task_export_tsv():
+    for dirname in directories:
+        for name in exported_observables:
+            yield make_single_transform(dirname,
+                                        observables.export_tsv,
+                                        names.observable(dirname, name),
+                                        names.tsv_extract(dirname, name))
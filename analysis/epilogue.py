@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Reduction of the logs of an HMC job at the end of the job script.
+
+While the allocation is still alive, the raw text and XML logs of the job are
+compressed into the ``hmc-out`` directory, the extractors write their shards
+next to them and the raw logs are removed. The raw logs may be on the local
+scratch disk of the node. ``slurm-<job>.out.xml`` becomes
+``hmc-out/hmc.<job>.out.xml.gz``, the other names are kept.
+
+A stamp with the size of the compressed log and the version of the extractor
+is written for each log. ``cached_call_unless_reduced`` is used by doit and
+``ingest.py`` instead of ``cache.cached_call`` and does not parse the log again
+as long as the stamp matches and the shards exist. ``call_unless_reduced`` does
+the same for the text logs, which are parsed incrementally and not cached.
+'''
+
+import argparse
+import concurrent.futures
+import fnmatch
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+import cache
+import extractors
+import names
+
+
+def reduced_name(raw, dest):
+    basename = os.path.basename(raw)
+    if basename.startswith('slurm-'):
+        basename = 'hmc.' + basename[len('slurm-'):]
+    if not basename.endswith('.gz'):
+        basename += '.gz'
+    return os.path.join(dest, basename)
+
+
+def extractor_for(path):
+    '''
+    :return: Tuple ``(function, kwargs, targets)`` with the extractor that the
+        pipeline uses for the compressed log or ``None`` if it is not a log.
+    '''
+    basename = os.path.basename(path)
+    if fnmatch.fnmatchcase(basename, 'hmc.*.out.txt.gz'):
+        return (extractors.logfile.parse_logfile_to_shard, {'incremental': True},
+                [names.log_shard(path), names.log_checkpoint(path)])
+    if fnmatch.fnmatchcase(basename, 'hmc.*.out.xml.gz') or fnmatch.fnmatchcase(basename, 'hmc.*.log.xml.gz'):
+        return (extractors.flatstore.flatten_to_shard, {},
+                [names.flat_shard(path), names.xpath_shard_meta(path)])
+    return None
+
+
+def compress(raw, path_out, level):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path_out), suffix='.gz')
+    with open(raw, 'rb') as f_in, os.fdopen(fd, 'wb') as f_raw, \
+            gzip.GzipFile(os.path.basename(raw), 'wb', level, f_raw) as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024**2)
+    os.replace(tmp, path_out)
+
+
+def write_stamp(path, function):
+    stamp = {
+        'size': os.path.getsize(path),
+        'function': cache.function_version(function),
+    }
+    stamp_path = names.reduction_stamp(path)
+    with open(stamp_path + '.tmp', 'w') as f:
+        json.dump(stamp, f)
+    os.replace(stamp_path + '.tmp', stamp_path)
+
+
+def has_node_shards(path, function, targets):
+    '''
+    Checks whether the shards of a log have been written by the epilogue and
+    are still valid for the current extractor.
+    '''
+    try:
+        with open(names.reduction_stamp(path)) as f:
+            stamp = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return False
+
+    return stamp['size'] == os.path.getsize(path) \
+        and stamp['function'] == cache.function_version(function) \
+        and all(os.path.isfile(target) for target in targets)
+
+
+def cached_call_unless_reduced(function, args=(), kwargs=None, inputs=(), outputs=()):
+    '''
+    Same as ``cache.cached_call`` but does nothing if the outputs have been
+    written by the epilogue from the same single input.
+    '''
+    if len(inputs) == 1 and has_node_shards(inputs[0], function, outputs):
+        return
+    cache.cached_call(function, args, kwargs, inputs, outputs)
+
+
+def call_unless_reduced(function, args=(), kwargs=None, inputs=(), outputs=()):
+    '''
+    Calls the function without the cache unless the outputs have been written
+    by the epilogue from the same single input.
+
+    This is for the incremental parse of text logs that are still growing.
+    Their cache key would need a hash of the whole log after every growth
+    step, which costs more than parsing the new part from the checkpoint.
+    '''
+    if len(inputs) == 1 and has_node_shards(inputs[0], function, outputs):
+        return
+    function(*args, **(kwargs or {}))
+
+
+def reduce_log(raw, dest, level=6, keep=False):
+    '''
+    Compresses a raw log, extracts the shards from the compressed log and
+    removes the raw one.
+
+    :return: Path of the compressed log.
+    '''
+    path = reduced_name(raw, dest)
+    compress(raw, path, level)
+
+    extractor = extractor_for(path)
+    if extractor is not None:
+        function, kwargs, targets = extractor
+        function(path, **kwargs)
+        write_stamp(path, function)
+
+    if not keep:
+        os.remove(raw)
+
+    return path
+
+
+def main():
+    options = _parse_args()
+
+    raws = [raw for raw in options.raw if os.path.isfile(raw)]
+    for raw in sorted(set(options.raw) - set(raws)):
+        print('{}: does not exist, skipping'.format(raw))
+
+    os.makedirs(options.dest, exist_ok=True)
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs) as executor:
+        futures = {executor.submit(reduce_log, raw, options.dest, options.level, options.keep): raw for raw in raws}
+        for future in concurrent.futures.as_completed(futures):
+            raw = futures[future]
+            try:
+                path = future.result()
+            except Exception as e:
+                print('{}: failed: {}'.format(raw, e))
+                failed += 1
+            else:
+                print('{}: {:.1f} MiB'.format(path, os.path.getsize(path) / 1024**2))
+
+    if failed > 0:
+        raise SystemExit(1)
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Compress the raw logs of a job into `hmc-out` and write the shards of the extractors next to them.')
+    parser.add_argument('raw', nargs='+', help='Raw text and XML logs of the job.')
+    parser.add_argument('--dest', default='hmc-out', help='Directory for the compressed logs. Default: %(default)s')
+    parser.add_argument('--level', type=int, default=6, help='gzip compression level. Default: %(default)s')
+    parser.add_argument('--keep', action='store_true', help='Keep the raw logs.')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of logs to reduce in parallel. Default: number of CPUs')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Executors for the independent extraction jobs of ``ingest.py``.
+
+A job is a tuple ``(function, path, targets)``. The function is called with
+the path and writes the targets, nothing is returned to the caller.
+``LocalExecutor`` runs the jobs in a process pool on this machine.
+``SlurmExecutor`` distributes them over the tasks of a Slurm array job, each
+array task runs its batch in a process pool on its compute node. The job is
+submitted with ``sbatch``, ``squeue`` is polled until it has finished and then
+the status files of the batches and the targets are collected. The commands
+can be replaced, ``fake_slurm.py`` runs the array tasks on this machine.
+'''
+
+import argparse
+import concurrent.futures
+import importlib
+import json
+import math
+import os
+import shlex
+import subprocess
+import sys
+import time
+import traceback
+
+
+# Job states in which an array task may still write its targets. Finished jobs
+# stay listed in a terminal state like ``COMPLETED`` for a while.
+ACTIVE_STATES = ['PENDING', 'RUNNING', 'CONFIGURING', 'COMPLETING', 'SUSPENDED']
+
+def _qualified_name(function):
+    module = function.__module__
+    if module == '__main__':
+        # The compute node has to import the script as a module.
+        module = os.path.splitext(os.path.basename(sys.modules['__main__'].__file__))[0]
+    return '{}:{}'.format(module, function.__name__)
+
+
+def _resolve(qualified_name):
+    module, name = qualified_name.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def _timed(function, path):
+    start = time.perf_counter()
+    function(path)
+    return time.perf_counter() - start
+
+
+def _print_throughput(path, duration):
+    megabytes = os.path.getsize(path) / 1024**2
+    print('{}: {:.1f} MiB in {:.2f} s, {:.1f} MiB/s'.format(
+        path, megabytes, duration, megabytes / max(duration, 1e-9)))
+
+
+def run_pool(jobs, workers=None):
+    '''
+    Runs the jobs in a process pool and prints the throughput of each file.
+
+    :return: Dictionary from the path to the duration in seconds or to
+        ``None`` if the job has failed.
+    '''
+    durations = {}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_timed, function, path): path for function, path, targets in jobs}
+
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                durations[path] = future.result()
+            except Exception as e:
+                print('{}: failed: {}'.format(path, e))
+                durations[path] = None
+            else:
+                _print_throughput(path, durations[path])
+            sys.stdout.flush()
+
+    return durations
+
+
+class LocalExecutor(object):
+    def __init__(self, workers=None):
+        self.workers = workers
+
+    def run(self, jobs):
+        '''
+        :return: List of the paths that failed.
+        '''
+        durations = run_pool(jobs, self.workers)
+        return [path for path, duration in durations.items() if duration is None]
+
+
+class SlurmExecutor(object):
+    '''
+    Runs the jobs as a Slurm array job.
+
+    :param str work_dir: Directory for the job script, the batches, the
+        status files and the output of the array tasks. It has to be on a
+        file system that the compute nodes can access.
+    :param int batch_size: Maximum number of files per array task.
+    :param list sbatch_options: Further options for ``#SBATCH`` lines, like
+        ``['--partition=batch', '--time=2:00:00']``.
+    :param str sbatch: Command to submit, may contain arguments.
+    :param str squeue: Command to query the queue, may contain arguments.
+    :param float poll_interval: Seconds between two queries of the queue.
+    :param int squeue_retries: Number of failed queries in a row, like
+        timeouts of the controller, after which the waiting is given up.
+    '''
+
+    def __init__(self, work_dir, batch_size=64, cpus_per_task=1, sbatch_options=(),
+                 sbatch='sbatch', squeue='squeue', poll_interval=30, squeue_retries=10):
+        self.work_dir = os.path.abspath(work_dir)
+        self.batch_size = batch_size
+        self.cpus_per_task = cpus_per_task
+        self.sbatch_options = sbatch_options
+        self.sbatch = shlex.split(sbatch)
+        self.squeue = shlex.split(squeue)
+        self.poll_interval = poll_interval
+        self.squeue_retries = squeue_retries
+
+    def make_batches(self, jobs):
+        '''
+        Distributes the jobs round robin. The jobs are sorted by size in
+        ``ingest.make_jobs``, so every batch gets large and small files.
+        '''
+        batch_count = math.ceil(len(jobs) / self.batch_size)
+        batches = [[] for i in range(batch_count)]
+        for i, (function, path, targets) in enumerate(jobs):
+            batches[i % batch_count].append([_qualified_name(function), os.path.abspath(path), targets])
+        return batches
+
+    def write_script(self, batch_count):
+        script_path = os.path.join(self.work_dir, 'array.sh')
+        lines = [
+            '#!/bin/bash',
+            '#SBATCH --job-name=hmc-ingest',
+            '#SBATCH --array=0-{}'.format(batch_count - 1),
+            '#SBATCH --cpus-per-task={}'.format(self.cpus_per_task),
+            '#SBATCH --output={}'.format(os.path.join(self.work_dir, 'slurm-%A_%a.out')),
+        ]
+        lines += ['#SBATCH {}'.format(option) for option in self.sbatch_options]
+        lines += [
+            '',
+            'set -e',
+            'cd {}'.format(shlex.quote(os.getcwd())),
+            '{} {} run-batch {} "$SLURM_ARRAY_TASK_ID" --workers "$SLURM_CPUS_PER_TASK"'.format(
+                shlex.quote(sys.executable), shlex.quote(os.path.abspath(__file__)), shlex.quote(self.work_dir)),
+            '',
+        ]
+        with open(script_path, 'w') as f:
+            f.write('\n'.join(lines))
+        return script_path
+
+    def submit(self, script_path):
+        '''
+        :return: Job ID.
+        '''
+        output = subprocess.check_output(self.sbatch + ['--parsable', script_path]).decode()
+        # With several clusters the output is `jobid;cluster`.
+        return output.strip().split(';')[0]
+
+    def is_queued(self, job_id):
+        '''
+        Queries whether any task of the job is still in one of the
+        ``ACTIVE_STATES``. Once the job has been purged from the controller,
+        ``squeue`` fails with "Invalid job id specified", then it has finished
+        as well. Other failures are retried after the poll interval.
+        '''
+        command = self.squeue + ['--noheader', '--format=%i', '--states={}'.format(','.join(ACTIVE_STATES)),
+                                 '--jobs={}'.format(job_id)]
+        for attempt in range(self.squeue_retries + 1):
+            if attempt > 0:
+                time.sleep(self.poll_interval)
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stderr = result.stderr.decode(errors='replace').strip()
+            if result.returncode == 0:
+                return len(result.stdout.strip()) > 0
+            if 'Invalid job id' in stderr:
+                return False
+            print('squeue failed with status {}: {}'.format(result.returncode, stderr))
+            sys.stdout.flush()
+
+        raise RuntimeError('squeue failed {} times in a row, giving up on job {}.'.format(attempt + 1, job_id))
+
+    def collect(self, batches):
+        '''
+        Reads the status files of the array tasks and checks that the targets
+        exist.
+
+        :return: List of the paths that failed.
+        '''
+        failed = []
+        for i, batch in enumerate(batches):
+            try:
+                with open(batch_status_path(self.work_dir, i)) as f:
+                    durations = json.load(f)
+            except (FileNotFoundError, ValueError):
+                # The array task has been killed or has not started at all.
+                print('Array task {} has not finished, see its output in {}.'.format(i, self.work_dir))
+                durations = {}
+
+            for function, path, targets in batch:
+                duration = durations.get(path)
+                if duration is None or not all(os.path.isfile(target) for target in targets):
+                    failed.append(path)
+                    print('{}: failed'.format(path))
+                else:
+                    _print_throughput(path, duration)
+
+        return failed
+
+    def run(self, jobs):
+        '''
+        :return: List of the paths that failed.
+        '''
+        if len(jobs) == 0:
+            return []
+
+        os.makedirs(self.work_dir, exist_ok=True)
+        batches = self.make_batches(jobs)
+        for i in range(len(batches)):
+            if os.path.exists(batch_status_path(self.work_dir, i)):
+                os.remove(batch_status_path(self.work_dir, i))
+        with open(batches_path(self.work_dir), 'w') as f:
+            json.dump(batches, f)
+
+        job_id = self.submit(self.write_script(len(batches)))
+        print('Submitted array job {} with {} tasks.'.format(job_id, len(batches)))
+        sys.stdout.flush()
+
+        while self.is_queued(job_id):
+            time.sleep(self.poll_interval)
+
+        return self.collect(batches)
+
+
+def batches_path(work_dir):
+    return os.path.join(work_dir, 'batches.json')
+
+
+def batch_status_path(work_dir, index):
+    return os.path.join(work_dir, 'status-{}.json'.format(index))
+
+
+def run_batch(work_dir, index, workers):
+    '''
+    Runs one batch on a compute node and writes the durations as its status
+    file, ``None`` marks a failed job.
+    '''
+    with open(batches_path(work_dir)) as f:
+        batch = json.load(f)[index]
+
+    jobs = []
+    for qualified_name, path, targets in batch:
+        try:
+            jobs.append((_resolve(qualified_name), path, targets))
+        except (ImportError, AttributeError):
+            traceback.print_exc()
+
+    durations = run_pool(jobs, workers)
+
+    status_path = batch_status_path(work_dir, index)
+    with open(status_path + '.tmp', 'w') as f:
+        json.dump(durations, f)
+    os.replace(status_path + '.tmp', status_path)
+
+
+def main():
+    options = _parse_args()
+
+    run_batch(options.work_dir, options.index, options.workers)
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Run one batch of a Slurm array job, this is called by the job script.')
+    parser.add_argument('command', choices=['run-batch'])
+    parser.add_argument('work_dir')
+    parser.add_argument('index', type=int)
+    parser.add_argument('--workers', type=int, help='Default: number of CPUs')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
@@ -11,16 +11,11 @@ except ImportError:
     def cprint(string, *args, **kwargs):
         print(string)
 
+from . import flatstore
+from . import gzindex
 from . import logfile
 from . import xmlfile
-import wflow
-
-
-def main(options):
-    for dirname in options.dirname:
-        wflow.process_directory(dirname)
-    xmlfile.main(options)
-    logfile.main(options)
+from . import xmlstream
 
 
 def print_progress(filename):
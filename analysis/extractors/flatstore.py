@@ -0,0 +1,436 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Column store with every leaf of every ``<Update>`` in the XML logs.
+
+Each XML file is flattened once without any knowledge of its schema. Every
+element without children that has a text becomes a row ``(update_no, path,
+value)``, where the path is the sequence of tags below ``<Update>``, like
+``HMCTrajectory/deltaH``. Repeated elements, like the ``leapP`` of every
+force evaluation, give several rows for the same path which are kept in
+document order. The leaves of the input parameters before the first update
+are stored separately with their absolute path, like
+``hmc/Input/Params/HMCTrj/MDIntegrator/tau0``.
+
+The rows are sorted by the path, such that all rows of one path are a
+contiguous slice given by the path index. Numbers are stored as floating
+point values, all other texts like ``true`` in a table of distinct strings.
+
+The per file shards are merged into one store per run. A new observable is
+then a query against this store instead of another pass over the XML files.
+The keys of ``extractors.xmlfile.bits`` are served from it as well.
+'''
+
+import array
+import json
+
+import numpy as np
+
+import names
+import observables
+import profiling
+
+from . import xmlfile
+
+
+_row_columns = ['update_no', 'order', 'value', 'text_id']
+_header_columns = ['header_shard', 'header_order', 'header_value', 'header_text_id']
+
+
+def _iter_leaves(elem, prefix, skip_tag=None):
+    '''
+    Yields the path and the text of every leaf below ``elem`` in document
+    order.
+
+    :param str skip_tag: Elements with this tag are left out together with
+        their children.
+    '''
+    for child in elem:
+        # Comments and processing instructions do not have a string as tag.
+        if not isinstance(child.tag, str) or child.tag == skip_tag:
+            continue
+        path = prefix + child.tag
+        if len(child) == 0:
+            if child.text is not None and child.text.strip() != '':
+                yield path, child.text
+        else:
+            yield from _iter_leaves(child, path + '/', skip_tag)
+
+
+class _Columns(object):
+    '''
+    Collects the rows of one file with compact arrays instead of lists.
+    '''
+
+    def __init__(self):
+        self.paths = {}
+        self.texts = {}
+        self.path_id = array.array('i')
+        self.update_no = array.array('q')
+        self.order = array.array('i')
+        self.value = array.array('d')
+        self.text_id = array.array('i')
+
+    def add(self, update_no, order, path, text):
+        self.path_id.append(self.paths.setdefault(path, len(self.paths)))
+        self.update_no.append(update_no)
+        self.order.append(order)
+        try:
+            self.value.append(float(text))
+            self.text_id.append(-1)
+        except ValueError:
+            self.value.append(np.nan)
+            self.text_id.append(self.texts.setdefault(text, len(self.texts)))
+
+    def arrays(self):
+        return {
+            'paths': _string_array(self.paths),
+            'texts': _string_array(self.texts),
+            'path_id': np.frombuffer(self.path_id, dtype=np.int32),
+            'update_no': np.frombuffer(self.update_no, dtype=np.int64),
+            'order': np.frombuffer(self.order, dtype=np.int32),
+            'value': np.frombuffer(self.value, dtype=np.float64),
+            'text_id': np.frombuffer(self.text_id, dtype=np.int32),
+        }
+
+
+def _string_array(ids):
+    '''
+    :param dict ids: Mapping from string to consecutive ids.
+    :return: Array of the strings ordered by their id.
+    '''
+    strings = sorted(ids, key=ids.get)
+    if len(strings) == 0:
+        return np.array([], dtype=str)
+    return np.array(strings, dtype=str)
+
+
+def _checked_names():
+    '''
+    :return: Set of the element names of the per update values in
+        ``extractors.xmlfile.bits``.
+    '''
+    return set(extractor.xpath.split('/')[-2] for extractor in xmlfile.bits.values() if not extractor.single)
+
+
+def flatten_file(xml_file):
+    '''
+    Flattens all complete updates of an XML file.
+
+    If an update occurs twice in the file, only the first occurrence is kept.
+    The values of ``extractors.xmlfile.bits`` in both occurrences have to be
+    the same, like in ``extractors.xmlfile.add_number``.
+
+    :return: Tuple with the store of the file and the status from
+        ``extractors.xmlfile.iter_complete_updates``.
+    '''
+    rows = _Columns()
+    header = _Columns()
+    checked_names = _checked_names()
+    seen = {}
+    status = xmlfile.new_status()
+
+    for update_no, update in xmlfile.iter_complete_updates(xml_file, status):
+        if len(seen) == 0:
+            # The parser reads ahead, so the following updates may already be
+            # in the document as well.
+            root = update.getroottree().getroot()
+            for order, (path, text) in enumerate(_iter_leaves(root, root.tag + '/', skip_tag='Update')):
+                header.add(0, order, path, text)
+
+        if update_no in seen:
+            checked = [(path, text) for path, text in _iter_leaves(update, '')
+                       if path.rsplit('/', 1)[-1] in checked_names]
+            assert seen[update_no] == checked, update_no
+            continue
+
+        checked = []
+        for order, (path, text) in enumerate(_iter_leaves(update, '')):
+            rows.add(update_no, order, path, text)
+            if path.rsplit('/', 1)[-1] in checked_names:
+                checked.append((path, text))
+        seen[update_no] = checked
+
+    updates = np.array(sorted(seen), dtype=np.int64)
+    columns = _combine([(rows.arrays(), header.arrays(), updates)])
+    return columns, status
+
+
+def _remap(tables):
+    '''
+    Unites several string tables.
+
+    :return: Tuple with the sorted union and one array per table which maps
+        the old ids to the ids in the union.
+    '''
+    union = np.unique(np.concatenate([table.astype(str) for table in tables] + [np.array([], dtype=str)]))
+    return union, [np.searchsorted(union, table).astype(np.int32) for table in tables]
+
+
+def _lookup(mapping, ids):
+    '''
+    Translates ids with a mapping from ``_remap`` and keeps ``-1``.
+    '''
+    result = np.full(len(ids), -1, dtype=np.int32)
+    valid = ids >= 0
+    result[valid] = mapping[ids[valid]]
+    return result
+
+
+def _combine(parts):
+    '''
+    Combines the columns of several files into a sorted store.
+
+    Updates that are already contained in an earlier part are dropped from
+    the later ones, like the same update in ``out.xml`` and ``log.xml``.
+
+    :param list parts: Tuples ``(rows, header, updates)``. ``rows`` and
+        ``header`` are dictionaries like from ``_Columns.arrays``, the
+        ``update_no`` of the header rows is ignored. ``updates`` are the
+        update numbers of the part.
+    :return: Dictionary with the arrays of the store.
+    '''
+    paths, path_maps = _remap([table for rows, header, updates in parts for table in (rows['paths'], header['paths'])])
+    texts, text_maps = _remap([table for rows, header, updates in parts for table in (rows['texts'], header['texts'])])
+
+    row_columns = {name: [] for name in ['path_id'] + _row_columns}
+    header_columns = {name: [] for name in ['header_path_id'] + _header_columns}
+    seen = np.array([], dtype=np.int64)
+    update_shard = []
+
+    for shard, (rows, header, updates) in enumerate(parts):
+        new_updates = np.setdiff1d(updates, seen)
+        keep = np.isin(rows['update_no'], new_updates)
+
+        row_columns['path_id'].append(path_maps[2 * shard][rows['path_id'][keep]])
+        row_columns['update_no'].append(rows['update_no'][keep])
+        row_columns['order'].append(rows['order'][keep])
+        row_columns['value'].append(rows['value'][keep])
+        row_columns['text_id'].append(_lookup(text_maps[2 * shard], rows['text_id'][keep]))
+
+        header_columns['header_path_id'].append(path_maps[2 * shard + 1][header['path_id']])
+        header_columns['header_shard'].append(np.full(len(header['path_id']), shard, dtype=np.int32))
+        header_columns['header_order'].append(header['order'])
+        header_columns['header_value'].append(header['value'])
+        header_columns['header_text_id'].append(_lookup(text_maps[2 * shard + 1], header['text_id']))
+
+        update_shard.append(np.column_stack([new_updates, np.full(len(new_updates), shard, dtype=np.int64)]))
+        seen = np.union1d(seen, new_updates)
+
+    dtypes = {'path_id': np.int32, 'update_no': np.int64, 'order': np.int32, 'value': np.float64,
+              'text_id': np.int32, 'header_path_id': np.int32, 'header_shard': np.int32,
+              'header_order': np.int32, 'header_value': np.float64, 'header_text_id': np.int32}
+    store = {name: np.concatenate(columns + [np.array([], dtype=dtypes[name])]).astype(dtypes[name])
+             for name, columns in list(row_columns.items()) + list(header_columns.items())}
+
+    # The rows are sorted by path such that the path index can point to the
+    # slice of each path.
+    order = np.lexsort((store['order'], store['update_no'], store['path_id']))
+    for name in ['path_id'] + _row_columns:
+        store[name] = store[name][order]
+    store['path_start'] = np.searchsorted(store['path_id'], np.arange(len(paths) + 1)).astype(np.int64)
+    del store['path_id']
+
+    update_shard = np.vstack(update_shard + [np.zeros((0, 2), dtype=np.int64)])
+    update_shard = update_shard[np.argsort(update_shard[:, 0])]
+    store['updates'] = update_shard[:, 0]
+    store['update_shard'] = update_shard[:, 1].astype(np.int32)
+
+    store['paths'] = paths
+    store['texts'] = texts
+    return store
+
+
+def _split(store):
+    '''
+    Inverse of ``_combine`` for a store with a single shard.
+    '''
+    path_id = np.repeat(np.arange(len(store['paths']), dtype=np.int32), np.diff(store['path_start']))
+    rows = {name: store[name] for name in _row_columns}
+    rows['path_id'] = path_id
+    rows['paths'] = store['paths']
+    rows['texts'] = store['texts']
+    header = {
+        'path_id': store['header_path_id'],
+        'order': store['header_order'],
+        'value': store['header_value'],
+        'text_id': store['header_text_id'],
+        'paths': store['paths'],
+        'texts': store['texts'],
+    }
+    return rows, header, store['updates']
+
+
+def save_store(path, store):
+    np.savez_compressed(path, **store)
+
+
+def load_store(path):
+    with np.load(path) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+@profiling.profiled
+def flatten_to_shard(xml_file):
+    '''
+    Flattens an XML file into its shard and writes the status of the file to
+    the metadata file ``names.xpath_shard_meta``.
+    '''
+    store, status = flatten_file(xml_file)
+    save_store(names.flat_shard(xml_file), store)
+
+    with open(names.xpath_shard_meta(xml_file), 'w') as f:
+        json.dump(status, f, indent=4, sort_keys=True)
+
+
+def merge_flat_shards(shard_names, merged_name):
+    '''
+    Merges the shards of the XML files of a run. If an update is contained in
+    several files, the first shard wins.
+    '''
+    store = _combine([_split(load_store(shard_name)) for shard_name in shard_names])
+    save_store(merged_name, store)
+
+
+class FlatStore(object):
+    '''
+    Queries against a flattened store.
+
+    Paths are written like simple XPath expressions. ``.//deltaH`` matches all
+    paths below ``<Update>`` that end in ``deltaH``, ``./HMCTrajectory/deltaH``
+    only that exact path. Expressions that start with ``//`` or ``/`` match
+    the paths of the input parameters in the same way. A trailing ``/text()``
+    is ignored.
+    '''
+
+    def __init__(self, path_or_store):
+        if isinstance(path_or_store, dict):
+            self.store = path_or_store
+        else:
+            self.store = load_store(path_or_store)
+        self.paths = [str(path) for path in self.store['paths']]
+
+    def match(self, xpath):
+        '''
+        :return: Tuple with a boolean whether the expression refers to the
+            input parameters and the list of matching path ids.
+        '''
+        if xpath.endswith('/text()'):
+            xpath = xpath[:-len('/text()')]
+
+        if xpath.startswith('.//'):
+            header, descendant, path = False, True, xpath[3:]
+        elif xpath.startswith('./'):
+            header, descendant, path = False, False, xpath[2:]
+        elif xpath.startswith('//'):
+            header, descendant, path = True, True, xpath[2:]
+        elif xpath.startswith('/'):
+            header, descendant, path = True, False, xpath[1:]
+        else:
+            raise ValueError('Unsupported path expression {}'.format(xpath))
+
+        if descendant:
+            ids = [i for i, candidate in enumerate(self.paths)
+                   if candidate == path or candidate.endswith('/' + path)]
+        else:
+            ids = [i for i, candidate in enumerate(self.paths) if candidate == path]
+
+        return header, ids
+
+    def counts(self):
+        '''
+        :return: List of tuples ``(path, rows)`` with the number of rows of
+            every path, including those of the input parameters.
+        '''
+        rows = np.diff(self.store['path_start']) + np.bincount(self.store['header_path_id'],
+                                                               minlength=len(self.paths))
+        return list(zip(self.paths, rows))
+
+    def _values(self, values, text_ids):
+        texts = self.store['texts']
+        return [float(value) if text_id < 0 else str(texts[text_id])
+                for value, text_id in zip(values, text_ids)]
+
+    def rows(self, xpath):
+        '''
+        Selects all rows of the matching paths below ``<Update>``.
+
+        :return: Tuple ``(update_no, order, values)`` sorted by update number
+            and document order. The values are floats or strings.
+        '''
+        header, ids = self.match(xpath)
+        if header:
+            raise ValueError('{} refers to the input parameters'.format(xpath))
+
+        start = self.store['path_start']
+        selection = np.concatenate([np.arange(start[i], start[i + 1]) for i in ids] + [np.array([], dtype=np.int64)])
+        update_no = self.store['update_no'][selection]
+        order = self.store['order'][selection]
+        sort = np.lexsort((order, update_no))
+        selection = selection[sort]
+
+        return (update_no[sort], order[sort],
+                self._values(self.store['value'][selection], self.store['text_id'][selection]))
+
+    def first(self, xpath):
+        '''
+        Selects the first match in every update, like ``xpath(update)[0]``.
+
+        :return: Tuple ``(update_no, values)``.
+        '''
+        header, ids = self.match(xpath)
+        if header:
+            return self.header(xpath)
+
+        update_no, order, values = self.rows(xpath)
+        unique, index = np.unique(update_no, return_index=True)
+        return unique, [values[i] for i in index]
+
+    def header(self, xpath):
+        '''
+        Assigns the first match in the input parameters of each file to all
+        updates that come from that file.
+
+        :return: Tuple ``(update_no, values)``.
+        '''
+        header, ids = self.match(xpath)
+        selection = np.where(np.isin(self.store['header_path_id'], ids))[0]
+        selection = selection[np.lexsort((self.store['header_order'][selection],
+                                          self.store['header_shard'][selection]))]
+        shards, index = np.unique(self.store['header_shard'][selection], return_index=True)
+        values = self._values(self.store['header_value'][selection[index]],
+                              self.store['header_text_id'][selection[index]])
+        by_shard = dict(zip(shards, values))
+
+        update_no = []
+        numbers = []
+        for update, shard in zip(self.store['updates'], self.store['update_shard']):
+            if shard in by_shard:
+                update_no.append(update)
+                numbers.append(by_shard[shard])
+        return np.array(update_no, dtype=np.int64), numbers
+
+    def extract(self, extractor):
+        '''
+        Serves an extractor from ``extractors.xmlfile``.
+
+        The transformation of the extractor gets the stored float instead of
+        the text for numeric values.
+
+        :return: Tuple ``(update_no_list, number_list)`` like the extractor.
+        '''
+        update_no, values = self.first(extractor.xpath)
+        return list(update_no), [extractor.transform(value) for value in values]
+
+
+@profiling.profiled
+def io_extract_key(path_in, key, path_out):
+    '''
+    Writes the observable column of a key of ``extractors.xmlfile.bits`` from
+    a store.
+    '''
+    update_no_list, number_list = FlatStore(path_in).extract(xmlfile.bits[key])
+    observables.write(path_out, np.array(update_no_list, dtype=np.int64), np.array(number_list, dtype=np.float64))
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Random access to single updates in gzip compressed Chroma logs.
+
+For every ``hmc.*.out.txt.gz``, ``hmc.*.out.xml.gz`` and ``hmc.*.log.xml.gz``
+an index is built once. It stores the byte ranges of each update in the
+decompressed stream, that is from one ``Doing Update:`` line to the next in
+text logs and the ``<Update>`` elements in XML files. Together with the
+decompressor restart points (zran index) from ``zran.GzipReader`` a single
+update can be read without decompressing everything before it.
+'''
+
+import argparse
+import json
+import os
+import re
+
+import names
+import zran
+
+
+INDEX_VERSION = 2
+
+doing_update_pattern = re.compile(rb'Doing Update: (\d+)')
+update_no_pattern = re.compile(rb'<update_no>(\d+)</update_no>')
+
+
+def is_xml(path):
+    return '.xml' in os.path.basename(path)
+
+
+def scan_log_updates(f):
+    '''
+    Finds the byte ranges of the updates in a text log.
+
+    :return: List of tuples ``(update_no, start, end)``.
+    '''
+    updates = []
+    offset = 0
+    current = None
+
+    for line in f:
+        m = doing_update_pattern.search(line)
+        if m:
+            if current is not None:
+                updates.append((current[0], current[1], offset))
+            current = (int(m.group(1)), offset)
+        offset += len(line)
+
+    if current is not None:
+        updates.append((current[0], current[1], offset))
+
+    return updates
+
+
+def scan_xml_updates(f):
+    '''
+    Finds the byte ranges of the ``<Update>`` elements in an XML file.
+
+    Updates without closing tag, as left by jobs that were killed, are not
+    included.
+
+    :return: List of tuples ``(update_no, start, end)``.
+    '''
+    updates = []
+    offset = 0
+    start = None
+    update_no = None
+
+    for line in f:
+        if start is None:
+            i = line.find(b'<Update>')
+            if i != -1:
+                start = offset + i
+                update_no = None
+
+        if start is not None:
+            if update_no is None:
+                m = update_no_pattern.search(line)
+                if m:
+                    update_no = int(m.group(1))
+
+            i = line.find(b'</Update>')
+            if i != -1:
+                if update_no is not None:
+                    updates.append((update_no, start, offset + i + len(b'</Update>')))
+                start = None
+
+        offset += len(line)
+
+    return updates
+
+
+def build_index(path, spacing=zran.DEFAULT_SPACING):
+    '''
+    Reads the gzip file once and writes the update index and the zran index
+    next to the shards.
+    '''
+    index_file = names.gz_index(path)
+    zran_file = names.gz_zran_index(path)
+
+    with zran.GzipReader(path, spacing=spacing) as f:
+        if is_xml(path):
+            updates = scan_xml_updates(f)
+        else:
+            updates = scan_log_updates(f)
+        points = f.points
+
+    with open(zran_file, 'w') as f:
+        json.dump([zran.point_to_json(point) for point in points], f)
+
+    index = {
+        'version': INDEX_VERSION,
+        'path': os.path.basename(path),
+        'size': os.path.getsize(path),
+        'mtime': os.path.getmtime(path),
+        'points': len(points),
+        'updates': updates,
+    }
+
+    with open(index_file, 'w') as f:
+        json.dump(index, f)
+
+    return index
+
+
+def load_index(path):
+    '''
+    Loads the index of the gzip file, rebuilding it if the file has changed.
+    '''
+    index_file = names.gz_index(path)
+
+    if os.path.isfile(index_file) and os.path.isfile(names.gz_zran_index(path)):
+        with open(index_file) as f:
+            index = json.load(f)
+
+        if index.get('version') == INDEX_VERSION \
+           and index['size'] == os.path.getsize(path) \
+           and index['mtime'] == os.path.getmtime(path):
+            return index
+
+    return build_index(path)
+
+
+class IndexedLog(object):
+    '''
+    Reads single updates from a gzip compressed log or XML file.
+
+    Use as a context manager::
+
+        with IndexedLog('hmc-out/hmc.1784081.out.xml.gz') as log:
+            update = etree.fromstring(log.read_update(120))
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.index = load_index(path)
+        self.ranges = {update_no: (start, end) for update_no, start, end in self.index['updates']}
+
+        with open(names.gz_zran_index(path)) as f:
+            points = [zran.point_from_json(point) for point in json.load(f)]
+        self.f = zran.GzipReader(path, points, spacing=None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def update_numbers(self):
+        return sorted(self.ranges.keys())
+
+    def read_update_bytes(self, update_no):
+        start, end = self.ranges[update_no]
+        self.f.seek(start)
+        return self.f.read(end - start)
+
+    def read_update(self, update_no):
+        return self.read_update_bytes(update_no).decode()
+
+    def read_update_lines(self, update_no):
+        return self.read_update(update_no).splitlines(True)
+
+
+def main():
+    options = _parse_args()
+
+    for dirname in options.dirname:
+        for path in names.layout.glob(dirname, 'hmc-out', 'hmc.*.gz'):
+            index = build_index(path, options.spacing)
+            print('{}: {} updates'.format(path, len(index['updates'])))
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Build random access indices for the gzip compressed logs of runs.')
+    parser.add_argument('dirname', nargs='+', help='Run directories containing `hmc-out`.')
+    parser.add_argument('--spacing', type=int, default=zran.DEFAULT_SPACING, help='Bytes between restart points. Default: %(default)s')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
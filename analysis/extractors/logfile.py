@@ -6,16 +6,20 @@
 import argparse
 import collections
 import glob
-import gzip
 import json
 import os
 import pprint
 import re
+import zlib
 
 import numpy as np
 
+import bytescan
 import extractors
 import names
+import profiling
+import transforms
+import zran
 
 
 patterns_before = {
@@ -50,90 +54,491 @@ patterns_resiuals = {
     'QPhiX Clover CG': re.compile(r'QPHIX_CLOVER_CG_SOLVER: \|\| r \|\| / \|\| b \|\| = ([\d.e+-]+)'),
 }
 
+# Wall-clock time of the phases of an update as tuples ``(phase, detail,
+# pattern)``. If the detail is ``None``, the first group of the pattern is the
+# detail, like the monomial or the measurement. The last group are the
+# seconds. The force time includes the solves done for the force. The momentum
+# refresh and the accept/reject step print no timings, only lines like
+# ``TwoFlavWilson4DMonomial: resetting Predictor after field refresh`` and
+# ``... before energy calc solve`` without seconds, so they have no phase.
+# Their solves are in the ``solver`` phase, the rest ends up in ``md_other``
+# of ``visualizers.plot_phases``.
+patterns_phases = [
+    ('solver', 'invcg2', re.compile(r'CG_SOLVER_TIME: ([\d.]+) sec')),
+    ('solver', 'QPhiX Clover M-Shift CG', re.compile(r'QPHIX_CLOVER_MULTI_SHIFT_CG_MDAGM_SOLVER: .* Time=([\d.]+) \(s\)')),
+    ('solver', 'QPhiX Clover BICGSTAB', re.compile(r'QPHIX_CLOVER_BICGSTAB_SOLVER: .* Time=([\d.]+) \(s\)')),
+    ('solver', 'QPhiX Clover CG', re.compile(r'QPHIX_CLOVER_CG_SOLVER: .* Time=([\d.]+) \(s\)')),
+    ('force', None, re.compile(r'FORCE TIME: (\S+) : ([\d.]+)')),
+    ('measurement', None, re.compile(r'(?!HMC:)(\w+): total time = ([\d.]+) secs')),
+    ('config_io', None, re.compile(r'(Gauge field [\w ]+): time= ?([\d.]+) secs')),
+]
 
-def parse_logfile_to_shard(logfile):
-    common = {}
-    results = {}
 
-    bucket_before = []
-    bucket_update = collections.defaultdict(list)
+def leading_literal(source):
+    '''
+    Returns the plain text that every match of the regular expression
+    ``source`` has to start with.
+    '''
+    if isinstance(source, bytes):
+        return leading_literal(source.decode()).encode()
 
-    if logfile.endswith('.gz'):
-        with gzip.open(logfile, 'rb') as f:
-            lines = [line.decode() for line in f]
-    else:
-        with open(logfile) as f:
-            lines = [line for line in f]
-
-    bucket = bucket_before
-    for line in lines:
-        m = doing_update_pattern.search(line)
-        if m:
-            update_no = int(m.group(1))
-            bucket = bucket_update[update_no]
-
-        bucket.append(line)
-
-    if len(bucket_update.keys()) > 0:
-        last_update = max(bucket_update.keys())
-        print(bucket_update[last_update])
-        last_line = bucket_update[last_update][-1]
-        secondlast_line = bucket_update[last_update][-2]
-        if not any(x.startswith('HMC: total time = ') for x in [last_line, secondlast_line]):
-            del bucket_update[last_update]
-
-    for line in bucket_before:
-        for key, (transform, pattern) in patterns_before.items():
-            m = pattern.match(line)
-            if m:
-                common[key] = transform(m.group(1))
+    for i, c in enumerate(source):
+        if c in '.^$*+?{}[]\\|()':
+            if c in '*+?{':
+                i -= 1
+            return source[:i]
+    return source
+
+
+class SolverPatternDispatcher(object):
+    '''
+    Matches log lines against all registered solver patterns in one go.
+
+    Every pattern starts with some plain text, like ``QPHIX_CLOVER_CG_SOLVER:``
+    or ``QDP:FlopCount:invcg2``. This literal prefix is searched for in the
+    whole text of an update block with ``str.find``, so lines which cannot
+    match are skipped without looking at them in Python. Patterns that are
+    used with ``match`` only consider occurrences at the start of a line.
+    Patterns whose prefixes start with the same text share one search. The order
+    of the values for each solver and metric is the order of the lines.
+
+    The patterns may also be ``bytes`` patterns, the text has to be ``bytes``
+    then as well.
+    '''
+
+    def __init__(self):
+        self.groups = collections.OrderedDict()
+
+    def register(self, solver, metric, pattern, search=False, transform=float):
+        literal = leading_literal(pattern.pattern)
+        if len(literal) == 0:
+            raise ValueError('Pattern {!r} does not start with plain text.'.format(pattern.pattern))
+
+        # Keep the prefixes free of each other such that every line is only
+        # looked at once per prefix.
+        for known in list(self.groups.keys()):
+            if literal.startswith(known):
+                literal = known
+                break
+            elif known.startswith(literal):
+                self.groups.setdefault(literal, []).extend(self.groups.pop(known))
+
+        method = pattern.search if search else pattern.match
+        self.groups.setdefault(literal, []).append((solver, metric, search, method, transform))
+
+    def register_all(self, patterns, metric, search=False, transform=float):
+        for solver, pattern in patterns.items():
+            self.register(solver, metric, pattern, search, transform)
+
+    def feed_text(self, text, solvers):
+        '''
+        Appends every value found in ``text`` to ``solvers[solver][metric]``.
+        '''
+        newline = b'\n' if isinstance(text, bytes) else '\n'
+
+        for literal, entries in self.groups.items():
+            i = text.find(literal)
+            while i != -1:
+                start = text.rfind(newline, 0, i) + 1
+                end = text.find(newline, i) + 1 or len(text)
+
+                for solver, metric, search, method, transform in entries:
+                    if search or i == start:
+                        m = method(text, start, end)
+                        if m:
+                            solvers[solver][metric].append(transform(m.group(1)))
+
+                i = text.find(literal, end)
+
+
+def make_solver_dispatcher():
+    '''
+    :return: Dispatcher with the solver patterns compiled for ``bytes``.
+    '''
+    dispatcher = SolverPatternDispatcher()
+    for patterns, metric, search in [(patterns_gflops, 'gflops', False),
+                                     (patterns_iterations, 'iters', False),
+                                     (patterns_resiuals, 'residuals', True)]:
+        for solver, pattern in patterns.items():
+            dispatcher.register(solver, metric, bytescan.compile_pattern(pattern.pattern), search)
+    return dispatcher
+
+
+solver_dispatcher_bytes = make_solver_dispatcher()
+
+flopcount_pattern_bytes = re.compile(
+    rb'QDP:FlopCount:(\S+) (?:Performance/CPU: t=([\d.]+)\(s\)'
+    rb'|Total performance:  ([\d.]+) Mflops = ([\d.]+) Gflops)')
+
+# Plain text that the lines of the phase patterns which do not start with
+# plain text contain.
+phase_literals = {
+    'measurement': ': total time = ',
+    'config_io': 'Gauge field ',
+}
+
+patterns_phases_bytes = [
+    (phase, detail,
+     (leading_literal(pattern.pattern) or phase_literals[phase]).encode(),
+     bytescan.compile_pattern(pattern.pattern))
+    for phase, detail, pattern in patterns_phases
+]
+
+doing_update_pattern_bytes = bytescan.compile_pattern(doing_update_pattern.pattern)
+
+patterns_before_bytes = {
+    key: (transform, bytescan.compile_pattern(pattern.pattern, anchored=True))
+    for key, (transform, pattern) in patterns_before.items()
+}
+
+
+def is_complete_block(block):
+    '''
+    Checks whether the run has finished after the given update block.
+
+    A finished run is signalled by ``HMC: total time =`` in one of the last
+    two lines. Otherwise the update is still running or the job has been
+    killed.
+    '''
+    return any(line.startswith(b'HMC: total time = ') for line in block.splitlines()[-2:])
+
+
+class UpdateBlockSplitter(object):
+    '''
+    Splits the raw bytes of a log into update blocks.
+
+    The log is fed as buffers that end at line breaks. Lines before the first
+    ``Doing Update:`` are matched against ``patterns_before`` and the results
+    are stored in ``common``. Each update block is emitted as soon as the next
+    one starts, so only the current block is held in memory. The state can be
+    saved and restored from the attributes such that a growing log can be
+    continued later on.
+    '''
+
+    def __init__(self, common=None, update_no=None, block=b''):
+        self.common = {} if common is None else common
+        self.update_no = update_no
+        self.pieces = [block] if block else []
+
+    @property
+    def block(self):
+        return b''.join(self.pieces)
+
+    def scan_header(self, data):
+        for key, (transform, pattern) in patterns_before_bytes.items():
+            for m in pattern.finditer(data):
+                self.common[key] = transform(m.group(1))
+
+    def feed(self, buffers):
+        '''
+        :param buffers: Iterable of ``bytes`` buffers that end at line breaks.
+        :return: Generator of tuples ``(update_no, block)``.
+        '''
+        for buf in buffers:
+            pos = 0
+            block_start = None
+
+            for m in doing_update_pattern_bytes.finditer(buf):
+                start = buf.rfind(b'\n', 0, m.start()) + 1
+                if start == block_start:
+                    # Only the first occurrence in a line counts.
+                    continue
+
+                if self.update_no is None:
+                    self.scan_header(buf[pos:start])
+                else:
+                    self.pieces.append(buf[pos:start])
+                    yield self.update_no, self.block
 
-    for update_no, lines in sorted(bucket_update.items()):
+                self.update_no = int(m.group(1))
+                self.pieces = []
+                pos = block_start = start
+
+            if self.update_no is None:
+                self.scan_header(buf[pos:])
+            else:
+                self.pieces.append(buf[pos:])
+
+    def pop_finished(self):
+        '''
+        Returns the current block if the run has finished after it, otherwise
+        ``None``.
+        '''
+        if self.update_no is not None:
+            block = self.block
+            if is_complete_block(block):
+                update_no = self.update_no
+                self.update_no = None
+                self.pieces = []
+                return update_no, block
+
+
+def iter_update_blocks(buffers, common):
+    '''
+    Splits the raw bytes of a log into the complete update blocks.
+
+    :param buffers: Iterable of ``bytes`` buffers that end at line breaks.
+    :param dict common: Dictionary to fill with the header fields.
+    :return: Generator of tuples ``(update_no, block)``.
+    '''
+    splitter = UpdateBlockSplitter(common)
+
+    for block in splitter.feed(buffers):
+        yield block
+
+    block = splitter.pop_finished()
+    if block is not None:
+        yield block
+
+
+def iter_parsed_blocks(blocks, common):
+    '''
+    :return: Generator of tuples ``(update_no, update_results)``.
+    '''
+    for update_no, block in blocks:
         try:
-            results[update_no] = parse_update_block(lines)
+            update_results = parse_update_bytes(block)
         except ValueError as e:
             print(e)
             continue
 
         # Copy common fields for each update.
         for key, val in common.items():
-            results[update_no][key] = val
+            update_results[key] = val
+
+        yield update_no, update_results
+
+
+def iter_parsed_updates(logfile):
+    '''
+    Parses a log file update by update.
+
+    The file is scanned as raw bytes, uncompressed files through a memory
+    map. Only the captured values are converted.
 
+    :return: Generator of tuples ``(update_no, update_results)``.
+    '''
+    common = {}
+    blocks = iter_update_blocks(bytescan.iter_buffers(logfile), common)
+    return iter_parsed_blocks(blocks, common)
+
+
+@profiling.profiled
+def parse_logfile_to_shard(logfile, incremental=False):
+    if incremental:
+        return update_logfile_shard(logfile)
+
+    results = {}
+
+    for update_no, update_results in iter_parsed_updates(logfile):
+        results[update_no] = update_results
+
+    transforms.write_log_columns(names.log_shard(logfile), results)
+
+    return results
+
+
+class TailReader(object):
+    '''
+    Iterates over the complete lines of a log file from a byte offset.
+
+    The offset is advanced past every buffer that has been handed out. A last
+    line without line break is still being written and is left for later, so
+    is the end of a gzip file that is still being written. For gzip files
+    ``point`` is the last restart point of the decompressor before the offset,
+    the next reader starts decompressing there instead of at the beginning.
+    '''
+
+    def __init__(self, logfile, offset, point=None):
+        self.logfile = logfile
+        self.offset = offset
+        self.point = point
+
+    def __iter__(self):
+        if not self.logfile.endswith('.gz'):
+            for buf in bytescan.iter_buffers(self.logfile, self.offset, complete_lines=True):
+                self.offset += len(buf)
+                yield buf
+            return
+
+        with zran.GzipReader(self.logfile, [] if self.point is None else [self.point]) as f:
+            f.seek(self.offset)
+            for buf in bytescan.iter_file_buffers(f, complete_lines=True):
+                self.offset += len(buf)
+                while f.points and f.points[0].out_offset <= self.offset:
+                    self.point = f.points.pop(0)
+                yield buf
+
+
+CHECKPOINT_VERSION = 4
+
+# Bytes at the beginning of the log file that have to stay the same.
+HEAD_SIZE = 4096
+
+
+def head_checksum(logfile, size=HEAD_SIZE):
+    '''
+    Computes the checksum of the first bytes of the log file as it is stored,
+    that is compressed for gzip files.
+
+    :return: Tuple ``(length, checksum)``. The length is less than ``size``
+        if the file is shorter.
+    '''
+    with open(logfile, 'rb') as f:
+        head = f.read(size)
+    return len(head), zlib.crc32(head)
+
+
+def load_checkpoint(logfile, shard_file, checkpoint_file):
+    '''
+    Loads the checkpoint of an earlier incremental run if it can be continued.
+
+    The checkpoint is discarded if the shard is gone, if the log file has
+    shrunk or if the beginning of the log file has changed. Only as many bytes
+    as there were in the file when the checkpoint was written are compared.
+    '''
+    if not (os.path.isfile(shard_file) and os.path.isfile(checkpoint_file)):
+        return None
+
+    with open(checkpoint_file) as f:
+        checkpoint = json.load(f)
+
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        return None
+    if os.path.getsize(logfile) < checkpoint['file_size']:
+        return None
+    head_size = checkpoint['head_size']
+    if head_checksum(logfile, head_size) != (head_size, checkpoint['head_checksum']):
+        return None
+
+    return checkpoint
+
+
+def update_logfile_shard(logfile):
+    '''
+    Parses only the part of the log file that has been appended since the last
+    call and adds the new updates to the existing shard.
+
+    A checkpoint next to the shard records the byte offset in the
+    (decompressed) log, the last complete update and the lines of the update
+    that was still running. For gzip files it also records a restart point of
+    the decompressor shortly before the offset, so only the new part of the
+    file is decompressed.
+    '''
     shard_file = names.log_shard(logfile)
-    with open(shard_file, 'w') as f:
-        json.dump(results, f, indent=4, sort_keys=True)
+    checkpoint_file = names.log_checkpoint(logfile)
+
+    checkpoint = load_checkpoint(logfile, shard_file, checkpoint_file)
+
+    if checkpoint is None:
+        results = {}
+        splitter = UpdateBlockSplitter()
+        offset = 0
+        point = None
+        last_update = None
+    else:
+        with transforms.read_log_columns(shard_file) as columns:
+            results = columns.to_results()
+        # The partial block is stored as Latin-1 such that arbitrary bytes
+        # survive the round trip through JSON.
+        splitter = UpdateBlockSplitter(checkpoint['common'],
+                                       checkpoint['partial_update'],
+                                       checkpoint['partial_block'].encode('latin-1'))
+        offset = checkpoint['offset']
+        point = zran.point_from_json(checkpoint['point'])
+        last_update = checkpoint['last_update']
+
+    reader = TailReader(logfile, offset, point)
+    blocks = list(splitter.feed(reader))
+    offset = reader.offset
+
+    block = splitter.pop_finished()
+    if block is not None:
+        blocks.append(block)
+
+    for update_no, update_results in iter_parsed_blocks(blocks, splitter.common):
+        results[update_no] = update_results
+        last_update = update_no
+
+    transforms.write_log_columns(shard_file, results)
+
+    checkpoint = {
+        'version': CHECKPOINT_VERSION,
+        'offset': offset,
+        'last_update': last_update,
+        'partial_update': splitter.update_no,
+        'partial_block': splitter.block.decode('latin-1'),
+        'common': splitter.common,
+        'point': zran.point_to_json(reader.point),
+        'file_size': os.path.getsize(logfile),
+    }
+    checkpoint['head_size'], checkpoint['head_checksum'] = head_checksum(logfile)
+
+    with open(checkpoint_file, 'w') as f:
+        json.dump(checkpoint, f)
 
     return results
 
 
 def parse_update_block(lines):
+    '''
+    Parses the lines of one update, they must still have their line endings.
+    '''
+    return parse_update_bytes(''.join(lines).encode())
+
+
+def parse_update_bytes(block):
+    '''
+    Parses the raw bytes of one update block.
+
+    The solver performance, iterations and residuals end up in ``solvers``.
+    Every ``QDP:FlopCount`` kernel is recorded in ``kernels`` with the
+    ``seconds`` from each ``Performance/CPU`` line and the ``mflops`` and
+    ``gflops`` from each ``Total performance`` line. The seconds spent in the
+    phases from ``patterns_phases`` are in ``phases``.
+    '''
     update_results = {
         'solvers': collections.defaultdict(lambda: collections.defaultdict(list)),
+        'kernels': collections.defaultdict(lambda: collections.defaultdict(list)),
+        'phases': collections.defaultdict(lambda: collections.defaultdict(list)),
     }
 
-    for line in lines:
-        for solver, pattern in patterns_gflops.items():
-            m = pattern.match(line)
-            if m:
-                gflops = float(m.group(1))
-                update_results['solvers'][solver]['gflops'].append(gflops)
+    solver_dispatcher_bytes.feed_text(block, update_results['solvers'])
+    parse_flopcount(block, update_results['kernels'])
+    parse_phases(block, update_results['phases'])
+
+    return update_results
 
-        for solver, pattern in patterns_iterations.items():
-            m = pattern.match(line)
-            if m:
-                iters = float(m.group(1))
-                update_results['solvers'][solver]['iters'].append(iters)
 
-        for solver, pattern in patterns_resiuals.items():
-            m = pattern.search(line)
+def parse_flopcount(block, kernels):
+    for m in flopcount_pattern_bytes.finditer(block):
+        if m.start() > 0 and block[m.start() - 1] != ord('\n'):
+            continue
+
+        kernel = kernels[m.group(1).decode()]
+        if m.group(2) is not None:
+            kernel['seconds'].append(float(m.group(2)))
+        else:
+            kernel['mflops'].append(float(m.group(3)))
+            kernel['gflops'].append(float(m.group(4)))
+
+
+def parse_phases(block, phases):
+    '''
+    Matches the phase patterns at the start of the lines that contain their
+    plain text. A ``(?m)^`` pattern would be tried at every line instead.
+    '''
+    for phase, detail, literal, pattern in patterns_phases_bytes:
+        i = block.find(literal)
+        while i != -1:
+            start = block.rfind(b'\n', 0, i) + 1
+            end = block.find(b'\n', i) + 1 or len(block)
+
+            m = pattern.match(block, start, end)
             if m:
-                try:
-                    iters = float(m.group(1))
-                except TypeError:
-                    print(m)
-                    print(m.groups())
-                    raise
+                if detail is None:
+                    phases[phase][m.group(1).decode()].append(float(m.group(2)))
                 else:
-                    update_results['solvers'][solver]['residuals'].append(iters)
+                    phases[phase][detail].append(float(m.group(1)))
 
-    return update_results
+            i = block.find(literal, end)
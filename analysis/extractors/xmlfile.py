@@ -3,137 +3,152 @@
 
 # Copyright © 2016-2017 Martin Ueding <mu@martin-ueding.de>
 
-import collections
-import glob
-import os
-
 from lxml import etree
-import numpy as np
 
-import extractors
-import names
-import transforms
+from . import xmlstream
 
 
-parser = etree.XMLParser(recover=False)
+def make_xpath_extractor(xpath, transform=float):
+    '''
+    Creates an extractor for a value that is contained in every ``<Update>``.
+    '''
+    def extractor(xml_file):
+        return extract_xpath_from_all(xml_file, xpath, transform)
+    extractor.xpath = xpath
+    extractor.transform = transform
+    extractor.single = False
+    return extractor
 
 
-def main(options):
-    for dirname in options.dirname:
-        try:
-            process_directory(dirname)
-        except FileNotFoundError as e:
-            print(e)
+def make_single_xpath_extractor(xpath, transform=float):
+    '''
+    Creates an extractor for a value that is given once for the whole file,
+    like the input parameters. It is assigned to every update in the file.
+    '''
+    def extractor(xml_file):
+        return extract_bits(xml_file, {xpath: extractor})[xpath]
+    extractor.xpath = xpath
+    extractor.transform = transform
+    extractor.single = True
+    return extractor
 
 
-def process_directory(dirname):
-    extractors.print_progress(dirname)
-    for key, extractor in bits.items():
-        extracted = extractor(dirname)
-        if extracted is not None:
-            extracted = list(extracted)
-            if len(extracted) != 0:
-                update_no_list, number_list = extracted
-                outfile = os.path.join(dirname, 'extract-{}.tsv'.format(key))
-                np.savetxt(outfile, np.column_stack([update_no_list, number_list]))
+def extract_xpath_from_all(xml_file, xpath, transform=float):
+    return extract_bits(xml_file, {xpath: make_xpath_extractor(xpath, transform)})[xpath]
 
-    transforms.convert_tau0_to_md_time(dirname)
-    transforms.convert_time_to_minutes(dirname)
 
-    for name in ['w_plaq', 'deltaH', 'n_steps']:
-        transforms.convert_to_md_time(dirname, name)
+update_no_xpath = etree.XPath('./update_no/text()')
 
 
-def extractor_to_shard(extractor, xml_file, key):
-    extracted = extractor(xml_file)
-    update_no_list, number_list = extracted
-    outfile = names.xpath_shard(xml_file, key)
-    np.savetxt(outfile, np.column_stack([update_no_list, number_list]))
+def add_number(numbers, update_no, number):
+    '''
+    Stores the number of an update. If the update occurs twice, the number
+    has to be the same.
+    '''
+    if update_no in numbers:
+        assert numbers[update_no] == number
+    else:
+        numbers[update_no] = number
 
 
-def make_xpath_extractor(xpath, transform=float):
-    def extractor(xml_file):
-        return extract_xpath_from_all(xml_file, xpath, transform)
-    return extractor
+def sorted_columns(numbers):
+    if len(numbers) == 0:
+        return [], []
+    return list(zip(*sorted(numbers.items())))
 
 
-def make_single_xpath_extractor(xpath, transform=float):
-    def extractor(xml_file):
-        update_no_list = []
-        number_list = []
-
-        step_sizes = {}
-
-        try:
-            tree = etree.parse(xml_file, parser)
-        except etree.XMLSyntaxError as e:
-            print('XML file could not be loaded')
-            print(e)
-        else:
-            if len(tree.xpath('//doHMC')) >= 0:
-                number = transform(tree.xpath(xpath)[0])
-
-                updates = tree.xpath('//Update')
-
-                for update in updates:
-                    update_no = int(update.xpath('./update_no/text()')[0])
-
-                    if update_no in update_no_list:
-                        # This number is already extracted for that update. Make
-                        # sure that the extracted value is the same.
-                        index = update_no_list.index(update_no)
-                        assert number_list[index] == number
-                    else:
-                        update_no_list.append(update_no)
-                        number_list.append(number)
+def extract_bits(xml_file, bits):
+    '''
+    Extracts several values from an XML file in a single streaming pass.
 
-        if len(update_no_list) == 0:
-            return [], []
-        else:
-            return list(zip(*sorted(zip(update_no_list, number_list))))
+    :param dict bits: Extractors created with ``make_xpath_extractor``
+        or ``make_single_xpath_extractor`` by key.
+    :return: Dictionary from key to the tuple ``(update_no_list,
+        number_list)``, sorted by update number.
+    '''
+    extracted, status = extract_bits_with_status(xml_file, bits)
+    return extracted
 
-    return extractor
 
+def new_status():
+    return {
+        'complete': True,
+        'last_complete_update': None,
+        'update_count': 0,
+        'error': None,
+    }
 
-def extract_xpath_from_all(xml_file, xpath, transform=float):
-    update_no_list = []
-    number_list = []
 
+def iter_complete_updates(xml_file, status):
+    '''
+    Yields the update number and the ``<Update>`` element of every complete
+    update in the file.
+
+    Jobs that hit the wall time leave XML files without the closing tags.
+    The iteration then stops at the point of truncation and this is recorded
+    in ``status``, a dictionary from ``new_status``.
+    '''
     try:
-        tree = etree.parse(xml_file, parser)
-    except etree.XMLSyntaxError as e:
-        print('XML file could not be loaded')
+        for update in xmlstream.iter_updates(xml_file):
+            update_no = int(update_no_xpath(update)[0])
+            yield update_no, update
+            status['last_complete_update'] = update_no
+            status['update_count'] += 1
+    except (etree.XMLSyntaxError, EOFError) as e:
+        # A truncated gzip stream raises an EOFError.
+        status['complete'] = False
+        status['error'] = str(e)
+        print('XML file {} is incomplete, keeping {} updates up to update {}'.format(
+            xml_file, status['update_count'], status['last_complete_update']))
         print(e)
-    else:
-        updates = tree.xpath('//Update')
-
-        for update in updates:
-            update_no = int(update.xpath('./update_no/text()')[0])
 
-            number_list_local = []
 
-            matches = update.xpath(xpath)
-            if len(matches) == 0:
-                print("No measurements of {} in XML file {}".format(xpath, xml_file))
-                continue
+def extract_bits_with_status(xml_file, bits):
+    '''
+    Like ``extract_bits`` and also tells whether the file could be read to
+    the end.
+
+    Jobs that hit the wall time leave XML files without the closing tags.
+    All ``<Update>`` elements that have been closed before the point of
+    truncation are kept.
+
+    :return: Tuple with the dictionary from ``extract_bits`` and a status
+        dictionary with the keys ``complete``, ``last_complete_update``,
+        ``update_count`` and ``error``.
+    '''
+    numbers = {key: {} for key in bits}
+    single_numbers = None
+    compiled = {key: etree.XPath(extractor.xpath) for key, extractor in bits.items()}
+    status = new_status()
+
+    for update_no, update in iter_complete_updates(xml_file, status):
+        if single_numbers is None:
+            # The input parameters precede the first update and are still in
+            # the document.
+            single_numbers = {}
+            for key, extractor in bits.items():
+                if extractor.single:
+                    matches = compiled[key](update)
+                    if len(matches) == 0:
+                        print("No value for {} in XML file {}".format(extractor.xpath, xml_file))
+                    else:
+                        single_numbers[key] = extractor.transform(matches[0])
 
-            number = transform(matches[0])
+        for key, number in single_numbers.items():
+            add_number(numbers[key], update_no, number)
 
-            if update_no in update_no_list:
-                # This number is already extracted for that update. Make sure
-                # that the extracted value is the same.
-                index = update_no_list.index(update_no)
-                assert number_list[index] == number
-            else:
-                update_no_list.append(update_no)
-                number_list.append(number)
+        for key, extractor in bits.items():
+            if extractor.single:
+                continue
 
-    if len(update_no_list) == 0:
-        return [], []
+            matches = compiled[key](update)
+            if len(matches) == 0:
+                print("No measurements of {} in XML file {}".format(extractor.xpath, xml_file))
+                continue
 
-    update_no_list, number_list = zip(*sorted(zip(update_no_list, number_list)))
+            add_number(numbers[key], update_no, extractor.transform(matches[0]))
 
-    return update_no_list, number_list
+    return {key: sorted_columns(numbers[key]) for key in bits}, status
 
 
 bits = {
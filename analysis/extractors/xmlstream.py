@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Streaming reader for the large XML files of Chroma.
+
+Loading the ``out.xml`` or ``log.xml`` of a long run with ``etree.parse``
+needs many times the file size in memory. Here the file is parsed with
+``etree.iterparse`` instead. Every completed ``<Update>`` is handed to the
+caller and then removed from the tree together with everything before it, so
+only a single update is held in memory.
+
+Gzip compressed files are decompressed in a background thread. ``zlib``
+releases the GIL, so inflating the next chunk and parsing the current one
+overlap. Files that end in the middle, like the ones of jobs that were
+killed, yield all complete updates before the error is raised.
+'''
+
+import queue
+import threading
+import zlib
+
+from lxml import etree
+
+
+# Compressed bytes read at once and largest decompressed chunk.
+READ_SIZE = 64 * 1024
+CHUNK_SIZE = 1024**2
+
+# Number of decompressed chunks that may wait for the parser.
+QUEUE_SIZE = 8
+
+
+class ThreadedGzipReader(object):
+    '''
+    File-like object that decompresses a gzip file in a background thread.
+    '''
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(queue_size)
+        self.stopped = threading.Event()
+        self.chunk = b''
+        self.pos = 0
+        self.eof = False
+
+        self.thread = threading.Thread(target=self._decompress, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            else:
+                return True
+        return False
+
+    def _decompress(self):
+        # The decompressor is used directly instead of ``gzip.open`` such that
+        # everything before the end of a truncated file is handed out before
+        # the ``EOFError``.
+        try:
+            with open(self.path, 'rb') as f:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                while True:
+                    pending = f.read(READ_SIZE)
+                    if not pending:
+                        break
+                    while pending:
+                        chunk = decompressor.decompress(pending, self.chunk_size)
+                        pending = decompressor.unconsumed_tail
+                        if decompressor.eof and decompressor.unused_data:
+                            # Another gzip member follows.
+                            pending = decompressor.unused_data
+                            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                        if chunk and not self._put(chunk):
+                            return
+
+            if not decompressor.eof:
+                raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+            self._put(b'')
+        except Exception as e:
+            self._put(e)
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self.pos == len(self.chunk):
+                if self.eof:
+                    break
+                chunk = self.queue.get()
+                if isinstance(chunk, Exception):
+                    raise chunk
+                if not chunk:
+                    self.eof = True
+                    break
+                self.chunk = chunk
+                self.pos = 0
+
+            if size < 0:
+                part = self.chunk[self.pos:]
+            else:
+                part = self.chunk[self.pos:self.pos + size]
+                size -= len(part)
+            self.pos += len(part)
+            parts.append(part)
+
+        return b''.join(parts)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_xml(path):
+    if path.endswith('.gz'):
+        return ThreadedGzipReader(path)
+    else:
+        return open(path, 'rb')
+
+
+def _drop_preceding(elem):
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
+
+
+def iter_elements(path, tag='Update', parent_tag=None):
+    '''
+    Yields the completed elements with the given tag one by one.
+
+    After the caller is done with an element, it is cleared and removed from
+    the tree together with its preceding siblings. The same is done with the
+    parent if it is an ``<elem>`` wrapper of an array. The elements before,
+    like the input parameters, stay in the document and can be reached with
+    absolute XPath expressions.
+
+    :param str parent_tag: Only yield elements with this parent. Use this for
+        tags like ``elem`` that also occur nested inside the element.
+    :raises etree.XMLSyntaxError: If the file is malformed or truncated. All
+        complete elements before that point have been yielded.
+    '''
+    with open_xml(path) as f:
+        for event, elem in etree.iterparse(f, events=('end',), tag=tag):
+            parent = elem.getparent()
+            if parent_tag is not None and (parent is None or parent.tag != parent_tag):
+                continue
+
+            yield elem
+
+            elem.clear()
+            _drop_preceding(elem)
+            if parent is not None and parent.tag == 'elem' and parent.getparent() is not None:
+                _drop_preceding(parent)
+
+
+def iter_updates(path):
+    '''
+    Yields the ``<Update>`` elements of a Chroma XML file.
+    '''
+    return iter_elements(path, 'Update')
@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Stand-in for ``sbatch`` and ``squeue`` to try the Slurm executor on a
+machine without Slurm, like
+
+    ingest.py --executor slurm --sbatch 'python3 fake_slurm.py sbatch' \\
+        --squeue 'python3 fake_slurm.py squeue' Runs
+
+``sbatch`` reads the ``--array`` and ``--output`` lines of the job script and
+runs the array tasks one after the other in a detached process. ``squeue``
+lists a job as ``RUNNING`` until that process has finished and then as
+``COMPLETED`` for ``FAKE_SLURM_MIN_JOB_AGE`` seconds, like ``MinJobAge`` of
+the controller. After that the job is purged and ``squeue`` fails with
+"Invalid job id specified". With ``FAKE_SLURM_FAIL_RATE`` that fraction of
+the queries fails like a timeout of the controller. The job IDs are kept in
+``FAKE_SLURM_DIR``, by default a directory in ``/tmp``. Only the options that
+``executors.SlurmExecutor`` uses are understood.
+'''
+
+import argparse
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def state_dir():
+    path = os.environ.get('FAKE_SLURM_DIR', os.path.join(tempfile.gettempdir(), 'fake-slurm'))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def running_path(job_id):
+    return os.path.join(state_dir(), '{}.running'.format(job_id))
+
+
+def done_path(job_id):
+    return os.path.join(state_dir(), '{}.done'.format(job_id))
+
+
+def job_state(job_id):
+    '''
+    :return: State of the job, ``None`` if it is unknown or has been purged.
+    '''
+    if os.path.exists(running_path(job_id)):
+        return 'RUNNING'
+    try:
+        age = time.time() - os.path.getmtime(done_path(job_id))
+    except FileNotFoundError:
+        return None
+    if age < float(os.environ.get('FAKE_SLURM_MIN_JOB_AGE', 300)):
+        return 'COMPLETED'
+    return None
+
+
+def next_job_id():
+    counter_path = os.path.join(state_dir(), 'counter')
+    try:
+        with open(counter_path) as f:
+            job_id = int(f.read()) + 1
+    except (FileNotFoundError, ValueError):
+        job_id = 1000
+    with open(counter_path, 'w') as f:
+        f.write(str(job_id))
+    return job_id
+
+
+def read_directives(script_path):
+    '''
+    :return: Dictionary with the ``#SBATCH`` options that have a value.
+    '''
+    directives = {}
+    with open(script_path) as f:
+        for line in f:
+            m = re.match(r'#SBATCH\s+--([\w-]+)=(\S+)', line)
+            if m:
+                directives[m.group(1)] = m.group(2)
+    return directives
+
+
+def array_indices(spec):
+    indices = []
+    for part in spec.split('%')[0].split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            indices += list(range(int(first), int(last) + 1))
+        else:
+            indices.append(int(part))
+    return indices
+
+
+def sbatch(script_path):
+    job_id = next_job_id()
+    with open(running_path(job_id), 'w') as f:
+        f.write(script_path)
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), 'run', str(job_id), script_path],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+    print(job_id)
+
+
+def run(job_id, script_path):
+    '''
+    Runs the array tasks of a submitted job.
+    '''
+    try:
+        directives = read_directives(script_path)
+        for index in array_indices(directives.get('array', '0')):
+            output = directives.get('output', 'slurm-%A_%a.out')
+            output = output.replace('%A', str(job_id)).replace('%a', str(index))
+            env = dict(os.environ, SLURM_ARRAY_JOB_ID=str(job_id), SLURM_ARRAY_TASK_ID=str(index),
+                       SLURM_CPUS_PER_TASK=directives.get('cpus-per-task', '1'))
+            with open(output, 'w') as f:
+                subprocess.call(['bash', script_path], env=env, stdout=f, stderr=subprocess.STDOUT)
+    finally:
+        os.replace(running_path(job_id), done_path(job_id))
+
+
+def squeue(job_ids, states=None):
+    '''
+    :param list states: States to list, all if ``None``.
+    :return: Exit status.
+    '''
+    if random.random() < float(os.environ.get('FAKE_SLURM_FAIL_RATE', 0)):
+        print('squeue: error: slurm_receive_msg: Socket timed out on send/recv operation', file=sys.stderr)
+        return 1
+
+    lines = []
+    for job_id in job_ids:
+        state = job_state(job_id)
+        if state is None:
+            print('slurm_load_jobs error: Invalid job id specified', file=sys.stderr)
+            return 1
+        if states is None or state in states:
+            lines.append(job_id)
+
+    for line in lines:
+        print(line)
+    return 0
+
+
+def main():
+    options = _parse_args()
+
+    if options.command == 'sbatch':
+        sbatch(options.args[-1])
+    elif options.command == 'squeue':
+        job_ids = []
+        states = None
+        for arg in options.args:
+            if arg.startswith('--jobs='):
+                job_ids += arg[len('--jobs='):].split(',')
+            elif arg.startswith('--states='):
+                states = arg[len('--states='):].upper().split(',')
+        sys.exit(squeue(job_ids, states))
+    elif options.command == 'run':
+        run(options.args[0], options.args[1])
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Pretend to be sbatch or squeue and run array jobs locally.')
+    parser.add_argument('command', choices=['sbatch', 'squeue', 'run'])
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,8 @@ import matplotlib.pyplot as pl
 import numpy as np
 import scipy.optimize as op
 
+from extractors import xmlstream
+
 
 def dandify_axes(ax):
     ax.grid(True)
@@ -30,33 +32,29 @@ def main():
 
     pp = pprint.PrettyPrinter()
 
-    print('Loading XML …')
-    tree = etree.parse(options.xml_file)
-
-    print('Extracting forces …')
-    forces_by_monomial = tree.xpath('//ForcesByMonomial')
-
     f_avg_dist = {}
     f_max_dist = {}
     f_sq_dist = {}
 
-    for force in forces_by_monomial:
-        for elem in force.iterchildren():
-            monomial_elem = elem.getchildren()[0]
-            monomial = monomial_elem.tag
-
-            if monomial not in f_avg_dist:
-                f_avg_dist[monomial] = []
-                f_max_dist[monomial] = []
-                f_sq_dist[monomial] = []
-
-            f_avg = float(monomial_elem.xpath('Forces/F_avg/text()')[0])
-            f_max = float(monomial_elem.xpath('Forces/F_max/text()')[0])
-            f_sq = float(monomial_elem.xpath('Forces/F_sq/text()')[0])
-
-            f_avg_dist[monomial].append(f_avg)
-            f_max_dist[monomial].append(f_max)
-            f_sq_dist[monomial].append(f_sq)
+    print('Extracting forces …')
+    for update in xmlstream.iter_updates(options.xml_file):
+        for force in update.xpath('.//ForcesByMonomial'):
+            for elem in force.iterchildren():
+                monomial_elem = elem.getchildren()[0]
+                monomial = monomial_elem.tag
+
+                if monomial not in f_avg_dist:
+                    f_avg_dist[monomial] = []
+                    f_max_dist[monomial] = []
+                    f_sq_dist[monomial] = []
+
+                f_avg = float(monomial_elem.xpath('Forces/F_avg/text()')[0])
+                f_max = float(monomial_elem.xpath('Forces/F_max/text()')[0])
+                f_sq = float(monomial_elem.xpath('Forces/F_sq/text()')[0])
+
+                f_avg_dist[monomial].append(f_avg)
+                f_max_dist[monomial].append(f_max)
+                f_sq_dist[monomial].append(f_sq)
 
 
     fig = pl.figure(figsize=(13, 10))
@@ -11,6 +11,8 @@ import matplotlib.pyplot as pl
 import numpy as np
 import scipy.optimize as op
 
+import bytescan
+
 perf_pattern = re.compile(r'QDP:FlopCount:(\S+) Total performance:  ([\d.]+) Mflops = ([\d.]+) Gflops = ([\d.]+) Tflops')
 nodes_pattern = re.compile(r'total number of nodes = (\d+)')
 jobid_pattern = re.compile(r'\D(\d{6})\D')
@@ -24,6 +26,12 @@ patterns = {
     'QPhiX Clover CG': re.compile(r'QPHIX_CLOVER_CG_SOLVER: .* Performance=([\d.]+) GFLOPS'),
 }
 
+scan_patterns = bytescan.compile_patterns(dict(
+    [(solver, pattern.pattern) for solver, pattern in patterns.items()],
+    nodes=nodes_pattern.pattern,
+    subgrid_volume=subgrid_volume_pattern.pattern,
+))
+
 
 def dandify_axes(ax):
     ax.grid(True)
@@ -52,25 +60,18 @@ def main():
         if m:
             jobid = int(m.group(1))
 
-        with open(hmc_log) as f:
-            for line in f:
-                m = nodes_pattern.search(line)
-                if m:
-                    nodes = int(m.group(1))
-
-                m = subgrid_volume_pattern.search(line)
-                if m:
-                    subgrid_volume = int(m.group(1))
-
-                for solver, pattern in patterns.items():
-                    m = pattern.search(line)
-                    if m:
-                        gflops = float(m.group(1))
-
-                        name = '{} @ {:2d}'.format(solver, nodes)
-                        if not name in perf:
-                            perf[name] = []
-                        perf[name].append(gflops / nodes)
+        for key, groups in bytescan.scan_file(hmc_log, scan_patterns):
+            if key == 'nodes':
+                nodes = int(groups[0])
+            elif key == 'subgrid_volume':
+                subgrid_volume = int(groups[0])
+            else:
+                gflops = float(groups[0])
+
+                name = '{} @ {:2d}'.format(key, nodes)
+                if not name in perf:
+                    perf[name] = []
+                perf[name].append(gflops / nodes)
 
         
     ll = reversed(sorted(perf.items(), key=lambda x: x[0].lower()))
@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Batch ingestion of all logs in a tree of runs without doit.
+
+The text and XML logs of all runs are parsed in a pool of processes with the
+same extractor functions that the doit tasks use, or with ``--executor
+slurm`` in an array job on the compute nodes, see ``executors.py``. The
+largest files are started first such that the slowest ones do not end up
+running alone at the end. Once all shards are there, they are merged into the ``extract``
+directory of each run.
+'''
+
+import argparse
+import glob
+import itertools
+import os
+import time
+
+import epilogue
+import executors
+import extractors
+import names
+import observables
+import transforms
+
+
+def find_runs(paths):
+    '''
+    Finds the run directories, that are the directories with an ``hmc-out``
+    subdirectory. Each path may be a run itself or contain runs.
+    '''
+    runs = []
+    for path in paths:
+        if os.path.isdir(os.path.join(path, 'hmc-out')):
+            runs.append(path)
+        else:
+            runs += sorted(os.path.dirname(hmc_out) for hmc_out in glob.glob(os.path.join(path, '*', 'hmc-out')))
+    return runs
+
+
+def text_logs(run):
+    return names.layout.glob(run, 'hmc-out', 'hmc.*.out.txt.gz')
+
+
+def xml_logs(run):
+    return sorted(itertools.chain(names.layout.glob(run, 'hmc-out', 'hmc.*.out.xml.gz'),
+                                  names.layout.glob(run, 'hmc-out', 'hmc.*.log.xml.gz')))
+
+
+def is_uptodate(source, targets):
+    if not all(os.path.isfile(target) for target in targets):
+        return False
+    mtime = os.path.getmtime(source)
+    return all(os.path.getmtime(target) >= mtime for target in targets)
+
+
+def text_targets(logfile):
+    return [names.log_shard(logfile), names.log_checkpoint(logfile)]
+
+
+def xml_targets(xml_file):
+    return [names.flat_shard(xml_file), names.xpath_shard_meta(xml_file)]
+
+
+def ingest_text_log(logfile):
+    '''
+    Worker function for a text log. The results are only written to the
+    shard, they do not need to travel back to the main process. The parse
+    continues from the checkpoint and does not use the cache.
+    '''
+    epilogue.call_unless_reduced(extractors.logfile.parse_logfile_to_shard, [logfile], {'incremental': True},
+                                 [logfile], text_targets(logfile))
+
+
+def ingest_xml_log(xml_file):
+    '''
+    Worker function for an XML log, it flattens all updates in a single
+    pass.
+    '''
+    epilogue.cached_call_unless_reduced(extractors.flatstore.flatten_to_shard, [xml_file], {},
+                                        [xml_file], xml_targets(xml_file))
+
+
+def make_jobs(runs, force=False):
+    '''
+    :return: List of tuples ``(function, path, targets)`` with the largest
+        files first.
+    '''
+    jobs = []
+    for run in runs:
+        for logfile in text_logs(run):
+            if force or not is_uptodate(logfile, text_targets(logfile)):
+                jobs.append((ingest_text_log, logfile, text_targets(logfile)))
+        for xml_file in xml_logs(run):
+            if force or not is_uptodate(xml_file, xml_targets(xml_file)):
+                jobs.append((ingest_xml_log, xml_file, xml_targets(xml_file)))
+
+    jobs.sort(key=lambda job: os.path.getsize(job[1]), reverse=True)
+    return jobs
+
+
+def make_executor(options):
+    if options.executor == 'slurm':
+        return executors.SlurmExecutor(options.work_dir, options.batch_size, options.cpus_per_task,
+                                       options.sbatch_option, options.sbatch, options.squeue,
+                                       options.poll_interval)
+    else:
+        return executors.LocalExecutor(options.jobs)
+
+
+def merge_run(run):
+    '''
+    Merges the shards of a run into its ``extract`` directory, just like the
+    merge tasks in ``dodo.py``.
+    '''
+    shard_names = [names.flat_shard(xml_file) for xml_file in xml_logs(run)]
+    shard_names = [shard_name for shard_name in shard_names if os.path.isfile(shard_name)]
+    flat_name = names.flat_extract(run)
+    extractors.flatstore.merge_flat_shards(shard_names, flat_name)
+    for key in extractors.xmlfile.bits:
+        extractors.flatstore.io_extract_key(flat_name, key, names.observable(run, key))
+        observables.export_tsv(names.observable(run, key), names.tsv_extract(run, key))
+
+    shard_names = [names.log_shard(logfile) for logfile in text_logs(run)]
+    shard_names = [shard_name for shard_name in shard_names if os.path.isfile(shard_name)]
+    if len(shard_names) > 0:
+        merged_name = names.log_extract(run)
+        transforms.merge_log_shards(shard_names, merged_name)
+        transforms.io_log_columns_to_long(merged_name, names.log_long(run))
+        transforms.io_kernel_breakdown(merged_name, names.kernels_long(run))
+        transforms.io_phase_breakdown(merged_name, names.observable(run, 'seconds_for_trajectory'),
+                                      names.phases_long(run))
+
+
+def main():
+    options = _parse_args()
+
+    runs = find_runs(options.path)
+    jobs = make_jobs(runs, options.force)
+    print('{} runs, {} files to parse'.format(len(runs), len(jobs)))
+
+    start = time.perf_counter()
+    failed = make_executor(options).run(jobs)
+
+    for run in runs:
+        extractors.print_progress(run)
+        merge_run(run)
+
+    print('Done in {:.1f} s, {} failed'.format(time.perf_counter() - start, len(failed)))
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Parse all logs of a tree of runs in parallel and merge them into the extract directories.')
+    parser.add_argument('path', nargs='+', help='Run directories or directories containing runs, like `Runs`.')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of worker processes. Default: number of CPUs')
+    parser.add_argument('--force', action='store_true', help='Parse all files, also those whose shards are up to date.')
+    parser.add_argument('--executor', choices=['local', 'slurm'], default='local', help='Parse in a process pool on this machine or in a Slurm array job. Default: %(default)s')
+
+    slurm = parser.add_argument_group('Slurm')
+    slurm.add_argument('--work-dir', default='ingest-slurm', help='Directory for the job script, the batches and the output, it has to be visible on the compute nodes. Default: %(default)s')
+    slurm.add_argument('--batch-size', type=int, default=64, help='Maximum number of files per array task. Default: %(default)s')
+    slurm.add_argument('--cpus-per-task', type=int, default=1, help='Number of worker processes per array task. Default: %(default)s')
+    slurm.add_argument('--sbatch-option', action='append', default=[], help='Additional option for the job script, like `--sbatch-option=--time=2:00:00`. Can be given multiple times.')
+    slurm.add_argument('--sbatch', default='sbatch', help='Submit command. Default: %(default)s')
+    slurm.add_argument('--squeue', default='squeue', help='Queue command. Default: %(default)s')
+    slurm.add_argument('--poll-interval', type=float, default=30, help='Seconds between two queries of the queue. Default: %(default)s')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
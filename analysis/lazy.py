@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Deferred imports of the large libraries.
+
+``dodo.py`` imports all the analysis modules to generate the tasks, but most
+runs of doit only execute a few of them or none at all. Matplotlib, SciPy and
+pandas take longer to import than the task generation itself, so the modules
+use stand-ins from ``lazy_import`` which import the library on the first
+attribute access.
+'''
+
+import importlib
+
+
+class LazyModule(object):
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        module = self._load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            # Submodules like ``scipy.stats`` are not necessarily imported
+            # with their package.
+            return importlib.import_module(self._name + '.' + attr)
+
+    def __repr__(self):
+        return '<lazy module {}>'.format(self._name)
+
+
+def lazy_import(name):
+    '''
+    Use ``pl = lazy_import('matplotlib.pyplot')`` instead of ``import
+    matplotlib.pyplot as pl``.
+    '''
+    return LazyModule(name)
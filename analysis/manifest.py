@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Manifest of the input files in a tree of runs.
+
+Finding the logs with ``glob`` in every task generator and letting doit hash
+every large log as a ``file_dep`` makes even ``doit list`` slow on a tree with
+thousands of logs. Instead the input directories of all runs are walked once
+with ``os.scandir`` and the size, modification time and inode of every file
+are recorded in the manifest. The task generators select their input files
+from the manifest and doit decides with ``stat_uptodate`` whether an input has
+changed by comparing these stat tuples. Only when they differ, the task is
+run again, and the extraction cache hashes the file contents then.
+'''
+
+import argparse
+import fnmatch
+import json
+import os
+
+import names
+
+
+MANIFEST_VERSION = 1
+
+# Subdirectories of a run that contain input files.
+input_dirs = ['hmc-out', 'wflow', 'corr']
+
+
+def manifest_path(root):
+    return os.path.join(root, '.hmc-manifest.json')
+
+
+def _stat_tuple(st):
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def scan(root, runs=None):
+    '''
+    Walks the input directories of all runs below ``root`` with
+    ``names.layout``.
+
+    :param list runs: Names of the runs to walk, all runs if ``None``.
+    :return: Tuple with the sorted list of run directories and a dictionary
+        from the path of every input file to its stat tuple ``[size,
+        mtime_ns, inode]``. The paths are relative to ``root``.
+    '''
+    directories = []
+    files = {}
+
+    if runs is None:
+        with os.scandir(root) as entries:
+            runs = [entry.name for entry in entries if entry.is_dir() and not entry.name.startswith('.')]
+    else:
+        runs = [run for run in runs if os.path.isdir(os.path.join(root, run))]
+
+    for run in runs:
+        directories.append(run)
+
+        # The walk also fills the index of the layout, the path functions
+        # then know which directories exist already.
+        run_path = os.path.normpath(os.path.join(root, run))
+        for input_dir in input_dirs:
+            for entry in names.layout.files(run_path, input_dir):
+                files[os.path.join(run, input_dir, entry.name)] = _stat_tuple(entry.stat())
+
+    return sorted(directories), files
+
+
+class Manifest(object):
+    def __init__(self, directories, files):
+        self.directories = directories
+        self.files = files
+
+    def glob(self, directory, input_dir, pattern):
+        '''
+        Selects the files of a run like ``glob.glob`` would.
+
+        :return: Sorted list of paths.
+        '''
+        prefix = os.path.join(directory, input_dir) + os.sep
+        return sorted(path for path in self.files
+                      if path.startswith(prefix) and fnmatch.fnmatchcase(path[len(prefix):], pattern))
+
+    def stat(self, path):
+        return self.files.get(path)
+
+    def to_json(self):
+        return {'version': MANIFEST_VERSION, 'directories': self.directories, 'files': self.files}
+
+
+def load(root='.'):
+    '''
+    :return: Manifest as written by ``refresh`` or ``None`` if there is no
+        usable one.
+    '''
+    try:
+        with open(manifest_path(root)) as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if data.get('version') != MANIFEST_VERSION:
+        return None
+
+    return Manifest(data['directories'], data['files'])
+
+
+def refresh(root='.', runs=None):
+    '''
+    Walks the tree once and rewrites the manifest if anything has changed.
+
+    :param list runs: Names of the runs to walk. The entries of the other runs
+        are taken from the previous manifest. All runs are walked if ``None``.
+    '''
+    current = Manifest(*scan(root, runs))
+    previous = load(root)
+
+    if runs is not None and previous is not None:
+        prefixes = tuple(run + os.sep for run in runs)
+        files = {path: stat for path, stat in previous.files.items() if not path.startswith(prefixes)}
+        files.update(current.files)
+        directories = sorted(set(previous.directories).difference(runs).union(current.directories))
+        current = Manifest(directories, files)
+
+    if previous is None or previous.to_json() != current.to_json():
+        path = manifest_path(root)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(current.to_json(), f, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+    return current
+
+
+def stat_uptodate(manifest, paths):
+    '''
+    Creates an ``uptodate`` checker for doit that is used instead of
+    ``file_dep`` for large input files.
+
+    The task is up to date if the stat tuples of the input files are the same
+    as the last time the task was run successfully. The targets are checked
+    by doit as usual. The stat tuples are saved under one key per file, so a
+    task can have several of these checkers.
+    '''
+    current = {'input_stat:' + path: manifest.stat(path) for path in paths}
+
+    def uptodate(task, values):
+        task.value_savers.append(lambda: current)
+        return all(values.get(key) == stat for key, stat in current.items())
+
+    return uptodate
+
+
+def main():
+    options = _parse_args()
+
+    manifest = refresh(options.root)
+    print('{}: {} runs, {} input files, {:.1f} GiB'.format(
+        manifest_path(options.root), len(manifest.directories), len(manifest.files),
+        sum(size for size, mtime, ino in manifest.files.values()) / 1024**3))
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Refresh the manifest of the input files in a tree of runs.')
+    parser.add_argument('root', nargs='?', default='.', help='Directory that contains the runs. Default: %(default)s')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,101 @@
 # Copyright © 2017-2018 Martin Ueding <mu@martin-ueding.de>
 
+import fnmatch
 import re
 import os
 
 
+# Subdirectories of a run that are indexed by ``Layout.index_run``. They are
+# walked recursively, so the ``shard`` directories of the input directories
+# are included.
+indexed_dirs = ['hmc-out', 'wflow', 'corr', 'shard']
+
+
+class Layout(object):
+    '''
+    Directories and files of the runs as far as this process knows them.
+
+    The path functions below are called for every task while doit builds the
+    task graph, calling ``os.makedirs`` each time is a metadata round trip to
+    the parallel file system. Directories that have been created or seen in
+    the index are remembered and not created again.
+
+    The index of a run is built with a single ``os.scandir`` walk over its
+    indexed subdirectories and answers ``glob`` without further system calls.
+    Files created after the walk are not in the index, a long running process
+    has to call ``forget`` before it looks at the tree again.
+    '''
+
+    def __init__(self):
+        self.forget()
+
+    def forget(self):
+        self.existing = set()
+        self.entries = {}
+        self.indexed = set()
+
+    def make_dir(self, dirname):
+        if dirname in self.existing:
+            return
+        os.makedirs(dirname, exist_ok=True)
+        self.existing.add(dirname)
+
+    def _walk(self, dirname):
+        try:
+            it = os.scandir(dirname)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        self.existing.add(dirname)
+        files = []
+        subdirs = []
+        with it:
+            for entry in it:
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    files.append(entry)
+        files.sort(key=lambda entry: entry.name)
+        self.entries[dirname] = files
+        for subdir in subdirs:
+            self._walk(subdir)
+
+    def index_run(self, run):
+        '''
+        Walks the indexed subdirectories of a run once.
+        '''
+        if run in self.indexed:
+            return
+        self.indexed.add(run)
+        self.existing.add(run)
+        for subdir in indexed_dirs:
+            self._walk(os.path.join(run, subdir))
+
+    def files(self, run, subdir):
+        '''
+        :param str run: Run directory.
+        :param str subdir: One of the indexed subdirectories or a directory
+            below one of them, like ``hmc-out/shard/flat``.
+        :return: List of ``os.DirEntry`` of the files in the directory, sorted
+            by name.
+        '''
+        self.index_run(run)
+        return self.entries.get(os.path.join(run, subdir), [])
+
+    def glob(self, run, subdir, pattern):
+        '''
+        Selects files like ``glob.glob(os.path.join(run, subdir, pattern))``.
+
+        :return: Sorted list of paths.
+        '''
+        return [entry.path for entry in self.files(run, subdir) if fnmatch.fnmatchcase(entry.name, pattern)]
+
+
+layout = Layout()
+
+
 def _make_dir(filename):
     dirname = os.path.dirname(filename)
-    os.makedirs(dirname, exist_ok=True)
+    layout.make_dir(dirname)
 
 
 def _ensure_dir(function):
@@ -34,21 +123,57 @@ def wflow_xml_shard_name(xml_file, key):
 
 
 @_ensure_dir
-def wflow_tsv(dirname, name):
-    path_out = os.path.join(dirname, 'extract', 'extract-{}.tsv'.format(name))
-    return path_out
+def log_shard(logfile):
+    dirname = os.path.dirname(logfile)
+    basename = os.path.basename(logfile)
+    return os.path.join(dirname, 'shard', 'logfile', 'shard-' + basename + '.npz')
 
 
 @_ensure_dir
-def log_shard(logfile):
+def log_checkpoint(logfile):
+    dirname = os.path.dirname(logfile)
+    basename = os.path.basename(logfile)
+    return os.path.join(dirname, 'shard', 'logfile', 'checkpoint-' + basename + '.json')
+
+
+@_ensure_dir
+def gz_index(path):
+    dirname = os.path.dirname(path)
+    basename = os.path.basename(path)
+    return os.path.join(dirname, 'shard', 'index', 'index-' + basename + '.json')
+
+
+@_ensure_dir
+def gz_zran_index(path):
+    dirname = os.path.dirname(path)
+    basename = os.path.basename(path)
+    return os.path.join(dirname, 'shard', 'index', 'index-' + basename + '.zran')
+
+
+@_ensure_dir
+def reduction_stamp(path):
+    dirname = os.path.dirname(path)
+    basename = os.path.basename(path)
+    return os.path.join(dirname, 'shard', 'epilogue', 'stamp-' + basename + '.json')
+
+
+@_ensure_dir
+def slim_log(logfile):
     dirname = os.path.dirname(logfile)
     basename = os.path.basename(logfile)
-    return os.path.join(dirname, 'shard', 'logfile', 'shard-' + basename + '.json')
+    return os.path.join(dirname, 'slim', basename)
+
+
+@_ensure_dir
+def slim_manifest(logfile):
+    dirname = os.path.dirname(logfile)
+    basename = os.path.basename(logfile)
+    return os.path.join(dirname, 'slim', basename + '.manifest.json')
 
 
 @_ensure_dir
 def log_extract(directory):
-    return os.path.join(directory, 'extract', 'extract-log.json')
+    return os.path.join(directory, 'extract', 'extract-log.npz')
 
 
 @_ensure_dir
@@ -57,15 +182,37 @@ def log_long(directory):
 
 
 @_ensure_dir
-def xpath_shard(xml_file, key):
+def kernels_long(directory):
+    return os.path.join(directory, 'extract', 'kernels-long.csv')
+
+
+@_ensure_dir
+def phases_long(directory):
+    return os.path.join(directory, 'extract', 'phases-long.csv')
+
+
+@_ensure_dir
+def xpath_shard_meta(xml_file):
     dirname = os.path.dirname(xml_file)
     basename = os.path.basename(xml_file)
-    return os.path.join(dirname, 'shard', 'xmlfile', 'shard-{}-{}.tsv'.format(basename, key))
+    return os.path.join(dirname, 'shard', 'xmlfile', 'meta-{}.json'.format(basename))
+
+
+@_ensure_dir
+def flat_shard(xml_file):
+    dirname = os.path.dirname(xml_file)
+    basename = os.path.basename(xml_file)
+    return os.path.join(dirname, 'shard', 'flat', 'flat-{}.npz'.format(basename))
+
+
+@_ensure_dir
+def flat_extract(directory):
+    return os.path.join(directory, 'extract', 'extract-flat.npz')
 
 
 @_ensure_dir
-def xmllog_extract(directory, key):
-    return os.path.join(directory, 'extract', 'extract-{}.tsv'.format(key))
+def observable(dirname, name):
+    return os.path.join(dirname, 'extract', 'observables', '{}.npy'.format(name))
 
 
 @_ensure_dir
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Column store for the observables of a run.
+
+Every observable that is given per update, like the plaquette or the time per
+trajectory, is a column in ``extract/observables/<name>.npy``. Each column is
+a structured array with the fields ``update_no`` and ``value`` sorted by the
+update number. The files are read memory mapped, so a transformation that
+only needs a few updates does not load the whole column. Writing goes to a
+temporary file which then replaces the column, such that a reader never sees
+a partially written column.
+
+The TSV files ``extract/extract-<name>.tsv`` are views of the columns and are
+written with ``export_tsv``, either from doit or with the command line of
+this module.
+'''
+
+import argparse
+import glob
+import os
+import tempfile
+
+import numpy as np
+
+import names
+
+
+dtype = np.dtype([('update_no', '<i8'), ('value', '<f8')])
+
+
+def read(path):
+    '''
+    :return: Tuple ``(update_no, values)`` of memory mapped arrays.
+    '''
+    data = np.load(path, mmap_mode='r')
+    return data['update_no'], data['value']
+
+
+def write(path, update_no, values):
+    '''
+    Replaces a column atomically. The rows are sorted by the update number.
+    '''
+    update_no = np.asarray(update_no)
+    values = np.asarray(values)
+    order = np.argsort(update_no, kind='stable')
+
+    data = np.zeros(len(update_no), dtype=dtype)
+    data['update_no'] = update_no[order]
+    data['value'] = values[order]
+
+    names.layout.make_dir(os.path.dirname(path))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.npy')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, data)
+    os.replace(tmp, path)
+
+
+def append(path, update_no, values):
+    '''
+    Adds updates to a column. If an update is in the column already, its
+    value is replaced.
+    '''
+    update_no = np.asarray(update_no, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+
+    if os.path.isfile(path):
+        old_update_no, old_values = read(path)
+        keep = ~np.isin(old_update_no, update_no)
+        update_no = np.concatenate([old_update_no[keep], update_no])
+        values = np.concatenate([old_values[keep], values])
+
+    write(path, update_no, values)
+
+
+def export_tsv(path_in, path_out):
+    '''
+    Writes a column as a TSV file with the update number and the value, like
+    the files that the transformations used to write.
+    '''
+    update_no, values = read(path_in)
+    if len(update_no) == 0:
+        np.savetxt(path_out, [])
+    else:
+        np.savetxt(path_out, np.column_stack([update_no, values]))
+
+
+def column_names(dirname):
+    pattern = os.path.join(dirname, 'extract', 'observables', '*.npy')
+    return sorted(os.path.basename(path)[:-len('.npy')] for path in glob.glob(pattern))
+
+
+def export_run(dirname):
+    '''
+    Exports all columns of a run as TSV files.
+    '''
+    for name in column_names(dirname):
+        export_tsv(names.observable(dirname, name), names.tsv_extract(dirname, name))
+
+
+def main():
+    options = _parse_args()
+
+    if options.command == 'export':
+        for dirname in options.dirname:
+            export_run(dirname)
+    elif options.command == 'list':
+        for dirname in options.dirname:
+            for name in column_names(dirname):
+                update_no, values = read(names.observable(dirname, name))
+                print('{}\t{}\t{}'.format(dirname, name, len(update_no)))
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='List the observables of runs or export them as TSV files into their `extract` directories.')
+    parser.add_argument('command', choices=['list', 'export'])
+    parser.add_argument('dirname', nargs='+', help='Run directories.')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Resource usage of the tasks and transformations of the analysis.
+
+Nothing is recorded unless ``HMC_ANALYSIS_PROFILE`` is set. Then the wall
+time, CPU time, peak memory and the bytes read and written are recorded for
+every executed doit task by ``ProfilingReporter`` and for every call of a
+function with the ``profiled`` decorator. Each measurement is appended as one
+JSON line to the file that ``HMC_ANALYSIS_PROFILE`` names, ``on`` or ``1``
+stands for ``.hmc-profile.jsonl`` in the working directory. The command line
+of this module sums the measurements per task family or function.
+
+The peak memory is reset at the start of a measurement where the kernel
+allows it, otherwise it is the peak of the whole process so far. Measurements
+that start within another one do not reset it, their peak includes the one of
+the enclosing measurement so far. With ``doit -n`` the
+tasks run in other processes and the task records only contain the wall
+time, the records of the decorated functions are complete.
+'''
+
+import argparse
+import collections
+import functools
+import json
+import os
+import resource
+import time
+
+try:
+    from doit.reporter import ConsoleReporter
+except ImportError:
+    # The reporter is only used from within doit, the decorator also works
+    # without it.
+    ConsoleReporter = object
+
+
+DEFAULT_PATH = '.hmc-profile.jsonl'
+
+
+def profile_path():
+    '''
+    :return: Path of the JSONL file or ``None`` if profiling is disabled.
+    '''
+    path = os.environ.get('HMC_ANALYSIS_PROFILE', '')
+    if path in ('', 'off', '0'):
+        return None
+    if path in ('on', '1'):
+        return DEFAULT_PATH
+    return path
+
+
+def _io_counters():
+    '''
+    :return: Tuple with the bytes read and written by this process, including
+        those served from the page cache.
+    '''
+    counters = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                counters[key] = int(value)
+    except OSError:
+        return 0, 0
+    return counters.get('rchar', 0), counters.get('wchar', 0)
+
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mib():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # On Linux the maximum resident set size is given in KiB.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Number of measurements of this process that have been started and not
+# stopped yet.
+_running = 0
+
+
+class Measurement(object):
+    '''
+    Resource usage of this process between ``start`` and ``stop``.
+    '''
+
+    def start(self):
+        global _running
+        if _running == 0:
+            _reset_peak_rss()
+        _running += 1
+        self.wall = time.perf_counter()
+        self.usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.io = _io_counters()
+
+    def stop(self):
+        global _running
+        _running -= 1
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        io = _io_counters()
+        return {
+            'wall_s': time.perf_counter() - self.wall,
+            'user_s': usage.ru_utime - self.usage.ru_utime,
+            'system_s': usage.ru_stime - self.usage.ru_stime,
+            'peak_rss_mib': _peak_rss_mib(),
+            'bytes_read': io[0] - self.io[0],
+            'bytes_written': io[1] - self.io[1],
+        }
+
+
+def write_record(record):
+    path = profile_path()
+    if path is None:
+        return
+    record['time'] = time.time()
+    record['pid'] = os.getpid()
+    # A single write of a line in append mode does not interleave with the
+    # lines of other processes.
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def profiled(function):
+    '''
+    Decorator that records the resource usage of every call while profiling
+    is enabled.
+    '''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if profile_path() is None:
+            return function(*args, **kwargs)
+
+        measurement = Measurement()
+        measurement.start()
+        success = False
+        try:
+            result = function(*args, **kwargs)
+            success = True
+            return result
+        finally:
+            record = measurement.stop()
+            record.update({
+                'kind': 'function',
+                'name': '{}.{}'.format(function.__module__, function.__qualname__),
+                'family': function.__qualname__,
+                'success': success,
+            })
+            write_record(record)
+    return wrapper
+
+
+class ProfilingReporter(ConsoleReporter):
+    '''
+    Console reporter of doit that also records the resource usage of each
+    executed task. The family of a task is its base name, like
+    ``logfile_to_shards``.
+    '''
+
+    desc = 'console output and resource usage in a JSONL file'
+
+    def __init__(self, outstream, options):
+        super().__init__(outstream, options)
+        self.measurements = {}
+
+    def execute_task(self, task):
+        super().execute_task(task)
+        measurement = Measurement()
+        measurement.start()
+        self.measurements[task.name] = measurement
+
+    def _finish(self, task, success):
+        measurement = self.measurements.pop(task.name, None)
+        if measurement is None:
+            return
+        record = measurement.stop()
+        record.update({
+            'kind': 'task',
+            'name': task.name,
+            'family': task.name.split(':', 1)[0],
+            'success': success,
+        })
+        write_record(record)
+
+    def add_success(self, task):
+        super().add_success(task)
+        self._finish(task, True)
+
+    def add_failure(self, task, fail):
+        super().add_failure(task, fail)
+        self._finish(task, False)
+
+
+def read_records(path):
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def summarize(records, kind='task'):
+    '''
+    Sums the records per family.
+
+    :return: List of dictionaries sorted by the total wall time.
+    '''
+    families = collections.OrderedDict()
+    for record in records:
+        if record.get('kind') != kind:
+            continue
+        family = families.setdefault(record['family'], {
+            'family': record['family'], 'count': 0, 'failed': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+            'max_wall_s': 0.0, 'peak_rss_mib': 0.0, 'bytes_read': 0, 'bytes_written': 0,
+        })
+        family['count'] += 1
+        family['failed'] += 0 if record['success'] else 1
+        family['wall_s'] += record['wall_s']
+        family['max_wall_s'] = max(family['max_wall_s'], record['wall_s'])
+        family['cpu_s'] += record.get('user_s', 0) + record.get('system_s', 0)
+        family['peak_rss_mib'] = max(family['peak_rss_mib'], record.get('peak_rss_mib', 0))
+        family['bytes_read'] += record.get('bytes_read', 0)
+        family['bytes_written'] += record.get('bytes_written', 0)
+
+    return sorted(families.values(), key=lambda family: family['wall_s'], reverse=True)
+
+
+def format_table(rows):
+    lines = ['{:40s} {:>6s} {:>6s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s}'.format(
+        'Family', 'Count', 'Failed', 'Wall/s', 'Max wall/s', 'CPU/s', 'Peak MiB', 'Read MiB', 'Write MiB')]
+    for row in rows:
+        lines.append('{:40s} {:6d} {:6d} {:10.2f} {:10.2f} {:10.2f} {:10.1f} {:10.1f} {:10.1f}'.format(
+            row['family'][:40], row['count'], row['failed'], row['wall_s'], row['max_wall_s'], row['cpu_s'],
+            row['peak_rss_mib'], row['bytes_read'] / 1024**2, row['bytes_written'] / 1024**2))
+    return '\n'.join(lines)
+
+
+def main():
+    options = _parse_args()
+
+    records = read_records(options.path)
+    if options.since is not None:
+        records = [record for record in records if record['time'] >= time.time() - options.since * 3600]
+
+    print(format_table(summarize(records, options.kind)))
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Summarize the recorded resource usage per task family or function.')
+    parser.add_argument('path', nargs='?', default=DEFAULT_PATH, help='Default: %(default)s')
+    parser.add_argument('--kind', choices=['task', 'function'], default='task', help='Summarize the doit tasks or the decorated functions. Default: %(default)s')
+    parser.add_argument('--since', type=float, help='Only use the records of the last hours.')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
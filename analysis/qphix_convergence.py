@@ -5,12 +5,13 @@ import argparse
 import collections
 import re
 
+import bytescan
 import util
 
-patterns = list(map(re.compile, [
-    'CG: iter (?P<iter>\d+):  r2 = (?P<r2>[\d.e+-]+)',
-    'CG:   iter (?P<iter>\d+): x2 = (?P<x2>[\d.e+-]+)',
-]))
+patterns = bytescan.compile_patterns({
+    'r2': 'CG: iter (\d+):  r2 = ([\d.e+-]+)',
+    'x2': 'CG:   iter (\d+): x2 = ([\d.e+-]+)',
+})
 
 
 
@@ -21,16 +22,8 @@ def main():
 
     results = collections.defaultdict(list)
 
-    with open(options.filename) as f:
-        for line in f:
-            for pattern in patterns:
-                m = pattern.search(line)
-                if m:
-                    gd = m.groupdict()
-                    iteration = gd['iter']
-                    del gd['iter']
-                    key, val = list(gd.items())[0]
-                    results[key].append((float(iteration), float(val)))
+    for key, (iteration, val) in bytescan.scan_file(options.filename, patterns):
+        results[key].append((float(iteration), float(val)))
 
     fig, ax = util.make_figure()
 
@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Queries the flattened XML logs of a run, see ``extractors.flatstore``.
+'''
+
+import argparse
+
+import extractors.flatstore
+
+
+def main():
+    options = _parse_args()
+
+    store = extractors.flatstore.FlatStore(options.store)
+
+    if options.xpath is None:
+        for path, rows in store.counts():
+            print('{:10d}  {}'.format(rows, path))
+        return
+
+    if options.all:
+        update_no, order, values = store.rows(options.xpath)
+    else:
+        update_no, values = store.first(options.xpath)
+    for update, value in zip(update_no, values):
+        print('{}\t{}'.format(update, value))
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Query the flattened XML logs of a run. Without a path, all paths with their number of rows are listed.')
+    parser.add_argument('store', help='Flattened store, like `extract/extract-flat.npz`.')
+    parser.add_argument('xpath', nargs='?', help='Path to select, like `.//deltaH` or `//tau0`.')
+    parser.add_argument('--all', action='store_true', help='Print all matches in every update, not only the first one.')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Reduces verbose Chroma text logs to the lines that the extractors look at.
+
+Chroma writes a lot of lines that no analysis ever reads, even compressed
+the logs take up a lot of space. This tool keeps every line that one of the
+registered pattern sets could match and drops all others. The extractors see
+the same lines in the same order, so they give identical results on the slim
+log.
+
+The slim log is written to ``slim/`` next to the original, together with a
+manifest that lists the pattern sets it has been slimmed for. A log slimmed
+for some pattern sets is not suitable for extractors that use other patterns.
+'''
+
+import argparse
+import collections
+import gzip
+import json
+import os
+import re
+import sys
+import time
+
+import bytescan
+import extractors.logfile
+import names
+import qphix_convergence
+
+
+def _sources(patterns):
+    return [pattern.pattern for pattern in patterns]
+
+
+# The lines that ``remez-parser/remez_parser.py`` reads, the type of the
+# approximation, the coefficients and the normalization. That parser lives
+# outside of this directory, so the patterns are repeated here.
+remez_patterns = [
+    re.compile(r'Construct (\w+) rational approx= REMEZ'),
+    re.compile(r'pfe: Residue = ([0-9.e+-]+) Pole = ([0-9.e+-]+)'),
+    re.compile(r'root: Normalisation constant is ([0-9.e+-]+)'),
+]
+
+
+# Regular expressions by name of the pattern set. They are searched anywhere
+# in a line, which keeps a few lines too many for the patterns that are only
+# used with ``re.match``, but never too few.
+pattern_sets = collections.OrderedDict([
+    ('logfile', [extractors.logfile.doing_update_pattern.pattern,
+                 'HMC: total time = ',
+                 extractors.logfile.flopcount_pattern_bytes.pattern]
+     + _sources(extractors.logfile.patterns_gflops.values())
+     + _sources(extractors.logfile.patterns_iterations.values())
+     + _sources(extractors.logfile.patterns_resiuals.values())
+     + [pattern.pattern for phase, detail, pattern in extractors.logfile.patterns_phases]),
+    ('header', [pattern.pattern for transform, pattern in extractors.logfile.patterns_before.values()]),
+    ('remez', _sources(remez_patterns)),
+    ('cg_history', _sources(qphix_convergence.patterns.values())),
+])
+
+
+def compile_pattern_sets(keys):
+    return [bytescan.compile_pattern(source) for key in keys for source in pattern_sets[key]]
+
+
+def selected_lines(buf, patterns):
+    '''
+    Finds the lines that contain a match of any of the patterns.
+
+    :return: Sorted list of the start offsets of the lines.
+    '''
+    starts = set()
+    for pattern in patterns:
+        for m in pattern.finditer(buf):
+            starts.add(buf.rfind(b'\n', 0, m.start()) + 1)
+    return sorted(starts)
+
+
+def line_end(buf, start):
+    end = buf.find(b'\n', start)
+    return len(buf) if end == -1 else end + 1
+
+
+def last_line_starts(buf, count):
+    starts = []
+    end = len(buf)
+    while end > 0 and len(starts) < count:
+        start = buf.rfind(b'\n', 0, end - 1) + 1
+        starts.insert(0, start)
+        end = start
+    return starts
+
+
+def slim_buffers(buffers, patterns, out):
+    '''
+    Writes the selected lines of the buffers to ``out``.
+
+    The last two lines of the log are always kept, the log parser looks at
+    them to decide whether the run has finished.
+
+    :return: Tuple with the number of bytes read and written.
+    '''
+    bytes_in = 0
+    bytes_out = 0
+    # Last lines seen so far as tuples ``(line, selected)``.
+    tail = collections.deque()
+
+    for buf in buffers:
+        bytes_in += len(buf)
+        starts = selected_lines(buf, patterns)
+        tail_starts = last_line_starts(buf, 2)
+
+        while len(tail) + len(tail_starts) > 2:
+            line, selected = tail.popleft()
+            if selected:
+                out.write(line)
+                bytes_out += len(line)
+
+        selected = set(starts)
+        for start in starts:
+            if start >= tail_starts[0]:
+                break
+            line = buf[start:line_end(buf, start)]
+            out.write(line)
+            bytes_out += len(line)
+
+        for start in tail_starts:
+            tail.append((buf[start:line_end(buf, start)], start in selected))
+
+    for line, selected in tail:
+        out.write(line)
+        bytes_out += len(line)
+
+    return bytes_in, bytes_out
+
+
+def slim_logfile(logfile, keys=None):
+    '''
+    Writes the slim version of a log file and its manifest.
+
+    :param list keys: Names of the pattern sets to keep lines for, all by
+        default.
+    :return: Manifest as a dictionary.
+    '''
+    if keys is None:
+        keys = list(pattern_sets.keys())
+
+    slim_file = names.slim_log(logfile)
+    patterns = compile_pattern_sets(keys)
+
+    opener = gzip.open if slim_file.endswith('.gz') else open
+    with opener(slim_file, 'wb') as out:
+        bytes_in, bytes_out = slim_buffers(bytescan.iter_buffers(logfile), patterns, out)
+
+    manifest = {
+        'source': os.path.basename(logfile),
+        'source_size': os.path.getsize(logfile),
+        'source_bytes': bytes_in,
+        'slim_size': os.path.getsize(slim_file),
+        'slim_bytes': bytes_out,
+        'pattern_sets': collections.OrderedDict((key, [
+            source.decode() if isinstance(source, bytes) else source
+            for source in pattern_sets[key]]) for key in keys),
+    }
+
+    with open(names.slim_manifest(logfile), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+    return manifest
+
+
+def read_lines(logfile):
+    opener = gzip.open if logfile.endswith('.gz') else open
+    with opener(logfile, 'rt', errors='replace') as f:
+        return f.readlines()
+
+
+def remez_coefficients(logfile):
+    '''
+    Runs the Remez parser if it can be imported, for instance with
+    ``PYTHONPATH=../remez-parser``.
+
+    :return: Coefficients or ``None`` if the parser is not available.
+    '''
+    try:
+        import remez_parser
+    except ImportError:
+        return None
+    return remez_parser.get_coeff(read_lines(logfile))
+
+
+def extract_all(logfile, keys):
+    '''
+    Runs the extractors of the given pattern sets on a log file.
+    '''
+    results = {}
+    if 'logfile' in keys or 'header' in keys:
+        results['logfile'] = dict(extractors.logfile.iter_parsed_updates(logfile))
+    if 'remez' in keys:
+        results['remez'] = remez_coefficients(logfile)
+    if 'cg_history' in keys:
+        results['cg_history'] = list(bytescan.scan_file(logfile, qphix_convergence.patterns))
+    return results
+
+
+def timed_extract_all(logfile, keys):
+    start = time.perf_counter()
+    results = extract_all(logfile, keys)
+    return results, time.perf_counter() - start
+
+
+def main():
+    options = _parse_args()
+
+    keys = options.patterns or list(pattern_sets.keys())
+    for key in keys:
+        if key not in pattern_sets:
+            print('Unknown pattern set {}, available are: {}'.format(key, ', '.join(pattern_sets)))
+            sys.exit(2)
+
+    failed = False
+
+    for logfile in options.logfile:
+        manifest = slim_logfile(logfile, keys)
+        print(logfile)
+        print('  Size:     {:d} -> {:d} bytes ({:.1f}×)'.format(
+            manifest['source_size'], manifest['slim_size'],
+            manifest['source_size'] / max(manifest['slim_size'], 1)))
+        print('  Content:  {:d} -> {:d} bytes ({:.1f}×)'.format(
+            manifest['source_bytes'], manifest['slim_bytes'],
+            manifest['source_bytes'] / max(manifest['slim_bytes'], 1)))
+
+        if options.no_check:
+            continue
+
+        full, full_time = timed_extract_all(logfile, keys)
+        slim, slim_time = timed_extract_all(names.slim_log(logfile), keys)
+        print('  Parsing:  {:.2f} -> {:.2f} s ({:.1f}×)'.format(
+            full_time, slim_time, full_time / max(slim_time, 1e-9)))
+
+        if full.get('remez', False) is None:
+            print('  The Remez parser cannot be imported, add remez-parser to PYTHONPATH to compare its results.')
+
+        for key in sorted(full):
+            if full[key] != slim[key]:
+                print('  Results of {} differ!'.format(key))
+                failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Drop the lines from Chroma text logs that no extractor looks at.')
+    parser.add_argument('logfile', nargs='+', help='Text logs, like `hmc.*.out.txt.gz`.')
+    parser.add_argument('--patterns', nargs='+', help='Pattern sets to keep lines for. Default: all of {}'.format(', '.join(pattern_sets)))
+    parser.add_argument('--no-check', action='store_true', help='Do not compare the extractor results on the original and the slim log.')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,8 @@ import matplotlib.pyplot as pl
 import numpy as np
 import scipy.optimize as op
 
+from extractors import xmlstream
+
 template_text = r'''
 \documentclass[a3paper, landscape, DIV=100]{scrartcl}
 \pagestyle{empty}
@@ -46,21 +48,18 @@ def main():
 
     pp = pprint.PrettyPrinter()
 
-    print('Loading XML …')
-    tree = etree.parse(options.xml_file)
+    print('Extracting first update …')
+    # Only the first update is needed, the rest of the file is not read.
+    steps = xmlstream.iter_elements(options.xml_file, 'elem', parent_tag='MCUpdates')
+    step = next(steps)
 
-    tau0 = float(tree.xpath('/hmc/Input/Params/HMCTrj/MDIntegrator/tau0/text()')[0])
-    n_steps = int(tree.xpath('/hmc/Input/Params/HMCTrj/MDIntegrator/Integrator/n_steps/text()')[0])
+    tau0 = float(step.xpath('/hmc/Input/Params/HMCTrj/MDIntegrator/tau0/text()')[0])
+    n_steps = int(step.xpath('/hmc/Input/Params/HMCTrj/MDIntegrator/Integrator/n_steps/text()')[0])
     print('n_steps', n_steps)
     print('tau0', tau0)
 
     delta_tau = tau0 / n_steps
 
-    print('Extracting first update …')
-    steps = tree.xpath('/hmc/doHMC/MCUpdates/elem')
-    print(steps)
-    step = steps[0]
-
     print('Extracting forces …')
     leaps = step.xpath('Update/HMCTrajectory/leapP')
     t = {}
@@ -84,6 +83,8 @@ def main():
 
                 print(t[tag], tag)
 
+    steps.close()
+
     pp.pprint(evaluations)
 
     env = jinja2.Environment(
@@ -11,11 +11,15 @@ import os
 import pprint
 
 import numpy as np
-import pandas as pd
 
+from lazy import lazy_import
 import names
+import observables
+import profiling
 import util
 
+pd = lazy_import('pandas')
+
 
 PERCENTILE_LOW = 50 - 34.13
 PERCENTILE_HIGH = 50 + 34.13
@@ -65,26 +69,25 @@ def residual_converter(solver_data, update_data):
 
 
 def convert_solver_list(dirname, converter, outname):
-    filename_in = os.path.join(dirname, 'extract', 'extract-log.json')
+    filename_in = names.log_extract(dirname)
 
     if not os.path.isfile(filename_in):
         print('File is missing:', filename_in)
         return
 
-    with open(filename_in) as f:
-        data = json.load(f)
-
     results = collections.defaultdict(list)
 
-    for update_no, update_data in sorted(data.items()):
-        for solver, solver_data in update_data['solvers'].items():
-            try:
-                result = list(converter(solver_data, update_data))
-            except KeyError as e:
-                print(filename_in, e)
-                continue
+    with LogColumns(filename_in) as columns:
+        for i, update_no in enumerate(columns.update_no):
+            update_data = columns.update_data(i)
+            for solver in columns.solvers_in_update(i):
+                try:
+                    result = list(converter(columns.solver_data(solver, i), update_data))
+                except KeyError as e:
+                    print(filename_in, e)
+                    continue
 
-            results[solver].append([float(update_no)] + result)
+                results[solver].append([float(update_no)] + result)
 
     to_json = {}
 
@@ -101,19 +104,250 @@ def convert_solver_list(dirname, converter, outname):
         json.dump(to_json, f, indent=4, sort_keys=True)
 
 
-def merge_json_shards(filenames, dest):
+class LazyMapping(object):
+    '''
+    Read-only mapping which looks up the values with a function on access.
+    '''
+
+    def __init__(self, getter):
+        self.getter = getter
+
+    def __getitem__(self, key):
+        return self.getter(key)
+
+    def __contains__(self, key):
+        try:
+            self.getter(key)
+        except KeyError:
+            return False
+        else:
+            return True
+
+
+# Groups of ragged per-update series and the prefix of their arrays.
+log_groups = collections.OrderedDict([
+    ('solvers', 'solver/'),
+    ('kernels', 'kernel/'),
+    ('phases', 'phase/'),
+])
+
+
+class LogColumns(object):
+    '''
+    Reader for the columnar log shards written by ``write_log_columns``.
+
+    The arrays are only loaded from the file when they are first used, so a
+    consumer only pays for the solvers and metrics that it looks at. Use as a
+    context manager such that the file is closed again.
+    '''
+
+    def __init__(self, path):
+        self.npz = np.load(path)
+        self.cache = {}
+        self.update_no = self['update_no']
+
+        self.common_keys = sorted(
+            name[len('common/'):]
+            for name in self.npz.files
+            if name.startswith('common/'))
+
+        self.group_series = {
+            group: sorted(
+                tuple(name[len(prefix):-len('/values')].rsplit('/', 1))
+                for name in self.npz.files
+                if name.startswith(prefix) and name.endswith('/values'))
+            for group, prefix in log_groups.items()
+        }
+        self.series = self.group_series['solvers']
+        self.kernel_series = self.group_series['kernels']
+        self.phase_series = self.group_series['phases']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.npz.close()
+
+    def __getitem__(self, name):
+        if name not in self.cache:
+            self.cache[name] = self.npz[name]
+        return self.cache[name]
+
+    def __len__(self):
+        return len(self.update_no)
+
+    def solvers(self):
+        return sorted(set(solver for solver, metric in self.series))
+
+    def metrics(self, solver):
+        return [metric for s, metric in self.series if s == solver]
+
+    def kernels(self):
+        return sorted(set(kernel for kernel, metric in self.kernel_series))
+
+    def common(self, key):
+        '''
+        Returns the column of a header field, missing values are ``-1``.
+        '''
+        if key not in self.common_keys:
+            return np.full(len(self), -1, dtype=np.int64)
+        return self['common/' + key]
+
+    def nodes(self):
+        '''
+        Returns the number of nodes of each update as ``float``, ``nan`` where
+        it is missing, such that quantities per node are ``nan`` there.
+        '''
+        nodes = self.common('nodes').astype(np.float64)
+        nodes[nodes <= 0] = np.nan
+        return nodes
+
+    def values(self, solver, metric, group='solvers'):
+        '''
+        :param str group: ``solvers`` or ``kernels``.
+        :return: Tuple ``(values, offsets)``, the values of the update with
+            index ``i`` are ``values[offsets[i]:offsets[i+1]]``.
+        '''
+        prefix = '{}{}/{}/'.format(log_groups[group], solver, metric)
+        return self[prefix + 'values'], self[prefix + 'offsets']
+
+    def values_in_update(self, solver, metric, i, group='solvers'):
+        values, offsets = self.values(solver, metric, group)
+        return values[offsets[i]:offsets[i+1]]
+
+    def solvers_in_update(self, i):
+        '''
+        Returns the solvers that have at least one value in the update with
+        index ``i``.
+        '''
+        result = []
+        for solver, metric in self.series:
+            if solver in result:
+                continue
+            values, offsets = self.values(solver, metric)
+            if offsets[i+1] > offsets[i]:
+                result.append(solver)
+        return result
+
+    def update_data(self, i):
+        '''
+        Mapping of the header fields of the update with index ``i``.
+        Missing fields raise ``KeyError`` on access.
+        '''
+        def getter(key):
+            if key not in self.common_keys or self.common(key)[i] == -1:
+                raise KeyError(key)
+            return int(self.common(key)[i])
+        return LazyMapping(getter)
+
+    def solver_data(self, solver, i, group='solvers'):
+        '''
+        Mapping from metric to the values of the solver in the update with
+        index ``i``. Metrics without values raise ``KeyError`` on access.
+        '''
+        def getter(metric):
+            if (solver, metric) not in self.group_series[group]:
+                raise KeyError(metric)
+            values = self.values_in_update(solver, metric, i, group)
+            if len(values) == 0:
+                raise KeyError(metric)
+            return values
+        return LazyMapping(getter)
+
+    def kernel_data(self, kernel, i):
+        return self.solver_data(kernel, i, 'kernels')
+
+    def phase_data(self, phase, i):
+        '''
+        Mapping from the detail, like the solver or monomial, to the seconds
+        spent in the phase in the update with index ``i``.
+        '''
+        return self.solver_data(phase, i, 'phases')
+
+    def to_results(self):
+        '''
+        Converts back to the nested dictionaries that the parser produces.
+        '''
+        results = {}
+        for i, update_no in enumerate(self.update_no):
+            update_results = {group: {} for group in log_groups}
+            for key in self.common_keys:
+                value = int(self.common(key)[i])
+                if value != -1:
+                    update_results[key] = value
+            for group, series in self.group_series.items():
+                for solver, metric in series:
+                    values = self.values_in_update(solver, metric, i, group)
+                    if len(values) > 0:
+                        update_results[group].setdefault(solver, {})[metric] = values.tolist()
+            results[int(update_no)] = update_results
+        return results
+
+
+def read_log_columns(path):
+    return LogColumns(path)
+
+
+def write_log_columns(path, results):
+    '''
+    Writes parsed log results as a columnar shard.
+
+    ``results`` maps the update number to the dictionary that
+    ``extractors.logfile`` creates for each update. Every (solver, metric),
+    (kernel, metric) and (phase, detail) becomes one flat array of values
+    together with an array of offsets into it, one per update. The header
+    fields get one integer column each with ``-1`` for missing values.
+    '''
+    update_nos = sorted(results.keys(), key=int)
+    updates = [results[update_no] for update_no in update_nos]
+
+    columns = {
+        'update_no': np.array(update_nos, dtype=np.int64),
+    }
+
+    common_keys = set()
+    series = {group: set() for group in log_groups}
+    for update in updates:
+        for key, val in update.items():
+            if key in log_groups:
+                for solver, solver_data in val.items():
+                    for metric in solver_data.keys():
+                        series[key].add((solver, metric))
+            else:
+                common_keys.add(key)
+
+    for key in sorted(common_keys):
+        columns['common/' + key] = np.array([update.get(key, -1) for update in updates], dtype=np.int64)
+
+    for group, prefix in log_groups.items():
+        for solver, metric in sorted(series[group]):
+            parts = [update.get(group, {}).get(solver, {}).get(metric, []) for update in updates]
+            offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+            np.cumsum([len(part) for part in parts], out=offsets[1:])
+            values = np.fromiter((value for part in parts for value in part), dtype=np.float64, count=offsets[-1])
+
+            name = '{}{}/{}/'.format(prefix, solver, metric)
+            columns[name + 'values'] = values
+            columns[name + 'offsets'] = offsets
+
+    with open(path, 'wb') as f:
+        np.savez(f, **columns)
+
+
+def merge_log_shards(filenames, dest):
     merged = {}
 
     for filename in filenames:
-        with open(filename) as f:
-            data = json.load(f)
-
-        for key, val in data.items():
+        with LogColumns(filename) as columns:
+            results = columns.to_results()
+        for key, val in results.items():
             assert key not in merged, key
             merged[key] = val
 
-    with open(dest, 'w') as f:
-        json.dump(merged, f, indent=4, sort_keys=True)
+    write_log_columns(dest, merged)
 
 
 def merge_dict_2(base, add):
@@ -140,7 +374,7 @@ def merge_tsv_shards(shard_names, merged_name):
     if len(all_data) == 0:
         merged = []
     else:
-        merged = np.row_stack(all_data)
+        merged = np.vstack(all_data)
         merged = util.sort_by_first_column(merged)
         merged = unique_rows(merged)
 
@@ -182,95 +416,174 @@ def convert_to_md_time(dirname, name_in):
                np.column_stack([md_time, y]))
 
 
+@profiling.profiled
 def io_delta_h_to_exp(path_in, path_out):
-    t, delta_h = util.load_columns(path_in, 2)
+    t, delta_h = observables.read(path_in)
     exp = np.exp(- delta_h)
-    np.savetxt(path_out, np.column_stack([t, exp]))
+    observables.write(path_out, t, exp)
 
 
+@profiling.profiled
 def io_time_to_minutes(path_in, path_out):
-    update_no, seconds = util.load_columns(path_in, 2)
-    np.savetxt(path_out, np.column_stack([update_no, seconds / 60]))
+    update_no, seconds = observables.read(path_in)
+    observables.write(path_out, update_no, seconds / 60)
 
 
 def convert_tau0_to_md_time(file_in, file_out):
-    result = []
-    try:
-        update_no, tau0 = util.load_columns(file_in, 2)
-    except ValueError as e:
-        print(e)
-    else:
-        md_time = np.cumsum(tau0)
-        assert tau0.shape == md_time.shape
-        result = np.column_stack([update_no, md_time])
-    np.savetxt(file_out, result)
+    update_no, tau0 = observables.read(file_in)
+    md_time = np.cumsum(tau0)
+    assert tau0.shape == md_time.shape
+    observables.write(file_out, update_no, md_time)
 
 
 def delta_delta_h(dirname):
-    result = []
+    update_no_ddh, ddh = observables.read(names.observable(dirname, 'DeltaDeltaH'))
+    update_no_dh, dh = observables.read(names.observable(dirname, 'deltaH'))
 
-    try:
-        update_no_ddh, ddh = util.load_columns(os.path.join(dirname,'extract',  'extract-DeltaDeltaH.tsv'), 2)
-        update_no_dh, dh = util.load_columns(os.path.join(dirname,'extract',  'extract-deltaH.tsv'), 2)
-    except ValueError:
-        pass
-    else:
-        for i, update_no in enumerate(update_no_ddh):
-            j = np.where(update_no == update_no_dh)[0][0]
-            print(update_no, '->', j)
-            result.append((update_no, ddh[i] / dh[j]))
+    result_update_no = []
+    result = []
+    for i, update_no in enumerate(update_no_ddh):
+        j = np.where(update_no == update_no_dh)[0][0]
+        print(update_no, '->', j)
+        result_update_no.append(update_no)
+        result.append(ddh[i] / dh[j])
 
-    np.savetxt(os.path.join(dirname,'extract',  'extract-DeltaDeltaH_over_DeltaH.tsv'),
-               result)
+    observables.write(names.observable(dirname, 'DeltaDeltaH_over_DeltaH'), result_update_no, result)
 
 
+@profiling.profiled
 def io_running_mean(path_in, path_out, window=100):
-    x = pd.read_table(path_in, header=None, squeeze=True, names=['y'], sep=' ')
+    update_no, values = observables.read(path_in)
+    x = pd.Series(values, index=update_no)
     r = x.rolling(window)
     rolling_mean = r.mean().dropna()
-    rolling_mean.to_csv(path_out, sep='\t')
+    observables.write(path_out, rolling_mean.index.values, rolling_mean.values)
 
 
-def io_log_json_to_long(path_in, path_out):
+@profiling.profiled
+def io_log_columns_to_long(path_in, path_out):
     cols = ['gflops', 'iters', 'residuals']
 
     rows = []
 
     print(path_in)
 
-    with open(path_in) as f:
-        updates = json.load(f)
+    with LogColumns(path_in) as columns:
+        nodes = columns.common('nodes')
+        subgrid_volume = columns.common('subgrid_volume')
+
+        for solver in columns.solvers():
+            metrics = [c for c in cols if (solver, c) in columns.series]
+            for i, update in enumerate(columns.update_no):
+                solver_data = columns.solver_data(solver, i)
+                for items in zip(*[solver_data[c] for c in metrics if c in solver_data]):
+                    if len(items) == 3:
+                        gflops, iters, residual = items
+                    else:
+                        gflops, iters = items
+                        residual = 'NA'
+
+                    rows.append([
+                        update,
+                        nodes[i] if nodes[i] > 0 else 'NA',
+                        subgrid_volume[i] if subgrid_volume[i] > 0 else 'NA',
+                        solver,
+                        gflops,
+                        iters,
+                        residual
+                    ])
+
+    rows.sort(key=lambda row: row[0])
+
+    with open(path_out, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Update', 'Ranks', 'Subgrid_Volume', 'Solver', 'GFLOPS', 'Iterations', 'Residual'])
+        for row in rows:
+            writer.writerow(row)
 
-    for update, update_data in sorted(updates.items()):
-        nodes = update_data['nodes']
-        subgrid_volume = update_data['subgrid_volume']
 
-        for solver, solver_data in update_data['solvers'].items():
-            print(update, solver, solver_data.keys())
-            for items in zip(*[solver_data[c] for c in cols if c in solver_data]):
-                if len(items) == 3:
-                    gflops, iters, residual = items
+@profiling.profiled
+def io_kernel_breakdown(path_in, path_out):
+    '''
+    Writes the ``QDP:FlopCount`` kernels of each update as a long table.
+
+    ``Seconds`` is the summed CPU time of all calls of the kernel within the
+    update, ``Time_Share`` its fraction of the time of all kernels in that
+    update. ``GFLOPS`` is the mean of the total performance of the calls,
+    divided by the number of nodes in ``GFLOPS_per_Node``.
+    '''
+    rows = []
+
+    with LogColumns(path_in) as columns:
+        kernels = columns.kernels()
+        nodes = columns.nodes()
+
+        for i, update in enumerate(columns.update_no):
+            per_kernel = []
+            for kernel in kernels:
+                kernel_data = columns.kernel_data(kernel, i)
+                seconds = kernel_data['seconds'] if 'seconds' in kernel_data else []
+                gflops = kernel_data['gflops'] if 'gflops' in kernel_data else []
+                if len(seconds) == 0 and len(gflops) == 0:
+                    continue
+                per_kernel.append((kernel, max(len(seconds), len(gflops)), np.sum(seconds), gflops))
+
+            total_seconds = sum(seconds for kernel, calls, seconds, gflops in per_kernel)
+
+            for kernel, calls, seconds, gflops in per_kernel:
+                if len(gflops) > 0:
+                    mean_gflops = np.mean(gflops)
+                    per_node = mean_gflops / nodes[i] if np.isfinite(nodes[i]) else 'NA'
                 else:
-                    gflops, iters = items
-                    residual = 'NA'
+                    mean_gflops = per_node = 'NA'
 
                 rows.append([
                     update,
-                    nodes,
-                    subgrid_volume,
-                    solver,
-                    gflops,
-                    iters,
-                    residual
+                    int(nodes[i]) if np.isfinite(nodes[i]) else 'NA',
+                    kernel,
+                    calls,
+                    seconds,
+                    seconds / total_seconds if total_seconds > 0 else 'NA',
+                    mean_gflops,
+                    per_node,
                 ])
 
     with open(path_out, 'w') as f:
         writer = csv.writer(f)
-        writer.writerow(['Update', 'Ranks', 'Subgrid_Volume', 'Solver', 'GFLOPS', 'Iterations', 'Residual'])
+        writer.writerow(['Update', 'Ranks', 'Kernel', 'Calls', 'Seconds', 'Time_Share', 'GFLOPS', 'GFLOPS_per_Node'])
         for row in rows:
             writer.writerow(row)
 
 
+@profiling.profiled
+def io_phase_breakdown(path_in, trajectory_path, path_out):
+    '''
+    Writes the seconds spent in the phases of each update as a long table.
+
+    The phases come from the text log. The ``seconds_for_trajectory`` from
+    the XML log are added as the phase ``trajectory`` if available.
+    '''
+    rows = []
+
+    with LogColumns(path_in) as columns:
+        for phase, detail in columns.phase_series:
+            for i, update in enumerate(columns.update_no):
+                seconds = columns.values_in_update(phase, detail, i, 'phases')
+                if len(seconds) > 0:
+                    rows.append([update, phase, detail, len(seconds), np.sum(seconds)])
+
+    if os.path.isfile(trajectory_path):
+        for update, seconds in zip(*observables.read(trajectory_path)):
+            rows.append([int(update), 'trajectory', 'total', 1, seconds])
+
+    rows.sort(key=lambda row: row[0])
+
+    with open(path_out, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Update', 'Phase', 'Detail', 'Calls', 'Seconds'])
+        for row in rows:
+            writer.writerow(row)
+
 
 if __name__ == '__main__':
     io_running_mean('/home/mu/Dokumente/Studium/Master_Science_Physik/Masterarbeit/Runs/0106-Mpi660-L16-T32/extract/extract-AcceptP.tsv', 'test.tsv')
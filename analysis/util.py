@@ -3,9 +3,12 @@
 
 # Copyright © 2017 Martin Ueding <mu@martin-ueding.de>
 
-import matplotlib.pyplot as pl
 import numpy as np
 
+from lazy import lazy_import
+
+pl = lazy_import('matplotlib.pyplot')
+
 
 def load_columns(filename, expected_column_count=None):
     data = np.loadtxt(filename)
@@ -4,19 +4,23 @@
 # Copyright © 2016-2017 Martin Ueding <mu@martin-ueding.de>
 
 import collections
+import csv
 import glob
 import json
 import os
 import pprint
 import re
 
-import matplotlib.pyplot as pl
 import numpy as np
 
+from lazy import lazy_import
 import names
+import observables
 import transforms
 import util
 
+pl = lazy_import('matplotlib.pyplot')
+
 
 def plot_solver_data(path_in, path_out, ylabel, title='Solver Data', log_scale=False):
     fig, ax = util.make_figure()
@@ -62,29 +66,31 @@ def plot_perf(dirnames):
     ax = fig.add_subplot(1, 1, 1)
 
     for dirname in dirnames:
-        filename = os.path.join(dirname, 'extract-log.json')
+        filename = names.log_extract(dirname)
 
         if not os.path.isfile(filename):
             print('File is missing:', filename)
             continue
 
-        with open(filename) as f:
-            data = json.load(f)
-
         solvers = collections.defaultdict(list)
 
-        for update_no, update_data in sorted(data.items()):
-            nodes = update_data['nodes']
+        with transforms.read_log_columns(filename) as columns:
+            nodes = columns.nodes()
+
+            for solver in columns.solvers():
+                if (solver, 'gflops') not in columns.series:
+                    continue
 
-            for solver, solver_data in update_data['solvers'].items():
-                gflops = solver_data['gflops']
-                iters = solver_data['iters']
-                solvers[solver].append((
-                    int(update_no),
-                    np.median(gflops) / nodes,
-                    np.percentile(gflops, transforms.PERCENTILE_LOW) / nodes,
-                    np.percentile(gflops, transforms.PERCENTILE_HIGH) / nodes,
-                ))
+                for i, update_no in enumerate(columns.update_no):
+                    gflops = columns.values_in_update(solver, 'gflops', i)
+                    if len(gflops) == 0:
+                        continue
+                    solvers[solver].append((
+                        int(update_no),
+                        np.median(gflops) / nodes[i],
+                        np.percentile(gflops, transforms.PERCENTILE_LOW) / nodes[i],
+                        np.percentile(gflops, transforms.PERCENTILE_HIGH) / nodes[i],
+                    ))
 
         for solver, tuples in sorted(solvers.items()):
             x, y, yerr_low, yerr_high = zip(*sorted(tuples))
@@ -110,30 +116,31 @@ def plot_perf_vs_sublattice(dirnames):
     to_plot = collections.defaultdict(lambda: collections.defaultdict(list))
 
     for dirname in dirnames:
-        filename = os.path.join(dirname, 'extract-log.json')
+        filename = names.log_extract(dirname)
 
         if not os.path.isfile(filename):
             print('File is missing:', filename)
             continue
 
-        with open(filename) as f:
-            data = json.load(f)
+        with transforms.read_log_columns(filename) as columns:
+            subgrid_volumes = columns.common('subgrid_volume')
+            nodes = columns.nodes()
 
-        for update_no, update_data in sorted(data.items()):
-            nodes = update_data['nodes']
-            subgrid_volume = update_data['subgrid_volume']
+            for solver in columns.solvers():
+                if (solver, 'gflops') not in columns.series:
+                    continue
 
-            for solver, solver_data in update_data['solvers'].items():
-                gflops = solver_data['gflops']
-                iters = solver_data['iters']
-
-                to_plot[solver][subgrid_volume] += gflops
+                for i in range(len(columns)):
+                    gflops = columns.values_in_update(solver, 'gflops', i)
+                    if len(gflops) == 0 or np.isnan(nodes[i]):
+                        continue
+                    to_plot[solver][int(subgrid_volumes[i])] += (gflops / nodes[i]).tolist()
 
     for solver, tuples in sorted(to_plot.items()):
         x = sorted(tuples.keys())
-        y = np.array([np.percentile(gflops, 50) / nodes for subgrid_volume, gflops in sorted(tuples.items())])
-        yerr_down = y - np.array([np.percentile(gflops, 50 - 34.13) / nodes for subgrid_volume, gflops in sorted(tuples.items())])
-        yerr_up = np.array([np.percentile(gflops, 50 + 34.13) / nodes for subgrid_volume, gflops in sorted(tuples.items())]) - y
+        y = np.array([np.percentile(gflops, 50) for subgrid_volume, gflops in sorted(tuples.items())])
+        yerr_down = y - np.array([np.percentile(gflops, 50 - 34.13) for subgrid_volume, gflops in sorted(tuples.items())])
+        yerr_up = np.array([np.percentile(gflops, 50 + 34.13) for subgrid_volume, gflops in sorted(tuples.items())]) - y
 
         ax.errorbar(x, y, (yerr_down, yerr_up), marker='o', linestyle='none', label=solver)
 
@@ -148,11 +155,51 @@ def plot_perf_vs_sublattice(dirnames):
     pl.savefig('plot-gflops-vs-subgrid_volume.png')
 
 
+def plot_phases(path_in, path_out):
+    '''
+    Stacked plot of the time spent in the phases of each update.
+
+    The force time is not shown as it contains the solver time. The time of
+    the trajectory that is not spent in solvers is shown as ``md_other``.
+    '''
+    fig, ax = util.make_figure()
+
+    seconds = collections.defaultdict(lambda: collections.defaultdict(float))
+    with open(path_in) as f:
+        for row in csv.DictReader(f):
+            seconds[row['Phase']][int(row['Update'])] += float(row['Seconds'])
+
+    updates = sorted(set(update for phase in seconds.values() for update in phase))
+
+    if len(updates) > 0:
+        x = np.array(updates)
+        solver = np.array([seconds['solver'][update] for update in updates])
+
+        stack = [('solver', solver)]
+        if 'trajectory' in seconds:
+            trajectory = np.array([seconds['trajectory'][update] for update in updates])
+            stack.append(('md_other', np.maximum(trajectory - solver, 0)))
+        for phase in ['measurement', 'config_io']:
+            if phase in seconds:
+                stack.append((phase, np.array([seconds[phase][update] for update in updates])))
+
+        labels, ys = zip(*stack)
+        ax.stackplot(x, *ys, labels=labels)
+
+        ax.set_title('Time per Phase')
+        ax.set_xlabel('Update Number')
+        ax.set_ylabel('Seconds')
+        util.dandify_axes(ax)
+        util.dandify_figure(fig)
+
+    fig.savefig(path_out)
+
+
 def plot_generic(path_in, path_out, xlabel, ylabel, title, use_auto_ylim=False):
     fig = pl.figure()
     ax = fig.add_subplot(1, 1, 1)
 
-    x, y = util.load_columns(path_in, 2)
+    x, y = observables.read(path_in)
 
     if len(x) > 0:
         ax.plot(x, y, marker='o', markersize=2)
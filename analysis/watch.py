@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Keeps the extracts of a tree of runs current while the jobs are running.
+
+The input directories ``hmc-out``, ``wflow`` and ``corr`` of all runs are
+watched with inotify, on systems without it their files are polled with
+``os.stat``. Once the changes have settled for a few seconds, doit is started
+with the tasks of the changed runs only, like ``doit runs=A,B``, and the
+stat checks of doit select the extraction and transformation tasks that have
+to be run again. The outputs are written into subdirectories like ``shard``
+and ``extract``, which are not watched, so doit does not trigger itself.
+'''
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import subprocess
+import sys
+import time
+
+import manifest
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.inotify_init1
+except (OSError, AttributeError):
+    _libc = None
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_event_header = struct.Struct('iIII')
+
+
+def list_runs(root):
+    with os.scandir(root) as entries:
+        return sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith('.'))
+
+
+class InotifyWatcher(object):
+    '''
+    Watches the tree with inotify. The root and the run directories are
+    watched for new runs and new input directories, the input directories for
+    new and written files.
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        self.fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self.watches = {}
+
+        self._add(root, IN_CREATE | IN_MOVED_TO | IN_ONLYDIR, None, None)
+        for run in list_runs(root):
+            self._add_run(run)
+
+    def _add(self, path, mask, run, input_dir):
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # The directory may have been removed again in the meantime.
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, 'inotify_add_watch: ' + os.strerror(error), path)
+        self.watches[wd] = (run, input_dir)
+
+    def _add_run(self, run):
+        self._add(os.path.join(self.root, run), IN_CREATE | IN_MOVED_TO | IN_ONLYDIR, run, None)
+        for input_dir in manifest.input_dirs:
+            self._add_input_dir(run, input_dir)
+
+    def _add_input_dir(self, run, input_dir):
+        self._add(os.path.join(self.root, run, input_dir),
+                  IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR, run, input_dir)
+
+    def _read_events(self):
+        while True:
+            try:
+                buffer = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, cookie, length = _event_header.unpack_from(buffer, offset)
+                offset += _event_header.size
+                name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                yield wd, mask, name
+
+    def changes(self, timeout):
+        '''
+        Waits for changes.
+
+        :param float timeout: Maximum time to wait in seconds, ``None`` to wait
+            until something changes.
+        :return: Set of the names of the runs with changed input files, may be
+            empty.
+        '''
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        for wd, mask, name in self._read_events():
+            if mask & IN_Q_OVERFLOW:
+                # Events have been lost, every run may have changed.
+                changed.update(list_runs(self.root))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or name.startswith('.'):
+                continue
+
+            run, input_dir = self.watches[wd]
+            is_dir = bool(mask & IN_ISDIR)
+            if run is None:
+                if is_dir:
+                    self._add_run(name)
+                    changed.add(name)
+            elif input_dir is None:
+                if is_dir and name in manifest.input_dirs:
+                    self._add_input_dir(run, name)
+                    changed.add(run)
+            elif not is_dir:
+                changed.add(run)
+
+        return changed
+
+
+class PollWatcher(object):
+    '''
+    Compares the size and modification time of the input files in regular
+    intervals.
+    '''
+
+    def __init__(self, root, interval):
+        self.root = root
+        self.interval = interval
+        self.snapshot = self._snapshot()
+
+    def _snapshot(self):
+        snapshot = {}
+        for run in list_runs(self.root):
+            for input_dir in manifest.input_dirs:
+                try:
+                    entries = os.scandir(os.path.join(self.root, run, input_dir))
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+                with entries:
+                    for entry in entries:
+                        if entry.is_file() and not entry.name.startswith('.'):
+                            st = entry.stat()
+                            snapshot[(run, input_dir, entry.name)] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def changes(self, timeout):
+        '''
+        Same as ``InotifyWatcher.changes``.
+        '''
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        snapshot = self._snapshot()
+        changed = set(key[0] for key in set(snapshot).symmetric_difference(self.snapshot))
+        changed.update(key[0] for key, stat in snapshot.items() if self.snapshot.get(key, stat) != stat)
+        self.snapshot = snapshot
+        return changed
+
+
+def make_watcher(root, poll, interval):
+    if _libc is None or poll:
+        return PollWatcher(root, interval)
+    try:
+        return InotifyWatcher(root)
+    except OSError as e:
+        print('Cannot use inotify ({}), polling every {} s instead.'.format(e, interval))
+        return PollWatcher(root, interval)
+
+
+def run_doit(root, runs, workers):
+    '''
+    Runs doit for the given runs, for all runs if ``runs`` is ``None``.
+
+    :return: Exit code of doit.
+    '''
+    command = [sys.executable, '-m', 'doit',
+               '-f', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dodo.py'),
+               '--dir', root, '-n', str(workers)]
+    if runs is not None:
+        command.append('runs=' + ','.join(runs))
+
+    print(time.strftime('%Y-%m-%d %H:%M:%S'), 'Updating', 'all runs' if runs is None else ', '.join(runs))
+    sys.stdout.flush()
+    returncode = subprocess.call(command)
+    if returncode != 0:
+        print('doit failed with exit code {}.'.format(returncode))
+    return returncode
+
+
+def watch(watcher, update, debounce, max_delay):
+    '''
+    Collects the changed runs until nothing has changed for ``debounce``
+    seconds, but not longer than ``max_delay`` seconds after the first change,
+    and then calls ``update`` with the sorted list of runs.
+    '''
+    pending = set()
+    first = last = None
+
+    while True:
+        if len(pending) == 0:
+            timeout = None
+        else:
+            timeout = max(0, min(last + debounce, first + max_delay) - time.monotonic())
+
+        changed = watcher.changes(timeout)
+        now = time.monotonic()
+        if len(changed) > 0:
+            pending.update(changed)
+            last = now
+            if first is None:
+                first = now
+
+        if len(pending) > 0 and (now >= last + debounce or now >= first + max_delay):
+            update(sorted(pending))
+            pending = set()
+            first = last = None
+
+
+def main():
+    options = _parse_args()
+
+    root = os.path.abspath(options.root)
+    watcher = make_watcher(root, options.poll, options.interval)
+    print('Watching {} with {}.'.format(root, type(watcher).__name__))
+
+    if not options.no_initial:
+        run_doit(root, None, options.workers)
+
+    try:
+        watch(watcher, lambda runs: run_doit(root, runs, options.workers), options.debounce, options.max_delay)
+    except KeyboardInterrupt:
+        pass
+
+
+def _parse_args():
+    '''
+    Parses the command line arguments.
+
+    :return: Namespace with arguments.
+    :rtype: Namespace
+    '''
+    parser = argparse.ArgumentParser(description='Watch a tree of runs and update the extracts of the runs with new or grown input files.')
+    parser.add_argument('root', nargs='?', default='.', help='Directory that contains the runs. Default: %(default)s')
+    parser.add_argument('--debounce', type=float, default=5, help='Seconds without changes before doit is started. Default: %(default)s')
+    parser.add_argument('--max-delay', type=float, default=60, help='Start doit at the latest this many seconds after the first change, even if files are still written. Default: %(default)s')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of parallel doit processes. Default: %(default)s')
+    parser.add_argument('--poll', action='store_true', help='Poll the files even if inotify is available.')
+    parser.add_argument('--interval', type=float, default=10, help='Seconds between two polls. Default: %(default)s')
+    parser.add_argument('--no-initial', action='store_true', help='Do not update all runs at the start.')
+    options = parser.parse_args()
+
+    return options
+
+
+if __name__ == '__main__':
+    main()
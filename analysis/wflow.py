@@ -8,13 +8,16 @@ import os
 import re
 
 from lxml import etree
-import matplotlib.pyplot as pl
 import numpy as np
-import scipy.interpolate
-import scipy.optimize
 
+from lazy import lazy_import
+import observables
+import profiling
 import util
 
+pl = lazy_import('matplotlib.pyplot')
+scipy = lazy_import('scipy')
+
 
 mev_fm = 197.3269788
 'http://physics.nist.gov/cgi-bin/cuu/Value?hbcmevf'
@@ -25,12 +28,14 @@ w0_cont_fm = 0.1755
 w0_cont_mev = mev_fm / w0_cont_fm
 
 
+@profiling.profiled
 def io_compute_intersection(path_in, path_out):
     root = find_root(path_in)
     result = np.sqrt(root)
     np.savetxt(path_out, [result])
 
 
+@profiling.profiled
 def io_convert_xml_to_tsv(path_in, path_out):
     tree = etree.parse(path_in)
 
@@ -44,6 +49,7 @@ def io_convert_xml_to_tsv(path_in, path_out):
     np.savetxt(path_out, np.column_stack([t, e]))
 
 
+@profiling.profiled
 def io_compute_t2_e(path_in, path_out):
     t, e = util.load_columns(path_in)
     np.savetxt(path_out, np.column_stack([t, t**2 * e]))
@@ -71,6 +77,7 @@ def derive_w(t, e, method='gradient'):
     return w
 
 
+@profiling.profiled
 def io_compute_w(path_in, path_out):
     t, e = util.load_columns(path_in)
     w = derive_w(t, e)
@@ -151,16 +158,14 @@ def merge_intersections(paths_in, path_out):
 
         data.append((update_no, intersection))
 
-    a = np.atleast_2d(np.array(data))
-    if a.shape[1] > 0:
-        a = util.sort_by_first_column(a)
-
-    np.savetxt(path_out, a)
+    observables.write(path_out, [update_no for update_no, intersection in data],
+                      [intersection for update_no, intersection in data])
 
 
+@profiling.profiled
 def io_w0_to_a(path_in, path_out):
-    update, w0_a = util.load_columns(path_in, 2)
+    update, w0_a = observables.read(path_in)
     a_fm = w0_cont_fm / w0_a
     a_mev = mev_fm / a_fm
-    np.savetxt(path_out, np.column_stack([update, a_mev]))
+    observables.write(path_out, update, a_mev)
     
@@ -0,0 +1,316 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Copyright © 2018 Martin Ueding <mu@martin-ueding.de>
+
+'''
+Decompression of gzip files that can be continued from restart points.
+
+This follows ``zran.c`` from the examples of zlib. While a file is
+decompressed, a restart point is taken at the end of a deflate block every
+``spacing`` bytes of output. A point consists of the offset in the compressed
+file, the number of bits of the previous byte that belong to the next block
+and the last 32 KiB of output, the dictionary that the next block may refer
+to. A raw inflate stream that is primed with these bits and the dictionary
+continues right there.
+
+The ``zlib`` module can neither stop at the end of a block nor prime a stream
+with bits, so ``libz`` is called through ``ctypes``. Without it no points are
+taken and the files are decompressed from the beginning with
+``zlib.decompressobj``.
+
+A file that ends before the end of the gzip stream, like the log of a job that
+is still running, is read as far as it can be decompressed and ``truncated``
+is set instead of raising an ``EOFError``.
+'''
+
+import base64
+import collections
+import ctypes
+import ctypes.util
+import io
+import zlib
+
+
+# Distance between the restart points in the decompressed stream.
+DEFAULT_SPACING = 4 * 1024**2
+
+WINDOW_SIZE = 32 * 1024
+READ_SIZE = 256 * 1024
+CHUNK_SIZE = 1024**2
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+RAW_WBITS = -zlib.MAX_WBITS
+
+Z_NO_FLUSH = 0
+Z_BLOCK = 5
+Z_OK = 0
+Z_STREAM_END = 1
+Z_BUF_ERROR = -5
+
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [
+        ('next_in', ctypes.c_void_p),
+        ('avail_in', ctypes.c_uint),
+        ('total_in', ctypes.c_ulong),
+        ('next_out', ctypes.c_void_p),
+        ('avail_out', ctypes.c_uint),
+        ('total_out', ctypes.c_ulong),
+        ('msg', ctypes.c_char_p),
+        ('state', ctypes.c_void_p),
+        ('zalloc', ctypes.c_void_p),
+        ('zfree', ctypes.c_void_p),
+        ('opaque', ctypes.c_void_p),
+        ('data_type', ctypes.c_int),
+        ('adler', ctypes.c_ulong),
+        ('reserved', ctypes.c_ulong),
+    ]
+
+
+try:
+    _libz = ctypes.CDLL(ctypes.util.find_library('z') or 'libz.so.1')
+    _libz.zlibVersion.restype = ctypes.c_char_p
+    _libz.inflateInit2_.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+    _libz.inflate.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int]
+    _libz.inflateEnd.argtypes = [ctypes.POINTER(_ZStream)]
+    _libz.inflatePrime.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_int, ctypes.c_int]
+    _libz.inflateSetDictionary.argtypes = [ctypes.POINTER(_ZStream), ctypes.c_char_p, ctypes.c_uint]
+except (OSError, AttributeError):
+    _libz = None
+
+
+Point = collections.namedtuple('Point', ['out_offset', 'in_offset', 'bits', 'window'])
+
+
+def point_to_json(point):
+    if point is None:
+        return None
+    return {
+        'out_offset': point.out_offset,
+        'in_offset': point.in_offset,
+        'bits': point.bits,
+        'window': base64.b64encode(point.window).decode('ascii'),
+    }
+
+
+def point_from_json(data):
+    if data is None:
+        return None
+    return Point(data['out_offset'], data['in_offset'], data['bits'], base64.b64decode(data['window']))
+
+
+class GzipReader(object):
+    '''
+    Reads the decompressed contents of a gzip file.
+
+    :param list points: Known restart points, ``seek`` starts from the last
+        one before the target.
+    :param int spacing: Bytes of output between the restart points that are
+        added to ``points`` while reading, ``None`` to take none.
+    '''
+
+    def __init__(self, path, points=(), spacing=DEFAULT_SPACING):
+        self.f = open(path, 'rb')
+        self.points = sorted(points, key=lambda point: point.out_offset)
+        self.spacing = spacing if _libz is not None else None
+        self.stream = None
+        self.out = ctypes.create_string_buffer(CHUNK_SIZE)
+        self._restart(None)
+
+    def _restart(self, point):
+        self._end_stream()
+
+        self.offset = 0 if point is None else point.out_offset
+        self.in_offset = 0 if point is None else point.in_offset
+        self.window = b'' if point is None else point.window
+        self.last_point = self.offset
+        self.input = b''
+        self.input_pos = 0
+        self.eof = False
+        self.truncated = False
+
+        if point is None:
+            self.f.seek(0)
+            self._start_stream(GZIP_WBITS)
+        else:
+            self.f.seek(point.in_offset - (1 if point.bits else 0))
+            self._start_stream(RAW_WBITS)
+            if point.bits:
+                byte = self.f.read(1)[0]
+                _libz.inflatePrime(ctypes.byref(self.stream), point.bits, byte >> (8 - point.bits))
+            _libz.inflateSetDictionary(ctypes.byref(self.stream), point.window, len(point.window))
+
+    def _start_stream(self, wbits):
+        self._end_stream()
+        self.raw = wbits == RAW_WBITS
+
+        if _libz is None:
+            self.decompressor = zlib.decompressobj(wbits)
+            return
+
+        self.stream = _ZStream()
+        ret = _libz.inflateInit2_(ctypes.byref(self.stream), wbits, _libz.zlibVersion(), ctypes.sizeof(_ZStream))
+        if ret != Z_OK:
+            self.stream = None
+            raise zlib.error('inflateInit2 failed with {}'.format(ret))
+
+    def _end_stream(self):
+        if self.stream is not None:
+            _libz.inflateEnd(ctypes.byref(self.stream))
+            self.stream = None
+
+    def _feed(self):
+        '''
+        Reads more compressed input if everything has been consumed.
+
+        :return: Whether there is input left.
+        '''
+        if self.input_pos == len(self.input):
+            self.input = self.f.read(READ_SIZE)
+            self.input_pos = 0
+        return self.input_pos < len(self.input)
+
+    def _consume(self, count):
+        self.input_pos += count
+        self.in_offset += count
+
+    def _inflate(self, size):
+        '''
+        :return: Tuple ``(ret, chunk, bits)``, ``bits`` is ``None`` unless
+            the chunk ends at the end of a deflate block.
+        '''
+        if _libz is None:
+            data = self.input[self.input_pos:]
+            chunk = self.decompressor.decompress(data, size)
+            # At the end of the stream the rest of the input is in both.
+            if self.decompressor.eof:
+                self._consume(len(data) - len(self.decompressor.unused_data))
+                return Z_STREAM_END, chunk, None
+            self._consume(len(data) - len(self.decompressor.unconsumed_tail))
+            return Z_OK, chunk, None
+
+        due = self.spacing is not None and self.offset - self.last_point >= self.spacing
+        stream = self.stream
+        available = len(self.input) - self.input_pos
+        stream.next_in = ctypes.cast(ctypes.c_char_p(self.input), ctypes.c_void_p).value + self.input_pos
+        stream.avail_in = available
+        stream.next_out = ctypes.addressof(self.out)
+        stream.avail_out = size
+
+        ret = _libz.inflate(ctypes.byref(stream), Z_BLOCK if due else Z_NO_FLUSH)
+        if ret not in (Z_OK, Z_STREAM_END, Z_BUF_ERROR):
+            raise zlib.error('Error {} while decompressing {}: {}'.format(ret, self.f.name, stream.msg))
+
+        self._consume(available - stream.avail_in)
+        chunk = ctypes.string_at(self.out, size - stream.avail_out)
+
+        # Bit 7 is set at the end of a block, bit 6 after the last block.
+        bits = None
+        if due and stream.data_type & 128 and not stream.data_type & 64:
+            bits = stream.data_type & 7
+        return ret, chunk, bits
+
+    def _next_member(self):
+        '''
+        Skips the trailer of a raw stream and starts the next gzip member if
+        there is one.
+        '''
+        if self.raw:
+            trailer = 8
+            while trailer > 0 and self._feed():
+                count = min(trailer, len(self.input) - self.input_pos)
+                self._consume(count)
+                trailer -= count
+            self.truncated = trailer > 0
+
+        if self._feed():
+            self._start_stream(GZIP_WBITS)
+        else:
+            self.eof = True
+
+    def _read_chunk(self, size):
+        '''
+        :return: Up to ``size`` bytes, ``b''`` at the end of the data.
+        '''
+        while not self.eof:
+            has_input = self._feed()
+            ret, chunk, bits = self._inflate(size)
+
+            if ret == Z_STREAM_END:
+                self._next_member()
+            elif not chunk and not has_input:
+                # The file ends within the stream.
+                self.eof = self.truncated = True
+
+            if chunk:
+                self.offset += len(chunk)
+                self.window = (self.window + chunk)[-WINDOW_SIZE:] if len(chunk) < WINDOW_SIZE else chunk[-WINDOW_SIZE:]
+                if bits is not None:
+                    self._add_point(bits)
+                return chunk
+
+        return b''
+
+    def _add_point(self, bits):
+        self.last_point = self.offset
+        if len(self.points) == 0 or self.points[-1].out_offset < self.offset:
+            self.points.append(Point(self.offset, self.in_offset, bits, self.window))
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            chunk = self._read_chunk(CHUNK_SIZE if size < 0 else min(size, CHUNK_SIZE))
+            if not chunk:
+                break
+            parts.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(parts)
+
+    def seek(self, offset):
+        '''
+        Moves to an offset in the decompressed stream. Decompression restarts
+        at the last restart point before it if that saves work.
+        '''
+        point = None
+        if _libz is not None:
+            for candidate in self.points:
+                if candidate.out_offset > offset:
+                    break
+                point = candidate
+
+        if offset < self.offset or (point is not None and point.out_offset > self.offset):
+            self._restart(point)
+
+        while self.offset < offset:
+            if not self._read_chunk(min(offset - self.offset, CHUNK_SIZE)):
+                break
+
+        return self.offset
+
+    def tell(self):
+        return self.offset
+
+    def __iter__(self):
+        rest = b''
+        while True:
+            chunk = self.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data = rest + chunk
+            cut = data.rfind(b'\n') + 1
+            rest = data[cut:]
+            yield from io.BytesIO(data[:cut])
+        if rest:
+            yield rest
+
+    def close(self):
+        self._end_stream()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
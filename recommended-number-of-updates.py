@@ -11,13 +11,15 @@ import re
 def main():
     options = _parse_args()
 
-    pattern_update = re.compile(r'Doing Update: (\d+) warm_up_p = \d+')
-    pattern_total_time = re.compile(r'HMC: total time = ([\d.]+) secs')
+    # The patterns are matched on the raw bytes of the lines, only the
+    # captured numbers are converted.
+    pattern_update = re.compile(rb'Doing Update: (\d+) warm_up_p = \d+')
+    pattern_total_time = re.compile(rb'HMC: total time = ([\d.]+) secs')
 
     updates = []
     total_time = None
 
-    with open(options.logfile) as f:
+    with open(options.logfile, 'rb') as f:
         for line in f:
             m = pattern_update.match(line)
             if m:
@@ -8,6 +8,11 @@
 #SBATCH --cpus-per-task=24
 #SBATCH --mail-type=ALL
 #SBATCH --mail-user=ueding@hiskp.uni-bonn.de
+#SBATCH --signal=B:USR1@600
+
+# Reduction of the logs at the end of the job, see the analysis directory. It
+# can be set with `sbatch --export=ALL,HMC_EPILOGUE=/path/to/epilogue.py`.
+epilogue=${HMC_EPILOGUE:-$HOME/Sources/chroma-auxiliary-scripts/analysis/epilogue.py}
 
 module load Intel
 module load IntelMPI
@@ -24,5 +29,45 @@ input=${last_restart:-hmc.ini.xml}
 export OMP_NUM_THREADS=${SLURM_CPUS_PER_TASK}
 export KMP_AFFINITY=scatter,0
 
+# The raw logs are written to the local scratch of this node, where the first
+# task runs, and not to the shared file system. Only the compressed logs and
+# the shards end up in `hmc-out` of this run. The restart files stay here.
+run_dir=$PWD
+scratch=${SLURM_TMPDIR:-/tmp}/hmc-${SLURM_JOB_ID}
+
+# Find out now and not after hours of compute if the epilogue cannot run.
+if ! python3 $epilogue --help > /dev/null; then
+    echo "The epilogue $epilogue cannot be run, not starting hmc." >&2
+    exit 1
+fi
+
+mkdir -p $scratch
+
 # Start the Hybrid Monte Carlo simulation.
-srun ./hmc -i $input -o slurm-${SLURM_JOB_ID}.out.xml -l slurm-${SLURM_JOB_ID}.log.xml -by 8 -bz 8 -c 24 -sy 1 -sz 1 -pxy 1 -pxyz 0 -minct 2
+srun ./hmc -i $input -o $scratch/slurm-${SLURM_JOB_ID}.out.xml -l $scratch/slurm-${SLURM_JOB_ID}.log.xml -by 8 -bz 8 -c 24 -sy 1 -sz 1 -pxy 1 -pxyz 0 -minct 2 > $scratch/slurm-${SLURM_JOB_ID}.out.txt &
+hmc_pid=$!
+
+# The logs on the scratch disk are lost if the job hits the time limit, so hmc
+# is stopped ten minutes before it. `wait` returns when the signal arrives,
+# the second one waits until hmc has actually exited.
+trap 'kill $hmc_pid' USR1
+wait $hmc_pid
+wait $hmc_pid
+
+# While the allocation is still alive, compress the logs into `hmc-out` and
+# let the extractors of the analysis write their small shards next to them.
+# The raw logs are removed afterwards.
+if ! python3 $epilogue --dest $run_dir/hmc-out -j 3 \
+    $scratch/slurm-${SLURM_JOB_ID}.out.txt $scratch/slurm-${SLURM_JOB_ID}.out.xml $scratch/slurm-${SLURM_JOB_ID}.log.xml
+then
+    # The scratch directory is wiped at the end of the job, so the raw logs
+    # that have not been reduced are moved to `hmc-out` as they are. The
+    # epilogue can be run on them there later.
+    echo "The epilogue failed, moving the remaining raw logs to $run_dir/hmc-out." >&2
+    mkdir -p $run_dir/hmc-out
+    if [[ -n $(ls -A $scratch) ]] && ! mv $scratch/* $run_dir/hmc-out/; then
+        echo "Moving the raw logs failed, they are left in $scratch." >&2
+        exit 1
+    fi
+fi
+rmdir $scratch